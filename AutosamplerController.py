@@ -1,10 +1,16 @@
-import re
-import json
+import time
 import serial
 import asyncio
 import logging
 from datetime import datetime
-from multiprocessing import Lock, Manager
+from multiprocessing import Lock
+
+from SerialTransport import open_serial_connection
+from ResponseRouter import ResponseRouter
+from SharedStatusTable import AutosamplerStatusTable
+from Handshake import Handshake
+from PollingScheduler import PollingScheduler, AUTOSAMPLER_POLLING, BUSY_RETRY
+import ResponseParser
 
 
 class AutosamplerController:
@@ -14,64 +20,124 @@ class AutosamplerController:
         port_name: str,
         serial_timeout: int,
         lock: Lock,
-        manager: Manager,
         logger: logging.Logger,
     ):
-        self.serial_port = serial.Serial()  # Init the serial port but don't open it yet
-        self.serial_port.port = port_name
+        # Init the serial port but don't open it yet, port_name may also be a pyserial url (socket://)
+        self.serial_port = serial.serial_for_url(port_name, do_not_open=True)
         self.serial_port.baudrate = 115200
-        self.serial_port.timeout = None
-        self.lock = lock  # Lock to ensure safe access to shared dictionary
+        self.serial_timeout = serial_timeout  # seconds to wait for a reply
+        # asyncio stream pair created on connect, reads never block the event loop
+        self.reader = None
+        self.writer = None
+        self.router = None  # pairs replies with the commands waiting for them
+        self.handshake_report = None  # stage timings of the last connect handshake
+        # when to refresh the status and slots, driven by poll_status
+        self.polling = PollingScheduler(AUTOSAMPLER_POLLING)
+        self.lock = lock  # Lock to ensure safe access to the status
         self.logger = logger
 
-        # Shared dictionary to store the status
-        self.status = manager.dict(
-            {
-                "serial_port": self.serial_port.name,
-                "controller_id": controller_id,
-                "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "connected": False,
-                "slots": [],
-                "slots_configuration": {},
-                "position": None,
-                "direction": None,
-                "rtc_time": -1,
-            }
-        )
-
+        # Dictionary to store the status, copied to the shared status table after every update
+        self.status = {
+            "serial_port": self.serial_port.name,
+            "controller_id": controller_id,
+            "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "connected": False,
+            "slots": [],
+            "slots_configuration": {},
+            "position": None,
+            "direction": None,
+            "rtc_time": -1,
+        }
+        # other processes attach to it with AutosamplerStatusTable(status_table.name)
+        self.status_table = AutosamplerStatusTable()
+        self.status_table.publish(self.status)
+        self.status_version = 0  # bumped on every status update
+        # called with this controller after every status update
+        self.status_listener = None
         self.logger.info(f"Autosampler controller {controller_id} created.")
 
-    def __is_connected(self) -> bool:
-        return self.serial_port is not None and self.serial_port.is_open
+    def is_connected(self) -> bool:
+        return self.writer is not None and not self.writer.is_closing()
+
+    def status_changed(self) -> None:
+        with self.lock:
+            self.status_table.publish(self.status)
+        self.status_version += 1
+        if self.status_listener:
+            self.status_listener(self)
+
+    def snapshot_status(self) -> dict:
+        """Return a consistent copy of the status from the shared status table."""
+        return self.status_table.snapshot()
 
     async def connect(self) -> str:
         """Connect to the serial port asynchronously."""
-        if self.__is_connected():
+        if self.is_connected():
             await self.disconnect()
         try:
             self.serial_port.open()
             self.serial_port.reset_input_buffer()
             self.serial_port.reset_output_buffer()
+            self.reader, self.writer = await open_serial_connection(self.serial_port)
+            self.router = ResponseRouter(
+                self.reader,
+                self.logger,
+                device_name="Autosampler",
+                unsolicited_callback=self.handle_unsolicited,
+                disconnect_callback=self.disconnect,
+            )
+            self.router.start()
+            handshake = Handshake(self.serial_port.name)
 
             # Identify Pico type
-            self.serial_port.write("0:ping\n".encode())
-            response = self.serial_port.readline().decode("utf-8").strip()
-            if "Pico Autosampler Control Version" not in response:
+            started = time.perf_counter()
+            response = await self.request(
+                "0:ping",
+                "Control Version",
+                handshake.remaining(handshake.stage_deadline(started)),
+            )
+            if not handshake.record(
+                "ping",
+                started,
+                bool(response) and "Pico Autosampler Control Version" in response,
+                detail=response or "",
+            ):
                 await self.disconnect()  # Wrong device
                 return "Error: Connected to the wrong device."
 
-            # Synchronize the time with PC
+            # Synchronize the time with PC and query time, slots and status, all in flight at
+            # once, the router pairs the replies
             now = datetime.now()
             sync_command = f"0:stime:{now.year}:{now.month}:{now.day}:{now.hour}:{now.minute}:{now.second}"
-            self.serial_port.write(f"{sync_command}\n".encode())
-            response = self.serial_port.readline().decode("utf-8").strip()
+            started = time.perf_counter()
+            timeout = handshake.remaining(handshake.stage_deadline(started))
+            configure, *queries = await asyncio.gather(
+                self.timed_request(sync_command, "Success", timeout),
+                self.timed_request("time", "RTC Time", timeout),
+                self.timed_request("config", "Autosampler Configuration", timeout),
+                self.timed_request("status", "Autosampler Status", timeout),
+            )
+            for (_, response), parse in zip(
+                queries, (self.parse_rtc_time, self.parse_config, self.parse_status)
+            ):
+                if response:
+                    await parse(response)
+            handshake.record("configure", started, bool(configure[1]), configure[0])
+            handshake.record(
+                "query",
+                started,
+                all(response for _, response in queries),
+                max(arrived for arrived, _ in queries),
+            )
 
-            await self.query_rtc_time()  # Query time
-            await self.query_config()  # Query slots information
-            await self.query_status()  # Query autosampler status
             # Safely update the shared status dictionary
             with self.lock:
                 self.status.update({"connected": True})
+            self.status_changed()
+            self.handshake_report = handshake.report()
+            self.logger.info(handshake.summary())
+            # the handshake just read the status, start polling at the fastest cadence
+            self.polling.reset()
             self.logger.info(f"Connected to {self.serial_port.name}")
             return f"Success: Connected to {self.serial_port.name}"
         except Exception as e:
@@ -82,8 +148,8 @@ class AutosamplerController:
     async def disconnect(self) -> str:
         """Disconnect from the serial port asynchronously."""
         try:
-            if self.__is_connected():
-                self.serial_port.close()  # close the serial port
+            if self.writer is not None:
+                await self.close_connection()  # close the serial port
                 self.logger.info(f"Disconnected from {self.serial_port.name}")
                 # Reset the status dictionary
                 with self.lock:
@@ -97,15 +163,30 @@ class AutosamplerController:
                             "rtc_time": -1,
                         }
                     )
+                self.status_changed()
                 return f"Success: Disconnected from {self.serial_port.name}"
         except Exception as e:
             self.logger.error(f"Failed to disconnect from {self.serial_port.name}: {e}")
             return f"Error: Failed to disconnect from {self.serial_port.name}: {e}"
 
+    async def close_connection(self) -> None:
+        """Close the stream pair, the transport closes the serial port once pending data is written."""
+        writer, router = self.writer, self.router
+        self.reader, self.writer, self.router = None, None, None
+        if router is not None:
+            await router.stop()
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception as e:
+            # the transport already reported the error that closed it
+            self.logger.debug(f"Serial transport closed with error: {e}")
+
     async def send_command(self, command: str) -> str:
         """Send command asynchronously."""
         try:
-            self.serial_port.write(f"{command.strip()}\n".encode())
+            self.writer.write(f"{command.strip()}\n".encode())
+            await self.writer.drain()
             if "time" not in command:
                 self.logger.debug(f"PC -> Pico: {command}")
             return f"Success: Command sent: {command}"
@@ -124,56 +205,59 @@ class AutosamplerController:
             self.logger.error(f"Error: Failed to send command: {e}")
             return f"Error: Failed to send command: {e}"
 
-    async def read_serial(self, keyword: str = None) -> str:
-        """Read serial data asynchronously, check if specific keyword is in the response."""
-        response = None
-        try:
-            # read the serial port, will block until a response is received
-            response = self.serial_port.readline().decode("utf-8").strip()
-            if "RTC Time" not in response:  # don't log the RTC time sync response
-                self.logger.debug(f"Autosampler -> PC: {response}")
-            if "Error" in response:
-                self.logger.error(f"{response}")
-                response = None
-            # check if the keyword is in the response
-            if keyword and response and keyword not in response:
-                self.logger.warning(
-                    f"Expected keyword '{keyword}' not found in response '{response}'"
-                )
-                response = None
-        except serial.SerialException as e:
-            await self.disconnect()
-            self.logger.error(
-                f"Error: SerialException from {self.serial_port.name}: {e}"
-            )
-        except serial.SerialTimeoutException as e:
-            await self.disconnect()
-            self.logger.error(f"Timeout error: {e}")
-        except Exception as e:
-            await self.disconnect()
-            self.logger.error(f"Error: {e}")
-        finally:
-            return response
+    async def request(self, command: str, keyword: str, timeout: float = None) -> str:
+        """Send a command and wait for the reply containing keyword, other commands may be in flight."""
+        # register before writing so the reply can't be missed
+        future = self.router.expect(keyword)
+        result = await self.send_command(command)
+        if not result.startswith("Success"):
+            self.router.discard(future)
+            return None
+        return await self.router.wait(
+            future, self.serial_timeout if timeout is None else timeout
+        )
+
+    async def timed_request(self, command: str, keyword: str, timeout: float) -> tuple:
+        """Like request, returns (time the reply arrived or the wait ended, reply)."""
+        response = await self.request(command, keyword, timeout)
+        return time.perf_counter(), response
 
     async def run_command_and_read(self, command: str, keyword: str, callback):
-        """Run send_command and read_serial concurrently using TaskGroup."""
+        """Send a command and pass its reply to callback once the router resolves it."""
         try:
-            if self.__is_connected():
-                async with asyncio.TaskGroup() as tg:
-                    # Add send_command task to the group
-                    send_task = tg.create_task(self.send_command(command))
-                    # Add read_serial task to the group
-                    read_task = tg.create_task(self.read_serial(keyword))
-                response = read_task.result()
+            if self.is_connected():
+                response = await self.request(command, keyword)
                 if response:
                     await callback(response)
+                    self.status_changed()
             else:
                 with self.lock:
                     self.status["connected"] = False
+                self.status_changed()
                 self.logger.error("Not connected to the serial port.")
         except Exception as e:
             self.logger.error(f"Error in run_command_and_read: {e}")
 
+    async def handle_unsolicited(self, response: str) -> None:
+        """Keep the status up to date from replies no command was waiting for."""
+        kind, _ = ResponseParser.AUTOSAMPLER_RESPONSES.parse(response)
+        if kind == "rtc_time":
+            await self.parse_rtc_time(response)
+        elif kind == "config":
+            await self.parse_config(response)
+        elif kind == "status":
+            await self.parse_status(response)
+        elif kind == "moved" and "moved to position" in response:
+            await self.parse_goto_position(response)
+        elif kind == "moved" and "moved to slot" in response:
+            await self.parse_goto_slot(response)
+        elif kind == "success" and "Moved one step" in response:
+            await self.parse_move_one_step(response)
+        else:
+            self.logger.debug(f"Unsolicited response ignored: {response}")
+            return
+        self.status_changed()
+
     async def query_rtc_time(self) -> None:
         """Query the RTC time asynchronously."""
         await self.run_command_and_read("time", "RTC Time", self.parse_rtc_time)
@@ -181,13 +265,10 @@ class AutosamplerController:
     async def parse_rtc_time(self, response: str) -> None:
         """Parse the RTC time from the response."""
         try:
-            match = re.search(r"RTC Time: (\d+-\d+-\d+ \d+:\d+:\d+)", response)
-            if match:
-                rtc_time = match.group(1)
+            rtc_time = ResponseParser.parse_rtc_time(response)
+            if rtc_time:
                 with self.lock:
-                    self.status["rtc_time"] = datetime.strptime(
-                        rtc_time, "%Y-%m-%d %H:%M:%S"
-                    ).timestamp()
+                    self.status["rtc_time"] = rtc_time.timestamp()
             else:
                 self.logger.error(f"Failed to parse RTC time from response: {response}")
         except Exception as e:
@@ -195,6 +276,7 @@ class AutosamplerController:
 
     async def query_config(self) -> None:
         """Query the slots configuration asynchronously."""
+        self.polling.sent("config")
         await self.run_command_and_read(
             "config", "Autosampler Configuration", self.parse_config
         )
@@ -202,8 +284,15 @@ class AutosamplerController:
     async def parse_config(self, response: str) -> None:
         """Parse slots configuration from the Pico."""
         try:
-            config_str = response.replace("Autosampler Configuration:", "").strip()
-            autosampler_config = json.loads(config_str)
+            autosampler_config = ResponseParser.parse_autosampler_config(response)
+            if autosampler_config is None:
+                self.logger.error(f"Error decoding configuration: {response}")
+                return
+            self.polling.result(
+                "config",
+                autosampler_config != self.status["slots_configuration"],
+                len(response) + 1,
+            )
             with self.lock:
                 self.status["slots_configuration"] = autosampler_config
                 self.status["slots"] = sorted(
@@ -214,13 +303,12 @@ class AutosamplerController:
                     ),
                 )
                 self.logger.info(f"Slots populated: {self.status['slots']}")
-        except json.JSONDecodeError as e:
-            self.logger.error(f"Error decoding configuration: {e}")
         except Exception as e:
             self.logger.error(f"Error updating slots configuration: {e}")
 
     async def query_status(self) -> None:
         """Query the autosampler status asynchronously."""
+        self.polling.sent("status")
         await self.run_command_and_read(
             "status", "Autosampler Status", self.parse_status
         )
@@ -228,23 +316,40 @@ class AutosamplerController:
     async def parse_status(self, response: str) -> None:
         """Parse autosampler status, including position and direction."""
         try:
-            match = re.search(r"position: (\d+), direction: (Left|Right)", response)
-            if match:
+            status = ResponseParser.parse_autosampler_status(response)
+            if status:
+                position, direction = status
+                self.polling.result(
+                    "status",
+                    status != (self.status["position"], self.status["direction"]),
+                    len(response) + 1,
+                )
                 with self.lock:
-                    self.status.update(
-                        {
-                            "position": int(match.group(1)),
-                            "direction": match.group(2),
-                        }
-                    )
+                    self.status.update({"position": position, "direction": direction})
             else:
                 self.logger.error(f"Invalid status response: {response}")
         except Exception as e:
             self.logger.error(f"Error parsing status: {e}")
 
+    async def poll_status(self) -> None:
+        """Send the status and slot queries the polling scheduler asks for until disconnected.
+
+        A poll waits while another command is still waiting for its reply.
+        """
+        queries = {"status": self.query_status, "config": self.query_config}
+        while self.is_connected():
+            await asyncio.sleep(self.polling.next_due_in())
+            if not self.is_connected():
+                break
+            if self.router.pending:
+                await asyncio.sleep(BUSY_RETRY)
+                continue
+            for query in self.polling.due():
+                await queries[query]()
+
     async def goto_position(self, position: str) -> None:
         """Go to a specific position and update status."""
-        if self.__is_connected():
+        if self.is_connected():
             try:
                 if position.isdigit():
                     await self.run_command_and_read(
@@ -261,13 +366,9 @@ class AutosamplerController:
     async def parse_goto_position(self, response: str) -> None:
         """Parse the response from the goto_position command and update status."""
         try:
-            match = re.search(
-                r"moved to position (\d+) in (\S+) seconds. relative position: (\d+)",
-                response,
-            )
-            if match:
-                position = int(match.group(1))
-                relative_position = int(match.group(3))
+            moved = ResponseParser.parse_goto_position(response)
+            if moved:
+                position, _, relative_position = moved
                 with self.lock:
                     self.status["position"] = position
                 self.logger.info(
@@ -280,7 +381,7 @@ class AutosamplerController:
 
     async def goto_slot(self, slot: str) -> None:
         """Go to a specific slot asynchronously and update status."""
-        if self.__is_connected():
+        if self.is_connected():
             try:
                 await self.run_command_and_read(
                     f"slot:{slot}",
@@ -294,12 +395,8 @@ class AutosamplerController:
     async def parse_goto_slot(self, response: str) -> None:
         """Parse the response from the goto_slot command and update status."""
         try:
-            match = re.search(
-                r"moved to slot (\S+)",
-                response,
-            )
-            if match:
-                slot = str(match.group(1))
+            slot = ResponseParser.parse_goto_slot(response)
+            if slot:
                 with self.lock:
                     position = self.status["slots_configuration"].get(slot, -1)
                     self.status["position"] = position
@@ -374,12 +471,7 @@ class AutosamplerController:
     async def parse_move_one_step(self, response: str) -> None:
         """Parse the response after moving one step."""
         try:
-            # format Success: Moved one step Left, current position: 701
-            match = re.search(
-                r"Moved one step (\S+), current position: (\d+)", response
-            )
-            direction = match.group(1)
-            position = int(match.group(2))
+            direction, position = ResponseParser.parse_move_one_step(response)
             with self.lock:
                 self.status["position"] = position
                 self.status["direction"] = direction
@@ -1,8 +1,10 @@
+import sys
 import asyncio
 import serial.tools.list_ports
-from multiprocessing import Manager, Lock
+from multiprocessing import Lock
 import logging
 from AutosamplerController import AutosamplerController
+from PicoSimulator import PicoSimulator, VirtualAutosamplerPico
 
 # Define Pi Pico vendor ID
 pico_vid = 0x2E8A
@@ -49,17 +51,23 @@ async def main():
     # Set up logging
     logger = setup_logging()
 
-    # List available Pi Pico COM ports
-    pico_ports = list_pico_ports()
+    # List available Pi Pico COM ports, or run with --simulate to use a virtual Pico
+    if "--simulate" in sys.argv:
+        simulator = PicoSimulator(VirtualAutosamplerPico())
+        pico_ports = [simulator.start()]
+        com_port = pico_ports[0]
+        print(f"Using simulated autosampler on {com_port}")
+    else:
+        pico_ports = list_pico_ports()
 
-    if not pico_ports:
-        print("No Pi Pico devices available. Exiting.")
-        return
+        if not pico_ports:
+            print("No Pi Pico devices available. Exiting.")
+            return
 
-    # Prompt the user to select a COM port
-    com_port = input(
-        f"Enter the COM port for the Autosampler (available: {', '.join(pico_ports)}): "
-    )
+        # Prompt the user to select a COM port
+        com_port = input(
+            f"Enter the COM port for the Autosampler (available: {', '.join(pico_ports)}): "
+        )
 
     if com_port not in pico_ports:
         print(
@@ -67,8 +75,7 @@ async def main():
         )
         return
 
-    # Initialize the manager and lock
-    manager = Manager()
+    # Initialize the lock
     lock = Lock()
 
     # Create the AutosamplerController object with the specified COM port, logger, and a timeout of 1 second
@@ -77,13 +84,11 @@ async def main():
         port_name=com_port,
         serial_timeout=1,
         lock=lock,
-        manager=manager,
         logger=logger,  # Pass the logger to the controller
     )
 
     # Show available commands with numbers
-    print(
-        """
+    print("""
     Available commands:
     1. Connect to the autosampler.
     2. Disconnect from the autosampler.
@@ -98,8 +103,7 @@ async def main():
     11. Save the configuration.
     12. Print the status dictionary.
     13. Exit the program.
-    """
-    )
+    """)
 
     while True:
         try:
@@ -151,10 +155,10 @@ async def main():
                 await controller.save_config()
 
             elif command == "12":  # Print status dictionary
-                with controller.lock:
-                    print("Status Dictionary:")
-                    for key, value in controller.status.items():
-                        print(f"{key}: {value}")
+                # read back from the shared status table, like another process would
+                print("Status Dictionary:")
+                for key, value in controller.snapshot_status().items():
+                    print(f"{key}: {value}")
 
             elif command == "13":  # Exit
                 print("Exiting...")
@@ -1,6 +1,16 @@
-from flask import Flask, request, jsonify
-from threading import Thread, Lock
-import time
+from flask import Flask, Response, render_template, request, jsonify
+from threading import Lock
+import logging
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from PumpController import PumpController
+from AutosamplerController import AutosamplerController
+from ControllerWorker import PumpControllerWorker, AsyncControllerLoop
+from StatusBoard import StatusBoard
+from PortRegistry import get_port_registry
+from Recipe import load_recipe, format_rows
+import PicoDiscovery
 
 app = Flask(__name__)
 
@@ -9,12 +19,35 @@ controllers = {
     "pumps": {},  # Map of {port: PumpController object}
     "autosamplers": {},  # Map of {port: AutosamplerController object}
 }
-pump_status = {}  # Dictionary mapping global pump_id to status
-autosampler_status = {}  # Dictionary mapping global autosampler_id to status
+pump_status = {}  # Map of global pump_id to {"controller", "port", "local_id"}
+autosampler_status = {}  # Map of global autosampler_id to {"controller", "port"}
 global_pump_id_counter = 1  # Global counter for pump IDs
-
-# Thread lock for safe access to shared resources
-lock = Lock()
+autosampler_id_counter = 0  # Global counter for autosampler IDs
+# Map of {port: PumpControllerWorker}, one per connected pump controller
+pump_workers = {}
+async_loop = None  # event loop thread shared by the async autosampler controllers
+
+# Guards the maps above, only taken to register or remove controllers and to publish status,
+# never while waiting on a Pico
+registry_lock = Lock()
+# One lock per controller port, serializes commands and disconnects on that controller only
+controller_locks = {}
+# Latest copy of each controller's status, {port: status dict}
+controller_status = {}
+# The status served by /get_status, published by the writers and read without a lock
+status_board = StatusBoard()
+# seconds between heartbeat comments on an idle /events stream
+EVENTS_HEARTBEAT_INTERVAL = 15
+# milliseconds the browser waits before reconnecting a dropped /events stream
+EVENTS_RETRY = 3000
+# longest /get_status?wait= long poll in seconds
+MAX_STATUS_WAIT = 60
+# The loaded recipe as (version, DataFrame), replaced as a whole so readers need no lock
+current_recipe = None
+# most rows /recipe returns per request
+MAX_RECIPE_PAGE = 500
+# recipe formats accepted from uploads, pickles are never read from the network
+UPLOAD_FORMATS = (".csv", ".xlsx", ".xls")
 
 
 # Function to assign a global pump ID and track it in pump_status
@@ -24,91 +57,269 @@ def register_pump(controller, pump_id_in_controller):
     global_pump_id = global_pump_id_counter
     pump_status[global_pump_id] = {
         "controller": controller,
+        "port": controller.serial_port.name,
         "local_id": pump_id_in_controller,
     }
     return global_pump_id
 
 
-# Function to process all commands for all controllers
-def process_controllers():
-    while True:
-        with lock:
-            for controller in list(controllers["pumps"].values()) + list(
-                controllers["autosamplers"].values()
-            ):
-                if controller.is_connected():
-                    controller.process_all_messages()
-        time.sleep(1)
+# Match the registered pumps with the ones the controller reports, caller holds registry_lock
+def sync_pump_ids(controller, pumps_info: dict) -> None:
+    registered = {
+        pump_info["local_id"]: pump_id
+        for pump_id, pump_info in pump_status.items()
+        if pump_info["controller"] is controller
+    }
+    for local_pump_id in pumps_info:
+        if local_pump_id not in registered:
+            register_pump(controller, local_pump_id)
+    for local_pump_id, pump_id in registered.items():
+        if local_pump_id not in pumps_info:
+            del pump_status[pump_id]
+
+
+# Build the JSON ready status from the copied controller status, caller holds registry_lock
+def build_status() -> dict:
+    pumps = {}
+    for pump_id, pump_info in pump_status.items():
+        status = controller_status.get(pump_info["port"], {})
+        pumps[pump_id] = {
+            "port": pump_info["port"],
+            "controller_id": status.get("controller_id"),
+            "local_id": pump_info["local_id"],
+            **status.get("pumps_info", {}).get(pump_info["local_id"], {}),
+        }
+    pump_controllers = {
+        port: {
+            "controller_id": status["controller_id"],
+            "connected": status["connected"],
+            "rtc_time": status["rtc_time"],
+        }
+        for port, status in controller_status.items()
+        if port in controllers["pumps"]
+    }
+    autosamplers = {
+        autosampler_id: {
+            "port": autosampler_info["port"],
+            **controller_status.get(autosampler_info["port"], {}),
+        }
+        for autosampler_id, autosampler_info in autosampler_status.items()
+    }
+    return {
+        "pump_status": pumps,
+        "pump_controllers": pump_controllers,
+        "autosampler_status": autosamplers,
+    }
 
 
-# Background thread to process commands
-background_thread = Thread(target=process_controllers, daemon=True)
-background_thread.start()
+# Status listener of every connected controller, runs on the thread that updated the status
+def publish_status(controller) -> None:
+    # copy outside registry_lock, the controller lock is only held for the copy
+    status = controller.snapshot_status()
+    port = controller.serial_port.name
+    with registry_lock:
+        if controllers["pumps"].get(port) is controller:
+            sync_pump_ids(controller, status["pumps_info"])
+        elif controllers["autosamplers"].get(port) is not controller:
+            return  # not registered yet or already removed
+        controller_status[port] = status
+        status_board.publish(build_status())
+
+
+# The async loop is only started once an autosampler connects
+def get_async_loop():
+    global async_loop
+    if async_loop is None:
+        async_loop = AsyncControllerLoop()
+    return async_loop
+
+
+# The web UI, served here with the /events, /load_recipe and /recipe endpoints it uses
+@app.route("/")
+def index():
+    return render_template("index.html")
+
+
+# Endpoint to list the Pico ports that are not connected yet
+@app.route("/get_ports", methods=["GET"])
+def get_ports():
+    connected = set(controllers["pumps"]) | set(controllers["autosamplers"])
+    ports = get_port_registry().get_ports(exclude=connected)
+    return jsonify(
+        {
+            "ports": [
+                {
+                    "port": port.device,
+                    "serial_number": port.serial_number,
+                    "description": port.description,
+                }
+                for port in ports
+            ]
+        }
+    )
 
 
-# Endpoint to connect to a PumpController
-@app.route("/connect_pump", methods=["POST"])
-def connect_pump():
-    data = request.get_json()
-    port = data.get("port")
+# Connect a PumpController and start its worker, returns (message, success)
+def connect_pump_controller(port: str) -> tuple:
     if port in controllers["pumps"]:
-        return jsonify(
-            {
-                "message": f"Pump controller at {port} is already connected",
-                "success": False,
-            }
-        )
+        return f"Pump controller at {port} is already connected", False
 
     controller_id = len(controllers["pumps"]) + 1
     controller = PumpController(controller_id, port, 1)
+    controller.status_listener = publish_status
 
     result = controller.connect()
 
     if result.title == "Success":
-        # Register the pumps and assign global IDs
-        for local_pump_id in controller.status["pumps_info"]:
-            global_pump_id = register_pump(controller, local_pump_id)
-            pump_status[global_pump_id]["status"] = controller.status["pumps_info"][
-                local_pump_id
-            ]
+        with registry_lock:
+            # Add controller to global port map
+            controllers["pumps"][port] = controller
+            controller_locks[port] = Lock()
+        # pumps are registered with global IDs from the status updates, the pump info reply
+        # may still be on its way
+        publish_status(controller)
+        # commands are written as soon as they are queued, replies handled as they arrive
+        pump_workers[port] = PumpControllerWorker(controller)
+        pump_workers[port].start()
+
+    return result.message, result.title == "Success"
+
+
+# Connect an AutosamplerController on the shared event loop, returns (message, success)
+def connect_autosampler_controller(port: str) -> tuple:
+    if port in controllers["autosamplers"]:
+        return f"Autosampler controller at {port} is already connected", False
+
+    controller_id = len(controllers["autosamplers"]) + 1
+    loop = get_async_loop()
+    controller = AutosamplerController(
+        controller_id, port, 1, Lock(), logging.getLogger("Autosampler")
+    )
+    controller.status_listener = publish_status
+
+    result = loop.run(controller.connect())
+    success = result.startswith("Success")
+
+    if success:
+        with registry_lock:
+            # Register the autosampler and assign a global ID
+            global autosampler_id_counter
+            autosampler_id_counter += 1
+            autosampler_status[autosampler_id_counter] = {
+                "controller": controller,
+                "port": port,
+            }
+            # Add controller to global port map
+            controllers["autosamplers"][port] = controller
+            controller_locks[port] = Lock()
+        # refresh the position and slots in the background until the autosampler disconnects
+        loop.submit(controller.poll_status())
+        publish_status(controller)
+    else:
+        controller.status_table.close()
 
-        # Add controller to global port map
-        controllers["pumps"][port] = controller
+    return result, success
 
-    return jsonify({"message": result.message, "success": result.title == "Success"})
+
+# Endpoint to connect to a PumpController
+@app.route("/connect_pump", methods=["POST"])
+def connect_pump():
+    data = request.get_json()
+    message, success = connect_pump_controller(data.get("port"))
+    return jsonify({"message": message, "success": success})
 
 
 # Endpoint to connect to an AutosamplerController
 @app.route("/connect_autosampler", methods=["POST"])
 def connect_autosampler():
     data = request.get_json()
-    port = data.get("port")
-    if port in controllers["autosamplers"]:
-        return jsonify(
-            {
-                "message": f"Autosampler controller at {port} is already connected",
-                "success": False,
-            }
-        )
-
-    controller_id = len(controllers["autosamplers"]) + 1
-    controller = AutosamplerController(controller_id, port, 1)
-
-    result = controller.connect()
-
-    if result.title == "Success":
-        # Register the autosampler and assign a global ID
-        global autosampler_id_counter
-        autosampler_id_counter += 1
-        autosampler_status[autosampler_id_counter] = {
-            "controller": controller,
-            "status": controller.status,
+    message, success = connect_autosampler_controller(data.get("port"))
+    return jsonify({"message": message, "success": success})
+
+
+# (port, serial number) of every Pico port that is not connected yet, plus extra port names
+# such as socket:// urls that are not USB devices
+def discovery_candidates(extra=()) -> list:
+    connected = set(controllers["pumps"]) | set(controllers["autosamplers"])
+    candidates = [
+        (port.device, port.serial_number)
+        for port in get_port_registry().get_ports(exclude=connected)
+    ]
+    known = {port for port, _ in candidates} | {sn for _, sn in candidates if sn}
+    candidates += [
+        (port, None) for port in extra if port not in known and port not in connected
+    ]
+    return candidates
+
+
+# Endpoint to ping every Pico port that is not connected yet at the same time and report what
+# answered, pump or autosampler controller. ?port= adds ports that are not USB devices.
+@app.route("/discover", methods=["GET"])
+def discover():
+    results = PicoDiscovery.discover(discovery_candidates(request.args.getlist("port")))
+    return jsonify({"controllers": [result._asdict() for result in results]})
+
+
+# Endpoint to save the connected controllers as the lab layout, by serial number
+@app.route("/save_layout", methods=["POST"])
+def save_layout():
+    serial_numbers = {
+        port.device: port.serial_number for port in get_port_registry().get_ports()
+    }
+    layout = {
+        group: [serial_numbers.get(port) or port for port in controllers[group]]
+        for group in ("pumps", "autosamplers")
+    }
+    try:
+        PicoDiscovery.save_layout(layout)
+    except OSError as e:
+        logging.error(f"Error: {e}")
+        return jsonify({"message": f"Error: {e}", "success": False})
+    return jsonify({"message": "Lab layout saved", "success": True, "layout": layout})
+
+
+# Endpoint to find the controllers of the saved lab layout and connect all of them at once
+@app.route("/connect_layout", methods=["POST"])
+def connect_layout():
+    layout = PicoDiscovery.load_layout()
+    # controllers saved without a serial number are remembered by their port
+    results = PicoDiscovery.discover(
+        discovery_candidates(layout["pumps"] + layout["autosamplers"])
+    )
+    matched = PicoDiscovery.match_layout(layout, results)
+    jobs = [(connect_pump_controller, port) for port in matched["pumps"]] + [
+        (connect_autosampler_controller, port) for port in matched["autosamplers"]
+    ]
+    replies = {}
+    if jobs:
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            futures = {port: executor.submit(connect, port) for connect, port in jobs}
+        for port, future in futures.items():
+            message, success = future.result()
+            replies[port] = {"message": message, "success": success}
+    return jsonify(
+        {
+            "success": all(reply["success"] for reply in replies.values()),
+            "connected": replies,
+            "missing": {
+                group: len(layout[group]) - len(matched[group])
+                for group in ("pumps", "autosamplers")
+            },
         }
+    )
 
-        # Add controller to global port map
-        controllers["autosamplers"][port] = controller
 
-    return jsonify({"message": result.message, "success": result.title == "Success"})
+# Remove a disconnected controller and its IDs, then publish the status without it
+def remove_controller(kind: str, port: str, ids: dict) -> None:
+    with registry_lock:
+        controller = controllers[kind].pop(port, None)
+        for global_id in [
+            i for i, info in ids.items() if info["controller"] is controller
+        ]:
+            del ids[global_id]
+        controller_locks.pop(port, None)
+        controller_status.pop(port, None)
+        status_board.publish(build_status())
 
 
 # Endpoint to disconnect a PumpController by port
@@ -117,25 +328,22 @@ def disconnect_pump():
     data = request.get_json()
     port = data.get("port")
 
-    with lock:
-        controller = controllers["pumps"].get(port)
-        if controller:
+    controller = controllers["pumps"].get(port)
+    controller_lock = controller_locks.get(port)
+    if controller and controller_lock:
+        with controller_lock:
+            # stop the worker first so it doesn't race the final messages
+            worker = pump_workers.pop(port, None)
+            if worker:
+                worker.stop()
             result = controller.disconnect()
-            if result.title == "Success":
-                # Remove the controller from the port map
-                del controllers["pumps"][port]
-                # Also remove all pumps associated with this controller
-                pump_ids_to_remove = [
-                    pump_id
-                    for pump_id, pump_info in pump_status.items()
-                    if pump_info["controller"] == controller
-                ]
-                for pump_id in pump_ids_to_remove:
-                    del pump_status[pump_id]
-            return jsonify(
-                {"message": result.message, "success": result.title == "Success"}
-            )
-        return jsonify({"message": "Pump controller not found", "success": False})
+        if result.title == "Success":
+            # Remove the controller and all pumps associated with it
+            remove_controller("pumps", port, pump_status)
+        return jsonify(
+            {"message": result.message, "success": result.title == "Success"}
+        )
+    return jsonify({"message": "Pump controller not found", "success": False})
 
 
 # Endpoint to disconnect an AutosamplerController by port
@@ -144,66 +352,179 @@ def disconnect_autosampler():
     data = request.get_json()
     port = data.get("port")
 
-    with lock:
-        controller = controllers["autosamplers"].get(port)
-        if controller:
-            result = controller.disconnect()
-            if result.title == "Success":
-                # Remove the controller from the port map
-                del controllers["autosamplers"][port]
-                # Also remove the autosampler from the global status
-                autosampler_ids_to_remove = [
-                    autosampler_id
-                    for autosampler_id, autosampler_info in autosampler_status.items()
-                    if autosampler_info["controller"] == controller
-                ]
-                for autosampler_id in autosampler_ids_to_remove:
-                    del autosampler_status[autosampler_id]
-            return jsonify(
-                {"message": result.message, "success": result.title == "Success"}
-            )
-        return jsonify(
-            {"message": "Autosampler controller not found", "success": False}
-        )
+    controller = controllers["autosamplers"].get(port)
+    controller_lock = controller_locks.get(port)
+    if controller and controller_lock:
+        with controller_lock:
+            result = async_loop.run(controller.disconnect())
+        success = result.startswith("Success")
+        if success:
+            # Remove the controller and its global ID
+            remove_controller("autosamplers", port, autosampler_status)
+            controller.status_table.close()
+        return jsonify({"message": result, "success": success})
+    return jsonify({"message": "Autosampler controller not found", "success": False})
 
 
 # Endpoint to toggle a pump's power
 @app.route("/toggle_pump_power/<int:pump_id>", methods=["POST"])
 def toggle_pump_power(pump_id):
-    with lock:
-        pump_info = pump_status.get(pump_id)
-        if pump_info:
-            controller = pump_info["controller"]
-            local_pump_id = pump_info["local_id"]
-            controller.toggle_power(local_pump_id)
-            return jsonify(
-                {"message": f"Toggled power for pump {pump_id}", "success": True}
-            )
-        return jsonify({"message": "Pump not found", "success": False})
+    pump_info = pump_status.get(pump_id)
+    controller_lock = controller_locks.get(pump_info["port"]) if pump_info else None
+    if controller_lock:
+        # only commands to the same controller wait for each other
+        with controller_lock:
+            pump_info["controller"].toggle_power(pump_info["local_id"])
+        return jsonify(
+            {"message": f"Toggled power for pump {pump_id}", "success": True}
+        )
+    return jsonify({"message": "Pump not found", "success": False})
 
 
 # Endpoint to toggle a pump's direction
 @app.route("/toggle_pump_direction/<int:pump_id>", methods=["POST"])
 def toggle_pump_direction(pump_id):
-    with lock:
-        pump_info = pump_status.get(pump_id)
-        if pump_info:
-            controller = pump_info["controller"]
-            local_pump_id = pump_info["local_id"]
-            controller.toggle_direction(local_pump_id)
-            return jsonify(
-                {"message": f"Toggled direction for pump {pump_id}", "success": True}
-            )
-        return jsonify({"message": "Pump not found", "success": False})
+    pump_info = pump_status.get(pump_id)
+    controller_lock = controller_locks.get(pump_info["port"]) if pump_info else None
+    if controller_lock:
+        with controller_lock:
+            pump_info["controller"].toggle_direction(pump_info["local_id"])
+        return jsonify(
+            {"message": f"Toggled direction for pump {pump_id}", "success": True}
+        )
+    return jsonify({"message": "Pump not found", "success": False})
+
+
+# Endpoint to load a recipe file uploaded as the "file" form field, answers with its columns and
+# row count, the rows are fetched page by page from /recipe
+@app.route("/load_recipe", methods=["POST"])
+def load_recipe_file():
+    global current_recipe
+    upload = request.files.get("file")
+    if upload is None or not upload.filename:
+        return jsonify({"success": False, "message": "No recipe file uploaded"})
+    try:
+        recipe_df = load_recipe(upload.filename, upload.stream, UPLOAD_FORMATS)
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        return jsonify(
+            {"success": False, "message": f"Failed to load recipe file: {e}"}
+        )
+    version = current_recipe[0] + 1 if current_recipe else 1
+    current_recipe = (version, recipe_df)
+    return jsonify(
+        {
+            "success": True,
+            "version": version,
+            "columns": [str(column) for column in recipe_df.columns],
+            "total": len(recipe_df),
+        }
+    )
+
+
+# Endpoint to get one page of the loaded recipe, ?offset=<first row>&limit=<rows>, so the web
+# table only holds the rows around its view however long the recipe is
+@app.route("/recipe", methods=["GET"])
+def get_recipe_page():
+    recipe = current_recipe
+    if recipe is None:
+        return jsonify({"success": False, "message": "No recipe loaded"})
+    version, recipe_df = recipe
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = min(max(request.args.get("limit", 100, type=int), 0), MAX_RECIPE_PAGE)
+    return jsonify(
+        {
+            "success": True,
+            "version": version,
+            "columns": [str(column) for column in recipe_df.columns],
+            "total": len(recipe_df),
+            "offset": offset,
+            "rows": format_rows(recipe_df, offset, offset + limit),
+        }
+    )
 
 
-# Endpoint to get the current status of all pumps and autosamplers
+# Endpoint to get the current status of all pumps and autosamplers, never waits on a lock.
+# Answers 304 when If-None-Match has the current ETag, with ?wait=<seconds> it holds the
+# request until the status changes from the version the client has (or the current one).
 @app.route("/get_status", methods=["GET"])
 def get_status():
-    with lock:
-        return jsonify(
-            {"pump_status": pump_status, "autosampler_status": autosampler_status}
+    snapshot = status_board.get()
+    wait = request.args.get("wait", type=float)
+    if wait and wait > 0:
+        if not request.if_none_match or request.if_none_match.contains(
+            status_board.etag(snapshot)
+        ):
+            snapshot = status_board.wait_for_change(
+                snapshot.version, min(wait, MAX_STATUS_WAIT)
+            )
+
+    etag = status_board.etag(snapshot)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(status_board.to_json(snapshot), mimetype="application/json")
+    response.set_etag(etag)
+    # clients may keep the status but have to revalidate it every time
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+# Format one Server-Sent Event
+def sse_event(data: str, event: str, event_id: str) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+
+
+# Stream the status as Server-Sent Events: a full "snapshot" event, then a "delta" event with
+# the JSON merge patch of every new version. Each stream sleeps until the status changes, so an
+# open browser tab costs no CPU while nothing happens. Event ids are "<epoch>-<version>", a
+# client resuming with an id from before a backend restart gets a snapshot.
+def status_events(last_event_id: str):
+    yield f"retry: {EVENTS_RETRY}\n\n"
+    changes = None
+    version = status_board.version_of(last_event_id)
+    if version is not None:
+        # resuming, replay what was missed if it is still in the history
+        changes = status_board.changes_since(version)
+    if changes is None:
+        snapshot = status_board.get()
+        yield sse_event(
+            json.dumps(snapshot.status),
+            "snapshot",
+            status_board.event_id(snapshot.version),
         )
+        version = snapshot.version
+    while True:
+        for version, delta in changes or []:
+            yield sse_event(delta, "delta", status_board.event_id(version))
+        snapshot = status_board.wait_for_change(version, EVENTS_HEARTBEAT_INTERVAL)
+        if snapshot.version == version:
+            # keeps proxies from closing an idle connection
+            yield ": heartbeat\n\n"
+            changes = []
+            continue
+        changes = status_board.changes_since(version)
+        if changes is None:
+            # too far behind, start over from the current status
+            yield sse_event(
+                json.dumps(snapshot.status),
+                "snapshot",
+                status_board.event_id(snapshot.version),
+            )
+            version = snapshot.version
+
+
+# Endpoint streaming status changes, resumes from the Last-Event-ID header sent on reconnect
+@app.route("/events", methods=["GET"])
+def events():
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get(
+        "last_event_id"
+    )
+    return Response(
+        status_events(last_event_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,130 @@
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import threading
+from datetime import datetime
+
+import Backend
+from Controller_benchmark import SimulatorProcess, summarize
+
+
+def measure_get_status(client, samples: int) -> list:
+    latency = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        client.get("/get_status")
+        latency.append(time.perf_counter() - start)
+    return latency
+
+
+def hammer(client, pump_ids: list, stop: threading.Event, latency: list) -> None:
+    """Toggle pumps back to back, each toggle queues a command and a status query."""
+    i = 0
+    while not stop.is_set():
+        pump_id = pump_ids[i % len(pump_ids)]
+        start = time.perf_counter()
+        client.post(f"/toggle_pump_power/{pump_id}")
+        latency.append(time.perf_counter() - start)
+        i += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure /get_status latency while other clients keep the Picos busy."
+    )
+    parser.add_argument("--controllers", type=int, default=4)
+    parser.add_argument("--pumps", type=int, default=8, help="pumps per controller")
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--writers", type=int, default=4, help="toggling threads")
+    parser.add_argument("--transport", choices=["pty", "socket"], default="pty")
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="seconds before each reply"
+    )
+    parser.add_argument("--baudrate", type=int, default=9600)
+    parser.add_argument("--text-only", action="store_true")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    options = {
+        "transport": args.transport,
+        "latency": args.latency,
+        "baudrate": args.baudrate or None,
+        "pumps": args.pumps,
+        "binary": not args.text_only,
+    }
+    simulators = [SimulatorProcess("pump", options) for _ in range(args.controllers)]
+    client = Backend.app.test_client()
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "options": dict(
+            options,
+            controllers=args.controllers,
+            samples=args.samples,
+            writers=args.writers,
+        ),
+        "results": {},
+    }
+
+    try:
+        for simulator in simulators:
+            reply = client.post("/connect_pump", json={"port": simulator.port}).json
+            if not reply["success"]:
+                raise RuntimeError(reply["message"])
+        # wait for every pump info reply to be registered
+        expected = args.controllers * args.pumps
+        deadline = time.perf_counter() + 30
+        while len(Backend.status_board.get().status.get("pump_status", {})) < expected:
+            if time.perf_counter() > deadline:
+                raise RuntimeError("pump info replies did not arrive")
+            time.sleep(0.05)
+        pump_ids = list(Backend.status_board.get().status["pump_status"])
+
+        version = Backend.status_board.get().version
+        idle = measure_get_status(client, args.samples)
+        results["results"]["get_status_idle_ms"] = summarize(idle)
+
+        stop = threading.Event()
+        toggles = []
+        writers = [
+            threading.Thread(target=hammer, args=(client, pump_ids, stop, toggles))
+            for _ in range(args.writers)
+        ]
+        for writer in writers:
+            writer.start()
+        time.sleep(0.5)  # let the send queues and the Picos fill up
+        version = Backend.status_board.get().version
+        start = time.perf_counter()
+        loaded = measure_get_status(client, args.samples)
+        wall = time.perf_counter() - start
+        published = Backend.status_board.get().version - version
+        stop.set()
+        for writer in writers:
+            writer.join()
+
+        results["results"]["get_status_loaded_ms"] = summarize(loaded)
+        results["results"]["toggle_ms"] = summarize(toggles)
+        results["results"]["snapshots_published_per_s"] = round(published / wall, 1)
+    except Exception as e:
+        logging.error(f"Error: backend benchmark failed: {e}")
+        results["results"]["error"] = str(e)
+    finally:
+        for port in list(Backend.controllers["pumps"]):
+            client.post("/disconnect_pump", json={"port": port})
+        for simulator in simulators:
+            simulator.stop()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
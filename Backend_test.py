@@ -0,0 +1,42 @@
+import io
+import pickle
+
+import pandas as pd
+
+import Backend
+
+
+def upload(name: str, data: bytes):
+    client = Backend.app.test_client()
+    return client.post(
+        "/load_recipe",
+        data={"file": (io.BytesIO(data), name)},
+        content_type="multipart/form-data",
+    ).get_json()
+
+
+def test_load_recipe_reads_csv_uploads(monkeypatch):
+    monkeypatch.setattr(Backend, "current_recipe", None)
+    reply = upload("recipe.csv", b"Time point (min),Pump1\r\n0,On\r\n1,Off\r\n")
+    assert reply["success"]
+    assert reply["columns"] == ["Time point (min)", "Pump1"]
+    assert reply["total"] == 2
+
+
+def test_load_recipe_rejects_pickle_uploads(monkeypatch):
+    monkeypatch.setattr(Backend, "current_recipe", None)
+    recipe_df = pd.DataFrame([["Time point (min)", "Pump1"], ["0", "On"]])
+    for name in ("recipe.pkl", "recipe.PKL", "recipe.json"):
+        reply = upload(name, pickle.dumps(recipe_df))
+        assert not reply["success"]
+        assert "Unsupported file format" in reply["message"]
+    assert Backend.current_recipe is None
+
+
+def test_index_serves_the_web_ui():
+    response = Backend.app.test_client().get("/")
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    # the page talks to the endpoints of this app
+    for endpoint in ('EventSource("/events")', '"/load_recipe"', "/recipe?"):
+        assert endpoint in page
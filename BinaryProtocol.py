@@ -0,0 +1,300 @@
+import struct
+import logging
+import binascii
+from datetime import datetime
+
+import serial
+
+from ResponseParser import PUMP_RESPONSES, ResponseTable
+
+# Compact binary reply framing, used instead of text lines when the Pico advertises it.
+#
+# The ping reply lists the capability as a separate word, e.g.
+#   Ping: Pico Pump Control Version 1.1 bin1
+# The host then sends "0:binary", the Pico answers with the text line BINARY_ACK and every reply
+# after it is a frame. Commands from the host stay text. "0:ping" is always answered in text and
+# puts the Pico back in text mode, so a fresh connection never starts in binary mode.
+#
+# frame: SOF (2 bytes) | type (u8) | payload length (u16 LE) | payload | CRC-16/CCITT (u16 LE)
+# the CRC (poly 0x1021, init 0xFFFF) covers type, length and payload.
+BINARY_CAPABILITY = "bin1"
+BINARY_COMMAND = "0:binary"
+BINARY_ACK = "Success: Binary mode enabled"
+
+SOF = b"\xa5\x5a"
+HEADER = struct.Struct("<BH")
+CRC = struct.Struct("<H")
+MAX_PAYLOAD = 4096
+
+# frame types
+TEXT = 0x00  # any reply without a compact form, utf-8 text of the line
+PUMP_INFO = 0x01  # per pump: id u8, power pin i8, direction pin i8, flags u8
+PUMP_STATUS = 0x02  # per pump: id u8, flags u8
+RTC_TIME = 0x03  # year u16, month, day, hour, minute, second u8
+
+PUMP_INFO_ENTRY = struct.Struct("<BbbB")
+PUMP_STATUS_ENTRY = struct.Struct("<BB")
+RTC_TIME_PAYLOAD = struct.Struct("<HBBBBB")
+
+# flag bits shared by the pump info and status entries
+INITIAL_POWER_HIGH = 0x01
+INITIAL_DIRECTION_HIGH = 0x02
+POWER_ON = 0x04
+DIRECTION_CCW = 0x08
+
+
+def supports_binary(ping_response: str) -> bool:
+    return BINARY_CAPABILITY in ping_response.split()
+
+
+def crc16(data: bytes) -> int:
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def encode_frame(frame_type: int, payload: bytes) -> bytes:
+    body = HEADER.pack(frame_type, len(payload)) + payload
+    return SOF + body + CRC.pack(crc16(body))
+
+
+def status_flags(power_status: str, direction_status: str) -> int:
+    return (POWER_ON if power_status == "ON" else 0) | (
+        DIRECTION_CCW if direction_status == "CCW" else 0
+    )
+
+
+def pack_pump_info(pumps_info: dict) -> bytes:
+    """Pack {pump_id: info} as returned by ResponseParser.parse_pump_info, one entry per pump."""
+    return b"".join(
+        PUMP_INFO_ENTRY.pack(
+            pump_id,
+            info["power_pin"],
+            info["direction_pin"],
+            (INITIAL_POWER_HIGH if info["initial_power_pin_value"] else 0)
+            | (INITIAL_DIRECTION_HIGH if info["initial_direction_pin_value"] else 0)
+            | status_flags(info["power_status"], info["direction_status"]),
+        )
+        for pump_id, info in pumps_info.items()
+    )
+
+
+def encode_pump_info(pumps_info: dict) -> bytes:
+    return encode_frame(PUMP_INFO, pack_pump_info(pumps_info))
+
+
+def encode_pump_status(pumps_status: dict) -> bytes:
+    """Encode {pump_id: (power_status, direction_status)}."""
+    payload = b"".join(
+        PUMP_STATUS_ENTRY.pack(pump_id, status_flags(power, direction))
+        for pump_id, (power, direction) in pumps_status.items()
+    )
+    return encode_frame(PUMP_STATUS, payload)
+
+
+def encode_rtc_time(rtc_time: datetime) -> bytes:
+    return encode_frame(
+        RTC_TIME,
+        RTC_TIME_PAYLOAD.pack(
+            rtc_time.year,
+            rtc_time.month,
+            rtc_time.day,
+            rtc_time.hour,
+            rtc_time.minute,
+            rtc_time.second,
+        ),
+    )
+
+
+def encode_text(response: str) -> bytes:
+    return encode_frame(TEXT, response.encode("utf-8"))
+
+
+def encode_reply(response: str, table: ResponseTable = PUMP_RESPONSES) -> bytes:
+    """Reference device side encoder: turn a text reply into the frame the Pico would send."""
+    kind, value = table.parse(response)
+    if kind == "pump_info" and value:
+        return encode_pump_info(value)
+    if kind == "pump_status" and value:
+        return encode_pump_status(value)
+    if kind == "rtc_time" and value:
+        return encode_rtc_time(value)
+    return encode_text(response)
+
+
+def decode_pump_info(payload: bytes) -> dict:
+    pumps_info = {}
+    for pump_id, power_pin, direction_pin, flags in PUMP_INFO_ENTRY.iter_unpack(
+        payload
+    ):
+        pumps_info[pump_id] = {
+            "power_pin": power_pin,
+            "direction_pin": direction_pin,
+            "initial_power_pin_value": int(bool(flags & INITIAL_POWER_HIGH)),
+            "initial_direction_pin_value": int(bool(flags & INITIAL_DIRECTION_HIGH)),
+            "power_status": "ON" if flags & POWER_ON else "OFF",
+            "direction_status": "CCW" if flags & DIRECTION_CCW else "CW",
+        }
+    # same order as the text parser
+    return dict(sorted(pumps_info.items()))
+
+
+def decode_pump_status(payload: bytes) -> dict:
+    return {
+        pump_id: (
+            "ON" if flags & POWER_ON else "OFF",
+            "CCW" if flags & DIRECTION_CCW else "CW",
+        )
+        for pump_id, flags in PUMP_STATUS_ENTRY.iter_unpack(payload)
+    }
+
+
+def decode_rtc_time(payload: bytes) -> datetime:
+    try:
+        return datetime(*RTC_TIME_PAYLOAD.unpack(payload))
+    except (struct.error, ValueError):
+        return None
+
+
+class FrameDecoder:
+    """Incremental frame decoder, feed it raw bytes and get back (kind, value, response, size).
+
+    Values have the same types the text parser returns, so callers handle both modes alike.
+    size is the length of the whole frame, the bytes the reply took on the link. Corrupted
+    frames are skipped by searching for the next start of frame.
+    """
+
+    def __init__(self, table: ResponseTable = PUMP_RESPONSES):
+        self.table = table
+        self.buffer = bytearray()
+        self.dropped = 0  # frames discarded because of a bad length or CRC
+
+    def feed(self, data: bytes) -> list:
+        self.buffer += data
+        replies = []
+        while True:
+            start = self.buffer.find(SOF)
+            if start == -1:
+                # keep a possible first SOF byte at the end
+                del self.buffer[: max(len(self.buffer) - 1, 0)]
+                return replies
+            if start:
+                del self.buffer[:start]
+            if len(self.buffer) < len(SOF) + HEADER.size:
+                return replies
+            frame_type, length = HEADER.unpack_from(self.buffer, len(SOF))
+            if length > MAX_PAYLOAD:
+                self.drop_frame("length")
+                continue
+            end = len(SOF) + HEADER.size + length + CRC.size
+            if len(self.buffer) < end:
+                return replies
+            body = bytes(self.buffer[len(SOF) : end - CRC.size])
+            (checksum,) = CRC.unpack_from(self.buffer, end - CRC.size)
+            if checksum != crc16(body):
+                self.drop_frame("CRC")
+                continue
+            del self.buffer[:end]
+            reply = self.decode(frame_type, body[HEADER.size :])
+            if reply:
+                replies.append(reply + (end,))
+
+    def drop_frame(self, reason: str) -> None:
+        # skip this SOF, the next one is searched on the following pass
+        self.dropped += 1
+        logging.warning(f"Dropped binary frame with bad {reason}")
+        del self.buffer[: len(SOF)]
+
+    def decode(self, frame_type: int, payload: bytes) -> tuple:
+        """Return (kind, value, response), response is only a label for frames without text."""
+        if frame_type == TEXT:
+            response = payload.decode("utf-8", errors="replace").strip()
+            return self.table.parse(response) + (response,)
+        if frame_type == PUMP_INFO:
+            return "pump_info", decode_pump_info(payload), "[pump info frame]"
+        if frame_type == PUMP_STATUS:
+            return "pump_status", decode_pump_status(payload), "[pump status frame]"
+        if frame_type == RTC_TIME:
+            return "rtc_time", decode_rtc_time(payload), "[RTC time frame]"
+        logging.warning(f"Unknown binary frame type: {frame_type}")
+        return None
+
+    def clear(self) -> None:
+        self.buffer.clear()
+
+
+class ReplyReader:
+    """Read replies from a Pico in text or binary mode, returns (kind, value, response, size).
+
+    size is the number of bytes the reply took on the link, the line with its newline or the
+    whole frame.
+
+    Starts in text mode and switches to frames right after the BINARY_ACK line, so replies
+    already in the buffer on either side of the switch are decoded the right way.
+    """
+
+    def __init__(
+        self, serial_port: serial.SerialBase, table: ResponseTable = PUMP_RESPONSES
+    ):
+        self.serial_port = serial_port
+        self.table = table
+        self.buffer = bytearray()
+        self.decoder = FrameDecoder(table)
+        self.binary = False
+        self.ack = BINARY_ACK.encode()
+
+    def read_replies(self, wait=False) -> list:
+        """Return every complete reply received so far, set wait to block until one arrives."""
+        data = self.read_available(wait)
+        replies = self.feed(data)
+        while wait and not replies and data:
+            # only part of a reply arrived, keep waiting until the port times out
+            data = self.read_available(wait)
+            replies = self.feed(data)
+        return replies
+
+    def read_available(self, wait: bool) -> bytes:
+        waiting = self.serial_port.in_waiting
+        if waiting:
+            return self.serial_port.read(waiting)
+        if wait:
+            # block until the first byte arrives or the port times out, then take the rest
+            data = self.serial_port.read(1)
+            if data and self.serial_port.in_waiting:
+                data += self.serial_port.read(self.serial_port.in_waiting)
+            return data
+        return b""
+
+    def feed(self, data: bytes) -> list:
+        if self.binary:
+            return self.decoder.feed(data)
+        self.buffer += data
+        replies = self.read_text()
+        if self.binary:
+            # whatever followed the ack line is already framed
+            replies += self.decoder.feed(bytes(self.buffer))
+            self.buffer.clear()
+        return replies
+
+    def read_text(self) -> list:
+        ack = self.buffer.find(self.ack)
+        if ack != -1:
+            end = self.buffer.find(b"\n", ack)
+            if end == -1:
+                return []  # wait for the end of the ack line
+            self.binary = True
+        else:
+            end = self.buffer.rfind(b"\n")
+            if end == -1:
+                return []
+        chunk = bytes(self.buffer[:end])
+        del self.buffer[: end + 1]
+        replies = []
+        for line in chunk.split(b"\n"):
+            response = line.decode("utf-8", errors="replace").strip()
+            if response:
+                replies.append(self.table.parse(response) + (response, len(line) + 1))
+        return replies
+
+    def clear(self) -> None:
+        self.buffer.clear()
+        self.decoder.clear()
+        self.binary = False
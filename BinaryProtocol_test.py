@@ -0,0 +1,124 @@
+from datetime import datetime
+
+import serial
+
+from BinaryProtocol import (
+    BINARY_ACK,
+    FrameDecoder,
+    ReplyReader,
+    SOF,
+    TEXT,
+    crc16,
+    encode_frame,
+    encode_pump_info,
+    encode_pump_status,
+    encode_reply,
+    encode_rtc_time,
+    encode_text,
+)
+
+PUMPS_INFO = {
+    1: {
+        "power_pin": 0,
+        "direction_pin": 1,
+        "initial_power_pin_value": 0,
+        "initial_direction_pin_value": 1,
+        "power_status": "ON",
+        "direction_status": "CW",
+    },
+    2: {
+        "power_pin": 2,
+        "direction_pin": -1,
+        "initial_power_pin_value": 1,
+        "initial_direction_pin_value": 0,
+        "power_status": "OFF",
+        "direction_status": "CCW",
+    },
+}
+
+
+def test_crc16_ccitt():
+    # CRC-16/CCITT-FALSE check value
+    assert crc16(b"123456789") == 0x29B1
+
+
+def test_frames_round_trip_with_their_size():
+    decoder = FrameDecoder()
+    rtc_time = datetime(2024, 5, 6, 7, 8, 9)
+    frames = [
+        encode_pump_info(PUMPS_INFO),
+        encode_pump_status({1: ("ON", "CW"), 2: ("OFF", "CCW")}),
+        encode_rtc_time(rtc_time),
+        encode_text("Success: Pump 1 power toggled"),
+    ]
+    replies = decoder.feed(b"".join(frames))
+    assert [reply[0] for reply in replies] == [
+        "pump_info",
+        "pump_status",
+        "rtc_time",
+        "success",
+    ]
+    assert replies[0][1] == PUMPS_INFO
+    assert replies[1][1] == {1: ("ON", "CW"), 2: ("OFF", "CCW")}
+    assert replies[2][1] == rtc_time
+    assert replies[3][2] == "Success: Pump 1 power toggled"
+    # the size is the whole frame, not the label or a repr of the value
+    assert [reply[3] for reply in replies] == [len(frame) for frame in frames]
+
+
+def test_encode_reply_picks_the_compact_frame():
+    assert encode_reply("RTC Time: 2024-05-06 07:08:09")[2] != TEXT
+    assert encode_reply("Success: done")[2] == TEXT
+
+
+def test_split_frames_are_buffered():
+    decoder = FrameDecoder()
+    frame = encode_pump_info(PUMPS_INFO)
+    assert decoder.feed(frame[:1]) == []
+    assert decoder.feed(frame[1:7]) == []
+    (reply,) = decoder.feed(frame[7:])
+    assert reply[1] == PUMPS_INFO
+
+
+def test_corrupted_frames_are_dropped():
+    decoder = FrameDecoder()
+    good = encode_text("Success: ok")
+    bad = bytearray(encode_text("Success: lost"))
+    bad[-1] ^= 0xFF
+    # noise before a frame and a frame with a bad CRC are both skipped
+    replies = decoder.feed(b"\x00\x13" + bytes(bad) + good)
+    assert [reply[2] for reply in replies] == ["Success: ok"]
+    assert decoder.dropped == 1
+
+
+def test_oversized_length_is_dropped():
+    decoder = FrameDecoder()
+    bogus = SOF + bytes([TEXT, 0xFF, 0xFF])
+    replies = decoder.feed(bogus + encode_text("Error: retry"))
+    assert [reply[2] for reply in replies] == ["Error: retry"]
+    assert decoder.dropped == 1
+
+
+def test_reply_reader_switches_to_frames_after_the_ack():
+    port = serial.serial_for_url("loop://", timeout=0.1)
+    reader = ReplyReader(port)
+    port.write(
+        b"Ping: Pico Pump Control Version 1.1 bin1\r\n"
+        + BINARY_ACK.encode()
+        + b"\n"
+        + encode_pump_status({1: ("ON", "CW")})
+    )
+    replies = reader.read_replies(wait=True)
+    assert [reply[0] for reply in replies] == ["ping", "success", "pump_status"]
+    assert replies[0][3] == len("Ping: Pico Pump Control Version 1.1 bin1\r\n")
+    assert replies[1][3] == len(BINARY_ACK) + 1
+    assert replies[2][3] == len(encode_pump_status({1: ("ON", "CW")}))
+    assert reader.binary
+
+
+def test_frame_layout():
+    frame = encode_frame(TEXT, b"hi")
+    assert frame[:2] == SOF
+    assert frame[2:5] == bytes([TEXT, 2, 0])
+    assert frame[5:7] == b"hi"
+    assert int.from_bytes(frame[7:], "little") == crc16(frame[2:7])
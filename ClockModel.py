@@ -0,0 +1,181 @@
+import math
+import time
+import logging
+from collections import deque
+from datetime import datetime
+from typing import NamedTuple
+
+# the Pico RTC only reports whole seconds
+RTC_RESOLUTION = 1.0
+# sample quickly until the offset is known to within this many seconds plus half the round trip
+TARGET_UNCERTAINTY = 0.02
+MIN_SAMPLE_INTERVAL = 1.0
+MAX_SAMPLE_INTERVAL = 300.0
+# a time query without a reply after this long is forgotten
+QUERY_TIMEOUT = 5.0
+# drift is only estimated from offsets measured at least this far apart
+MIN_DRIFT_SPAN = 1800.0
+MAX_SAMPLES = 32
+# stime is not scheduled closer to the second boundary than this
+MIN_STIME_LEAD = 0.05
+
+
+class ClockSample(NamedTuple):
+    sent: float  # host time the time query was written
+    received: float  # host time the reply was read
+    device_time: float  # the RTC reading as a timestamp
+
+    @property
+    def host_time(self) -> float:
+        return (self.sent + self.received) / 2
+
+    @property
+    def round_trip(self) -> float:
+        return self.received - self.sent
+
+
+class ClockModel:
+    """The RTC time of a Pico estimated on the host, so it does not have to be polled every second.
+
+    A reading of second D that was requested at host time s and read at r means the offset of the
+    device clock lies between D - r and D + 1 - s. Intersecting these bounds over samples taken
+    at different points within the RTC second narrows the offset down to about the round trip.
+    Every query is timed so the reply is read where the RTC second would begin if the current
+    estimate were right, which halves the bounds like a binary search. The sample interval grows
+    once the offset is known, the drift is estimated from offsets measured far apart and keeps
+    the later samples consistent.
+    """
+
+    def __init__(
+        self,
+        name: str = "Pico",
+        target_uncertainty: float = TARGET_UNCERTAINTY,
+        min_interval: float = MIN_SAMPLE_INTERVAL,
+        max_interval: float = MAX_SAMPLE_INTERVAL,
+    ):
+        self.name = name
+        self.target_uncertainty = target_uncertainty
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget every sample, e.g. after the RTC has been set."""
+        self.samples = deque(maxlen=MAX_SAMPLES)
+        self.offset = None  # device time minus host time in seconds at self.reference
+        self.uncertainty = None  # half the width of the offset bounds
+        self.reference = None
+        self.drift = 0.0  # seconds the device gains per host second
+        self.anchor = None  # (host time, offset) of the first converged estimate
+        self.converged = False
+        self.interval = self.min_interval
+        self.next_sample = 0.0
+        self.pending = None
+
+    def due(self, now: float = None) -> bool:
+        """True if a time query should be sent now."""
+        now = now if now is not None else time.time()
+        if self.pending is not None and now - self.pending > QUERY_TIMEOUT:
+            logging.debug(f"{self.name} time query timed out")
+            self.pending = None
+        return self.pending is None and now >= self.next_sample
+
+    def query_sent(self, now: float = None) -> None:
+        self.pending = now if now is not None else time.time()
+
+    def add_sample(self, device_time: datetime, received: float = None) -> bool:
+        """Add the reply to the pending time query, returns False if no query was pending."""
+        received = received if received is not None else time.time()
+        if device_time is None or self.pending is None:
+            return False
+        sample = ClockSample(self.pending, received, device_time.timestamp())
+        self.pending = None
+        self.samples.append(sample)
+        if not self.fit():
+            # the RTC jumped or drifted out of the bounds, start over from this sample
+            logging.info(f"{self.name} clock changed, restarting the clock model")
+            self.samples = deque([sample], maxlen=MAX_SAMPLES)
+            self.anchor = None
+            self.drift = 0.0
+            self.converged = False
+            self.fit()
+        self.schedule(received)
+        return True
+
+    def bounds(self, reference: float) -> tuple:
+        """Intersection of the offset bounds of all samples, projected to the reference time."""
+        low, high = -math.inf, math.inf
+        for sample in self.samples:
+            correction = self.drift * (reference - sample.host_time)
+            low = max(low, sample.device_time - sample.received + correction)
+            high = min(
+                high, sample.device_time + RTC_RESOLUTION - sample.sent + correction
+            )
+        return low, high
+
+    def fit(self) -> bool:
+        reference = self.samples[-1].host_time
+        low, high = self.bounds(reference)
+        if low > high:
+            return False
+        self.reference = reference
+        self.offset = (low + high) / 2
+        self.uncertainty = (high - low) / 2
+        converged = (
+            self.uncertainty <= self.target_uncertainty + self.min_round_trip() / 2
+        )
+        if converged and not self.converged:
+            logging.info(
+                f"{self.name} clock offset {self.offset:+.3f} s ± {self.uncertainty:.3f} s"
+            )
+        self.converged = converged
+        if converged:
+            if self.anchor is None:
+                self.anchor = (reference, self.offset)
+            elif reference - self.anchor[0] >= MIN_DRIFT_SPAN:
+                self.drift = (self.offset - self.anchor[1]) / (
+                    reference - self.anchor[0]
+                )
+                logging.debug(f"{self.name} clock drift {self.drift * 1e6:+.1f} ppm")
+        return True
+
+    def schedule(self, now: float) -> None:
+        if self.converged:
+            self.interval = min(self.interval * 2, self.max_interval)
+        else:
+            self.interval = self.min_interval
+        # the first host time after the interval at which the estimated device second begins
+        one_way = self.min_round_trip() / 2
+        earliest = now + self.interval + one_way
+        device_time = self.device_timestamp(earliest)
+        self.next_sample = earliest + math.ceil(device_time) - device_time - one_way
+
+    def min_round_trip(self) -> float:
+        return min((sample.round_trip for sample in self.samples), default=0.0)
+
+    def device_timestamp(self, now: float = None) -> float:
+        """Estimated device time as a timestamp, None before the first sample."""
+        if self.offset is None:
+            return None
+        now = now if now is not None else time.time()
+        return now + self.offset + self.drift * (now - self.reference)
+
+    def now(self) -> datetime:
+        """Estimated device time, None before the first sample."""
+        timestamp = self.device_timestamp()
+        return datetime.fromtimestamp(timestamp) if timestamp is not None else None
+
+    def stime_command(self, prefix: str = "0:", now: float = None) -> tuple:
+        """Return (command, delay) that sets the RTC to the next whole host second.
+
+        stime only takes whole seconds, so the command has to arrive when that second begins. Sent
+        after delay seconds, it arrives half the shortest round trip later, right on the boundary.
+        """
+        now = now if now is not None else time.time()
+        one_way = self.min_round_trip() / 2
+        boundary = math.floor(now + one_way) + 1
+        if boundary - one_way - now < MIN_STIME_LEAD:
+            boundary += 1
+        rtc_time = datetime.fromtimestamp(boundary)
+        command = f"{prefix}stime:{rtc_time.year}:{rtc_time.month}:{rtc_time.day}:{rtc_time.hour}:{rtc_time.minute}:{rtc_time.second}"
+        return command, boundary - one_way - now
@@ -0,0 +1,62 @@
+from queue import Queue
+
+# queries that only read state from the Pico, sending one of them twice in a row gives the same answer
+IDEMPOTENT_QUERIES = frozenset(["0:st", "0:info", "0:time", "time", "status", "config"])
+
+# default upper bound for one write, a step toggling a dozen pumps is well below it
+DEFAULT_MAX_BURST_BYTES = 256
+
+
+class CoalescingQueue(Queue):
+    """A FIFO command queue that collapses duplicate idempotent queries still waiting to be sent.
+
+    When a query is put while an identical one is still queued, the older copy is dropped and
+    the new one is appended, so the single query left runs after every command queued before it
+    (a burst of pump toggles followed by "0:st" each costs one status round trip).
+    """
+
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self.coalesced = 0  # number of queries dropped because a duplicate was queued
+
+    def _put(self, item):
+        if item in IDEMPOTENT_QUERIES:
+            try:
+                self.queue.remove(item)
+            except ValueError:
+                pass
+            else:
+                self.coalesced += 1
+                # put() counts every item as an unfinished task, keep task_done()/join() balanced
+                self.unfinished_tasks -= 1
+        self.queue.append(item)
+
+    def get_burst(self, max_burst_bytes: int = DEFAULT_MAX_BURST_BYTES) -> tuple:
+        """Remove every queued command that fits in one write, return them and the encoded buffer.
+
+        The first command is always taken even if it is longer than max_burst_bytes.
+        """
+        commands = []
+        payload = bytearray()
+        with self.mutex:
+            while self.queue:
+                encoded = f"{self.queue[0].strip()}\n".encode()
+                if commands and len(payload) + len(encoded) > max_burst_bytes:
+                    break
+                commands.append(self.queue.popleft())
+                payload += encoded
+            if commands:
+                self.not_full.notify()
+        return commands, bytes(payload)
+
+    def wait(self, timeout: float = None) -> bool:
+        """Block until a command is queued or wake() is called, return True if commands are waiting."""
+        with self.not_empty:
+            if not self._qsize():
+                self.not_empty.wait(timeout)
+            return bool(self._qsize())
+
+    def wake(self) -> None:
+        """Release every thread blocked in wait(), used to stop a worker."""
+        with self.not_empty:
+            self.not_empty.notify_all()
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import threading
+
+from PumpController import PumpController
+
+
+class PumpControllerWorker:
+    """Drive one PumpController from two threads, each blocked on its own event source.
+
+    The writer sleeps on the send queue and writes a command the moment it is queued, the
+    reader sleeps in a blocking read on the port and handles replies as they arrive. A slow or
+    silent Pico therefore only holds up its own threads. When the controller's polling
+    scheduler says so and nothing else is queued, the writer queues the status queries.
+    """
+
+    def __init__(self, controller: PumpController):
+        self.controller = controller
+        self.running = False
+        self.writer_thread = None
+        self.reader_thread = None
+
+    def start(self) -> None:
+        self.running = True
+        # the threads never disconnect the controller, they stop once its port failed
+        self.controller.connection_lost_listener = self.connection_lost
+        name = self.controller.serial_port.name
+        self.writer_thread = threading.Thread(
+            target=self.write_loop, name=f"{name} writer", daemon=True
+        )
+        self.reader_thread = threading.Thread(
+            target=self.read_loop, name=f"{name} reader", daemon=True
+        )
+        self.writer_thread.start()
+        self.reader_thread.start()
+
+    def stop(self) -> None:
+        """Stop both threads, the controller stays connected."""
+        self.running = False
+        self.controller.send_command_queue.wake()
+        # wake the reader up from its blocking read, not every port type supports it
+        cancel_read = getattr(self.controller.serial_port, "cancel_read", None)
+        if cancel_read and self.controller.is_connected():
+            try:
+                cancel_read()
+            except Exception as e:
+                logging.debug(f"cancel_read failed: {e}")
+        # without cancel_read the reader returns once the port times out
+        timeout = (self.controller.serial_port.timeout or 0) + 1
+        for thread in (self.writer_thread, self.reader_thread):
+            if thread and thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def connection_lost(self, controller: PumpController) -> None:
+        """Stop both threads after a port error, the owner of the worker disconnects."""
+        self.running = False
+        controller.send_command_queue.wake()
+
+    def is_alive(self) -> bool:
+        return bool(self.reader_thread and self.reader_thread.is_alive())
+
+    def write_loop(self) -> None:
+        while self.running and self.controller.is_connected():
+            # wake up for a queued command or when the next status poll is due
+            if self.controller.send_command_queue.wait(
+                self.controller.polling.next_due_in()
+            ):
+                self.controller.send_command()
+            elif self.running:
+                self.controller.poll_status()
+
+    def read_loop(self) -> None:
+        try:
+            while self.running and self.controller.is_connected():
+                self.controller.read_serial(wait=True)
+        finally:
+            # the port may have been lost, make sure the writer does not wait forever
+            self.running = False
+            self.controller.send_command_queue.wake()
+
+
+class AsyncControllerLoop:
+    """One event loop in a background thread shared by every async controller.
+
+    The async controllers read their ports from the loop through their reply routers, so a
+    single thread serves any number of them. Blocking code such as a Flask handler runs a
+    controller coroutine with run().
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="async controllers", daemon=True
+        )
+        self.thread.start()
+
+    def run(self, coroutine, timeout: float = None):
+        """Run a coroutine on the loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def submit(self, coroutine):
+        """Schedule a coroutine on the loop without waiting, returns its future."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
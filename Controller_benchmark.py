@@ -0,0 +1,426 @@
+import sys
+import json
+import time
+import serial
+import asyncio
+import logging
+import argparse
+import platform
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from PicoSimulator import PicoSimulator, VirtualPumpPico, VirtualAutosamplerPico
+from CommandQueue import CoalescingQueue
+from BinaryProtocol import ReplyReader, supports_binary, BINARY_COMMAND
+
+# command sent, reply keyword (async controllers) and reply kind (reply readers) for each test
+PUMP_COMMANDS = {
+    "pw": ("1:pw", "Success", "success"),
+    "di": ("1:di", "Success", "success"),
+    "st": ("0:st", "Status: Power", "pump_status"),
+    "info": ("0:info", "Info: Power Pin", "pump_info"),
+    "time": ("0:time", "RTC Time", "rtc_time"),
+}
+AUTOSAMPLER_COMMANDS = {
+    "status": ("status", "Autosampler Status"),
+    "config": ("config", "Autosampler Configuration"),
+    "time": ("time", "RTC Time"),
+    "move": ("move:right", "Moved one step"),
+    "position": ("position:100", "moved to position"),
+}
+# a single reply can take a while at low baud rates, give up on a command after this long
+REPLY_TIMEOUT = 5.0
+
+
+def run_simulator(device: str, options: dict, conn) -> None:
+    if device == "pump":
+        virtual_pico = VirtualPumpPico(
+            options["pumps"], binary_capable=options["binary"]
+        )
+    else:
+        virtual_pico = VirtualAutosamplerPico()
+    simulator = PicoSimulator(
+        virtual_pico,
+        transport=options["transport"],
+        reply_latency=options["latency"],
+        baudrate=options["baudrate"],
+        link_latency=options.get("link_latency", 0.0),
+    )
+    conn.send(simulator.start())
+    conn.recv()  # serve until the benchmark is done
+    simulator.stop()
+
+
+class SimulatorProcess:
+    """A virtual Pico in its own process, so its CPU time is not counted as the host's."""
+
+    def __init__(self, device: str, options: dict):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=run_simulator, args=(device, options, child_conn), daemon=True
+        )
+        self.process.start()
+        self.port = self.conn.recv()
+
+    def stop(self) -> None:
+        self.conn.send(None)
+        self.process.join(timeout=5)
+
+
+def summarize(samples: list) -> dict:
+    """Latency percentiles in milliseconds."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return round(
+            ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1e3, 3
+        )
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered) * 1e3, 3),
+        "p50": percentile(50),
+        "p90": percentile(90),
+        "p99": percentile(99),
+        "max": round(ordered[-1] * 1e3, 3),
+    }
+
+
+def throughput(count: int, wall: float, cpu: float) -> dict:
+    return {
+        "commands": count,
+        "commands_per_s": round(count / wall, 1) if wall else None,
+        "cpu_us_per_command": round(cpu / count * 1e6, 1) if count else None,
+    }
+
+
+def bench_sync_pump(port: str, rounds: int, burst: int, binary: bool) -> dict:
+    """The blocking PumpController used by the backend."""
+    from PumpController import PumpController
+
+    controller = PumpController(1, port, 1, binary_protocol=binary)
+    kinds = []
+    handle_reply = controller.handle_reply
+
+    def recording_handle_reply(kind, value, response, size):
+        kinds.append(kind)
+        return handle_reply(kind, value, response, size)
+
+    controller.handle_reply = recording_handle_reply
+
+    def wait_for(kind, count=1):
+        deadline = time.perf_counter() + REPLY_TIMEOUT
+        while kinds.count(kind) < count and time.perf_counter() < deadline:
+            controller.read_serial(wait=True)
+
+    start = time.perf_counter()
+    message = controller.connect()
+    connect_time = time.perf_counter() - start
+    if message.title != "Success":
+        return {"error": message.message}
+    kinds.clear()
+
+    latency = {}
+    for name, (command, _, kind) in PUMP_COMMANDS.items():
+        samples = []
+        for _ in range(rounds):
+            kinds.clear()
+            start = time.perf_counter()
+            controller.send_command_queue.put(command)
+            controller.send_command()
+            wait_for(kind)
+            samples.append(time.perf_counter() - start)
+        latency[name] = summarize(samples)
+
+    kinds.clear()
+    cpu = time.process_time()
+    start = time.perf_counter()
+    for _ in range(burst):
+        controller.send_command_queue.put("1:pw")
+    while not controller.send_command_queue.empty():
+        controller.send_command()
+    wait_for("success", burst)
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+
+    controller.disconnect()
+    return {
+        "connect_s": round(connect_time, 4),
+        "binary_protocol": controller.reply_reader.binary,
+        "latency_ms": latency,
+        "sustained": throughput(kinds.count("success"), wall, cpu),
+    }
+
+
+async def bench_async(controller, commands: dict, rounds: int, burst: int) -> dict:
+    start = time.perf_counter()
+    response = await controller.connect()
+    connect_time = time.perf_counter() - start
+    if not response.startswith("Success"):
+        return {"error": response}
+
+    latency = {}
+    for name, (command, keyword) in commands.items():
+        samples = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            await controller.request(command, keyword)
+            samples.append(time.perf_counter() - start)
+        latency[name] = summarize(samples)
+
+    command, keyword = next(iter(commands.values()))
+    cpu = time.process_time()
+    start = time.perf_counter()
+    # every request in flight at once, the router pairs the replies
+    replies = await asyncio.gather(
+        *(controller.request(command, keyword) for _ in range(burst))
+    )
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+
+    await controller.disconnect()
+    return {
+        "connect_s": round(connect_time, 4),
+        "latency_ms": latency,
+        "sustained": throughput(sum(1 for r in replies if r), wall, cpu),
+    }
+
+
+def bench_async_pump(port: str, rounds: int, burst: int) -> dict:
+    from PumpController_async import PumpController
+
+    controller = PumpController(
+        1, port, 1, multiprocessing.Lock(), logging.getLogger("benchmark")
+    )
+    commands = {name: (c, k) for name, (c, k, _) in PUMP_COMMANDS.items()}
+    try:
+        return asyncio.run(bench_async(controller, commands, rounds, burst))
+    finally:
+        controller.status_table.close()
+
+
+def bench_async_autosampler(port: str, rounds: int, burst: int) -> dict:
+    from AutosamplerController import AutosamplerController
+
+    controller = AutosamplerController(
+        1, port, 1, multiprocessing.Lock(), logging.getLogger("benchmark")
+    )
+    try:
+        return asyncio.run(bench_async(controller, AUTOSAMPLER_COMMANDS, rounds, burst))
+    finally:
+        controller.status_table.close()
+
+
+def bench_gui_queue(port: str, rounds: int, burst: int, tick: float) -> dict:
+    """The Tk PicoController path: a coalescing queue drained by the main loop tick."""
+    queue = CoalescingQueue()
+    serial_port = serial.serial_for_url(port, timeout=1)
+    reader = ReplyReader(serial_port)
+    kinds = []
+
+    def main_loop_tick():
+        # same order as PicoController.main_loop: read, then send
+        for kind, value, response, size in reader.read_replies():
+            kinds.append(kind)
+            if kind == "ping" and supports_binary(value):
+                queue.put(BINARY_COMMAND)
+        if not queue.empty():
+            _, payload = queue.get_burst()
+            serial_port.write(payload)
+
+    def run_until(kind, count=1):
+        deadline = time.perf_counter() + REPLY_TIMEOUT
+        main_loop_tick()
+        while kinds.count(kind) < count and time.perf_counter() < deadline:
+            time.sleep(tick)
+            main_loop_tick()
+
+    start = time.perf_counter()
+    queue.put("0:ping")
+    now = datetime.now()
+    queue.put(
+        f"0:stime:{now.year}:{now.month}:{now.day}:{now.hour}:{now.minute}:{now.second}"
+    )
+    queue.put("0:info")
+    run_until("pump_info")
+    connect_time = time.perf_counter() - start
+
+    latency = {}
+    for name, (command, _, kind) in PUMP_COMMANDS.items():
+        samples = []
+        for _ in range(rounds):
+            kinds.clear()
+            start = time.perf_counter()
+            queue.put(command)
+            run_until(kind)
+            samples.append(time.perf_counter() - start)
+        latency[name] = summarize(samples)
+
+    kinds.clear()
+    cpu = time.process_time()
+    start = time.perf_counter()
+    for _ in range(burst):
+        queue.put("1:pw")
+    run_until("success", burst)
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+
+    serial_port.close()
+    return {
+        "connect_s": round(connect_time, 4),
+        "tick_s": tick,
+        "binary_protocol": reader.binary,
+        "latency_ms": latency,
+        "sustained": throughput(kinds.count("success"), wall, cpu),
+    }
+
+
+def bench_startup(ports: list, binary: bool) -> dict:
+    """Connect a bench of pump controllers one after another, then all at once."""
+    from PumpController import PumpController
+
+    def connect(controller_id, port):
+        controller = PumpController(controller_id, port, 1, binary_protocol=binary)
+        start = time.perf_counter()
+        message = controller.connect()
+        return controller, message, time.perf_counter() - start
+
+    results = {}
+    for mode in ("sequential", "concurrent"):
+        start = time.perf_counter()
+        if mode == "sequential":
+            connected = [connect(i, port) for i, port in enumerate(ports, 1)]
+        else:
+            with ThreadPoolExecutor(max_workers=len(ports)) as executor:
+                connected = list(executor.map(connect, range(1, len(ports) + 1), ports))
+        wall = time.perf_counter() - start
+        stages = {}
+        for controller, message, _ in connected:
+            if message.title != "Success":
+                return {"error": message.message}
+            for stage in controller.handshake_report["stages"]:
+                stages.setdefault(stage["name"], []).append(stage["seconds"])
+        results[mode] = {
+            "wall_s": round(wall, 4),
+            "connect_ms": summarize([seconds for _, _, seconds in connected]),
+            "stage_ms": {name: summarize(samples) for name, samples in stages.items()},
+            "missed_stages": sum(
+                not stage["ok"]
+                for controller, _, _ in connected
+                for stage in controller.handshake_report["stages"]
+            ),
+        }
+        for controller, _, _ in connected:
+            controller.disconnect()
+    return dict(results, controllers=len(ports))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the controllers against a simulated Pico."
+    )
+    parser.add_argument("--rounds", type=int, default=50, help="samples per command")
+    parser.add_argument("--burst", type=int, default=200, help="commands per burst")
+    parser.add_argument("--transport", choices=["pty", "socket"], default="pty")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument(
+        "--link-latency", type=float, default=0.0, help="USB round trip in seconds"
+    )
+    parser.add_argument("--baudrate", type=int, default=115200)
+    parser.add_argument("--pumps", type=int, default=8)
+    parser.add_argument("--text-only", action="store_true")
+    parser.add_argument("--tick", type=float, default=0.02, help="GUI main loop tick")
+    parser.add_argument(
+        "--controllers", type=int, default=8, help="pump controllers for startup"
+    )
+    parser.add_argument(
+        "--only",
+        choices=[
+            "sync_pump",
+            "async_pump",
+            "async_autosampler",
+            "gui_queue",
+            "startup",
+        ],
+        action="append",
+    )
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    options = {
+        "transport": args.transport,
+        "latency": args.latency,
+        "link_latency": args.link_latency,
+        "baudrate": args.baudrate or None,
+        "pumps": args.pumps,
+        "binary": not args.text_only,
+    }
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "options": dict(options, rounds=args.rounds, burst=args.burst),
+        "results": {},
+    }
+    selected = args.only or [
+        "sync_pump",
+        "async_pump",
+        "async_autosampler",
+        "gui_queue",
+        "startup",
+    ]
+
+    for name in selected:
+        if name == "startup":
+            simulators = [
+                SimulatorProcess("pump", options) for _ in range(args.controllers)
+            ]
+            try:
+                result = bench_startup(
+                    [simulator.port for simulator in simulators], options["binary"]
+                )
+            except Exception as e:
+                logging.error(f"Error: {name} benchmark failed: {e}")
+                result = {"error": str(e)}
+            finally:
+                for simulator in simulators:
+                    simulator.stop()
+            results["results"][name] = result
+            continue
+        device = "autosampler" if name == "async_autosampler" else "pump"
+        simulator = SimulatorProcess(device, options)
+        try:
+            if name == "sync_pump":
+                result = bench_sync_pump(
+                    simulator.port, args.rounds, args.burst, options["binary"]
+                )
+            elif name == "async_pump":
+                result = bench_async_pump(simulator.port, args.rounds, args.burst)
+            elif name == "async_autosampler":
+                result = bench_async_autosampler(
+                    simulator.port, args.rounds, args.burst
+                )
+            else:
+                result = bench_gui_queue(
+                    simulator.port, args.rounds, args.burst, args.tick
+                )
+        except Exception as e:
+            logging.error(f"Error: {name} benchmark failed: {e}")
+            result = {"error": str(e)}
+        finally:
+            simulator.stop()
+        results["results"][name] = result
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
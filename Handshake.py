@@ -0,0 +1,72 @@
+import time
+import logging
+from typing import NamedTuple
+
+# upper bound for a whole connect handshake in seconds
+HANDSHAKE_TIMEOUT = 3.0
+# each stage has this long from the moment its commands are sent until its last reply
+STAGE_TIMEOUT = 1.0
+
+
+class HandshakeStage(NamedTuple):
+    name: str
+    # from sending the stage's commands to its last reply, or to its deadline
+    seconds: float
+    ok: bool
+    detail: str
+
+
+class Handshake:
+    """Deadlines and timing of one staged connect handshake.
+
+    The controllers identify the Pico first, then send the commands of every following stage in
+    one go and match the replies as they arrive, so the stages overlap on the wire. Each stage
+    still has its own deadline, capped by the deadline of the whole handshake, and its timing
+    is recorded for the connect report.
+    """
+
+    def __init__(
+        self,
+        device_name: str,
+        timeout: float = HANDSHAKE_TIMEOUT,
+        stage_timeout: float = STAGE_TIMEOUT,
+    ):
+        self.device_name = device_name
+        self.stage_timeout = stage_timeout
+        self.start = time.perf_counter()
+        self.deadline = self.start + timeout
+        self.stages = []
+
+    def stage_deadline(self, started: float) -> float:
+        return min(started + self.stage_timeout, self.deadline)
+
+    def remaining(self, deadline: float) -> float:
+        return max(deadline - time.perf_counter(), 0.0)
+
+    def record(
+        self, name: str, started: float, ok: bool, finished: float = None, detail=""
+    ) -> bool:
+        """Record a finished stage, finished defaults to now. Returns ok."""
+        finished = finished if finished is not None else time.perf_counter()
+        self.stages.append(HandshakeStage(name, finished - started, ok, detail))
+        if not ok:
+            logging.warning(
+                f"{self.device_name}: handshake stage {name} missed its deadline {detail}".rstrip()
+            )
+        return ok
+
+    def report(self) -> dict:
+        return {
+            "total_s": round(time.perf_counter() - self.start, 6),
+            "stages": [
+                {"name": stage.name, "seconds": round(stage.seconds, 6), "ok": stage.ok}
+                for stage in self.stages
+            ],
+        }
+
+    def summary(self) -> str:
+        stages = ", ".join(
+            f"{stage.name} {stage.seconds * 1e3:.1f} ms{'' if stage.ok else ' (missed)'}"
+            for stage in self.stages
+        )
+        return f"{self.device_name} handshake: {stages}, total {(time.perf_counter() - self.start) * 1e3:.1f} ms"
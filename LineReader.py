@@ -0,0 +1,31 @@
+import serial
+
+
+class LineReader:
+    """Read everything the port has buffered in one call and split it into complete lines.
+
+    Partial lines stay in the buffer until the rest arrives with a later read.
+    """
+
+    def __init__(self, serial_port: serial.SerialBase):
+        self.serial_port = serial_port
+        self.buffer = bytearray()
+
+    def read_lines(self, wait=False) -> list:
+        """Return every complete line received so far, set wait to block until one arrives."""
+        waiting = self.serial_port.in_waiting
+        if waiting:
+            self.buffer += self.serial_port.read(waiting)
+        elif wait and b"\n" not in self.buffer:
+            # block until a full line arrives or the port times out
+            self.buffer += self.serial_port.read_until(b"\n")
+        end = self.buffer.rfind(b"\n")
+        if end == -1:
+            return []
+        chunk = self.buffer[:end].decode("utf-8", errors="replace")
+        del self.buffer[: end + 1]
+        lines = [line.strip() for line in chunk.split("\n")]
+        return [line for line in lines if line]
+
+    def clear(self) -> None:
+        self.buffer.clear()
@@ -0,0 +1,142 @@
+import json
+import time
+import logging
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+
+from PortRegistry import get_port_registry
+
+PUMP_PING = "Pico Pump Control Version"
+AUTOSAMPLER_PING = "Pico Autosampler Control Version"
+# how long every port gets to answer the ping, all ports are probed at the same time
+PROBE_TIMEOUT = 1.0
+# where save_layout keeps the controllers of the lab bench
+LAB_LAYOUT_FILE = "lab_layout.json"
+
+
+class ProbeResult(NamedTuple):
+    port: str
+    serial_number: str  # None for ports without one, such as the simulator
+    kind: str  # "pump", "autosampler" or None if the device did not answer like a Pico
+    version: str
+    response: str  # the ping reply, or the error
+    seconds: float
+
+    @property
+    def key(self) -> str:
+        """What a lab layout remembers a controller by, the serial number when there is one."""
+        return self.serial_number or self.port
+
+
+def classify(ping_response: str) -> tuple:
+    """Return (kind, version) for a ping reply, (None, None) for anything else."""
+    for kind, marker in (("pump", PUMP_PING), ("autosampler", AUTOSAMPLER_PING)):
+        if marker in ping_response:
+            version = ping_response.split(marker, 1)[1].split()
+            return kind, version[0] if version else ""
+    return None, None
+
+
+def probe_port(port: str, serial_number: str = None, timeout=PROBE_TIMEOUT):
+    """Ping one port and report what answered, the port is closed again afterwards."""
+    start = time.perf_counter()
+    deadline = start + timeout
+    try:
+        with serial.serial_for_url(
+            port, baudrate=115200, timeout=timeout
+        ) as serial_port:
+            serial_port.reset_input_buffer()
+            serial_port.write(b"0:ping\n")
+            while time.perf_counter() < deadline:
+                serial_port.timeout = max(deadline - time.perf_counter(), 0)
+                response = serial_port.readline().decode("utf-8", errors="replace")
+                if not response:
+                    break  # timed out
+                response = response.strip()
+                if "Control Version" in response:
+                    kind, version = classify(response)
+                    return ProbeResult(
+                        port,
+                        serial_number,
+                        kind,
+                        version,
+                        response,
+                        time.perf_counter() - start,
+                    )
+            response = "Error: no ping reply"
+    except Exception as e:
+        response = f"Error: {e}"
+    return ProbeResult(
+        port, serial_number, None, None, response, time.perf_counter() - start
+    )
+
+
+def discover(ports: list = None, timeout=PROBE_TIMEOUT) -> list:
+    """Probe every port in parallel, by default all the Pico ports in the port registry.
+
+    ports may hold port names or (port, serial number) pairs. Takes about one timeout however
+    many ports there are.
+    """
+    if ports is None:
+        ports = [
+            (port.device, port.serial_number)
+            for port in get_port_registry().get_ports()
+        ]
+    ports = [(port, None) if isinstance(port, str) else port for port in ports]
+    if not ports:
+        return []
+    with ThreadPoolExecutor(max_workers=len(ports)) as executor:
+        results = list(
+            executor.map(
+                lambda port: probe_port(port[0], port[1], timeout),
+                ports,
+            )
+        )
+    for result in results:
+        logging.debug(
+            f"Probed {result.port} (SN:{result.serial_number}) in {result.seconds:.3f} s: {result.kind or result.response}"
+        )
+    return results
+
+
+def save_layout(layout: dict, file_name: str = LAB_LAYOUT_FILE) -> None:
+    """Save {"pumps": [key, ...], "autosamplers": [key, ...]} as the lab layout."""
+    with open(file_name, "w") as f:
+        json.dump(layout, f, indent=2)
+
+
+def load_layout(file_name: str = LAB_LAYOUT_FILE) -> dict:
+    """Return the saved lab layout, empty if there is none."""
+    try:
+        with open(file_name) as f:
+            layout = json.load(f)
+    except FileNotFoundError:
+        layout = {}
+    return {
+        "pumps": layout.get("pumps", []),
+        "autosamplers": layout.get("autosamplers", []),
+    }
+
+
+def match_layout(layout: dict, results: list) -> dict:
+    """Pick the probed ports that belong to the layout, {"pumps": [port], "autosamplers": [port]}.
+
+    A controller is matched by its key and must still answer as the same kind of Pico.
+    """
+    found = {result.key: result for result in results}
+    matched = {}
+    for group, kind in (("pumps", "pump"), ("autosamplers", "autosampler")):
+        matched[group] = []
+        for key in layout.get(group, []):
+            result = found.get(key)
+            if result is None:
+                logging.warning(f"Lab layout {kind} {key} was not found")
+            elif result.kind != kind:
+                logging.warning(
+                    f"Lab layout {kind} {key} answered as {result.kind}: {result.response}"
+                )
+            else:
+                matched[group].append(result.port)
+    return matched
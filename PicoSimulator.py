@@ -0,0 +1,471 @@
+import os
+import copy
+import json
+import time
+import socket
+import select
+import logging
+import argparse
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+from BinaryProtocol import BINARY_CAPABILITY, BINARY_ACK, encode_reply
+
+
+class VirtualPico:
+    """Command handling shared by the virtual Picos, every command returns its text reply."""
+
+    def __init__(self, version: str = "1.0"):
+        self.version = version
+        self.rtc_offset = timedelta(0)  # RTC time minus host time
+        self.binary = False  # send binary frames instead of text lines
+        self.commands_handled = 0
+
+    def ping_reply(self) -> str:
+        raise NotImplementedError
+
+    def handle(self, command: str) -> str:
+        """Run one command line and return the reply, without the trailing newline."""
+        self.commands_handled += 1
+        try:
+            return self.dispatch(command.strip())
+        except (ValueError, IndexError, KeyError) as e:
+            return f"Error: Invalid command '{command.strip()}': {e}"
+
+    def dispatch(self, command: str) -> str:
+        raise NotImplementedError
+
+    def encode(self, reply: str) -> bytes:
+        return f"{reply}\n".encode()
+
+    def rtc_now(self) -> datetime:
+        return datetime.now() + self.rtc_offset
+
+    def rtc_time_reply(self) -> str:
+        now = self.rtc_now()
+        # the Pico does not zero pad the date and time fields
+        return f"RTC Time: {now.year}-{now.month}-{now.day} {now.hour}:{now.minute}:{now.second}"
+
+    def set_rtc_time(self, fields: list) -> str:
+        year, month, day, hour, minute, second = map(int, fields)
+        rtc_time = datetime(year, month, day, hour, minute, second)
+        self.rtc_offset = rtc_time - datetime.now()
+        return "Success: RTC time synced"
+
+
+class VirtualPumpPico(VirtualPico):
+    """A pump controller Pico, pumps are registered and toggled like on the real firmware."""
+
+    def __init__(
+        self, num_pumps: int = 2, version: str = "1.1", binary_capable: bool = True
+    ):
+        super().__init__(version)
+        self.binary_capable = binary_capable
+        self.pumps = {}
+        for pump_id in range(1, num_pumps + 1):
+            self.register(pump_id, 2 * pump_id - 2, 2 * pump_id - 1, 0, 0, "OFF", "CW")
+        self.saved_pumps = copy.deepcopy(self.pumps)
+
+    def ping_reply(self) -> str:
+        reply = f"Ping: Pico Pump Control Version {self.version}"
+        if self.binary_capable:
+            reply += f" {BINARY_CAPABILITY}"
+        return reply
+
+    def encode(self, reply: str) -> bytes:
+        if self.binary:
+            return encode_reply(reply)
+        return super().encode(reply)
+
+    def register(
+        self,
+        pump_id: int,
+        power_pin: int,
+        direction_pin: int,
+        initial_power_pin_value: int,
+        initial_direction_pin_value: int,
+        initial_power_status: str,
+        initial_direction_status: str,
+    ) -> None:
+        self.pumps[pump_id] = {
+            "power_pin": power_pin,
+            "direction_pin": direction_pin,
+            "initial_power_pin_value": initial_power_pin_value,
+            "initial_direction_pin_value": initial_direction_pin_value,
+            "power_status": initial_power_status,
+            "direction_status": initial_direction_status,
+        }
+
+    def info_reply(self) -> str:
+        if not self.pumps:
+            return "Info: No pumps registered."
+        return ", ".join(
+            f"Pump{pump_id} Info: Power Pin: {pump['power_pin']}, Direction Pin: {pump['direction_pin']}, "
+            f"Initial Power Pin Value: {pump['initial_power_pin_value']}, "
+            f"Initial Direction Pin Value: {pump['initial_direction_pin_value']}, "
+            f"Current Power Status: {pump['power_status']}, Current Direction Status: {pump['direction_status']}"
+            for pump_id, pump in sorted(self.pumps.items())
+        )
+
+    def status_reply(self) -> str:
+        if not self.pumps:
+            return "Info: No pumps registered."
+        return ", ".join(
+            f"Pump{pump_id} Status: Power: {pump['power_status']}, Direction: {pump['direction_status']}"
+            for pump_id, pump in sorted(self.pumps.items())
+        )
+
+    def selected_pumps(self, pump_id: int) -> list:
+        # pump 0 addresses every pump
+        if pump_id == 0:
+            return list(self.pumps)
+        if pump_id not in self.pumps:
+            raise KeyError(f"Pump{pump_id} not found")
+        return [pump_id]
+
+    def dispatch(self, command: str) -> str:
+        target, _, rest = command.partition(":")
+        if not rest:
+            # the autosampler style commands without a pump id
+            target, rest = "0", command
+        pump_id = int(target)
+        name, _, args = rest.partition(":")
+        args = args.split(":") if args else []
+
+        if name == "ping":
+            self.binary = False  # ping always resets the reply mode
+            return self.ping_reply()
+        if name == "binary":
+            if not self.binary_capable:
+                return "Error: Binary mode not supported"
+            return BINARY_ACK  # the caller switches after the ack is written
+        if name == "stime":
+            return self.set_rtc_time(args)
+        if name == "time":
+            return self.rtc_time_reply()
+        if name == "info":
+            return self.info_reply()
+        if name == "st":
+            return self.status_reply()
+        if name == "pw":
+            for pid in self.selected_pumps(pump_id):
+                pump = self.pumps[pid]
+                pump["power_status"] = "OFF" if pump["power_status"] == "ON" else "ON"
+            return f"Success: Pump{pump_id} power toggled"
+        if name == "di":
+            for pid in self.selected_pumps(pump_id):
+                pump = self.pumps[pid]
+                pump["direction_status"] = (
+                    "CW" if pump["direction_status"] == "CCW" else "CCW"
+                )
+            return f"Success: Pump{pump_id} direction toggled"
+        if name == "reg":
+            if pump_id <= 0:
+                return "Error: Invalid pump id"
+            power_pin, direction_pin, power_value, direction_value = map(int, args[:4])
+            power_status, direction_status = args[4], args[5]
+            self.register(
+                pump_id,
+                power_pin,
+                direction_pin,
+                power_value,
+                direction_value,
+                power_status,
+                direction_status,
+            )
+            return f"Success: Pump{pump_id} registered"
+        if name == "clr":
+            for pid in self.selected_pumps(pump_id):
+                del self.pumps[pid]
+            return f"Success: Pump{pump_id} removed"
+        if name == "save":
+            self.saved_pumps = copy.deepcopy(self.pumps)
+            return "Success: Configuration saved"
+        if name == "shutdown":
+            for pump in self.pumps.values():
+                pump["power_status"] = "OFF"
+            return "Success: Emergency shutdown, all pumps are off"
+        if name == "reset":
+            self.pumps = copy.deepcopy(self.saved_pumps)
+            self.binary = False
+            return "Success: Pico reset"
+        return f"Error: Unknown command '{command}'"
+
+
+class VirtualAutosamplerPico(VirtualPico):
+    """An autosampler Pico with a slot table and a stepper position."""
+
+    def __init__(
+        self,
+        slots: dict = None,
+        position: int = 0,
+        steps_per_second: float = 10000.0,
+        version: str = "1.0",
+    ):
+        super().__init__(version)
+        self.slots = dict(slots) if slots else {"waste": 0, "1": 100, "2": 200}
+        self.saved_slots = dict(self.slots)
+        self.position = position
+        self.direction = "Right"
+        self.steps_per_second = steps_per_second  # only used for the reported move time
+
+    def ping_reply(self) -> str:
+        return f"Ping: Pico Autosampler Control Version {self.version}"
+
+    def move_to(self, position: int) -> tuple:
+        relative_position = abs(position - self.position)
+        if position != self.position:
+            self.direction = "Right" if position > self.position else "Left"
+        self.position = position
+        return relative_position, relative_position / self.steps_per_second
+
+    def dispatch(self, command: str) -> str:
+        if command.startswith("0:"):
+            command = command[2:]
+        name, _, args = command.partition(":")
+        args = args.split(":") if args else []
+
+        if name == "ping":
+            return self.ping_reply()
+        if name == "stime":
+            return self.set_rtc_time(args)
+        if name == "time":
+            return self.rtc_time_reply()
+        if name == "config":
+            return f"Autosampler Configuration: {json.dumps(self.slots)}"
+        if name == "status":
+            return f"Autosampler Status: position: {self.position}, direction: {self.direction}"
+        if name == "position":
+            position = int(args[0])
+            if position < 0:
+                return "Error: Invalid position"
+            relative_position, seconds = self.move_to(position)
+            return f"Info: moved to position {position} in {seconds:.6f} seconds. relative position: {relative_position}"
+        if name == "slot":
+            slot = args[0]
+            if slot not in self.slots:
+                return f"Error: Slot '{slot}' not found"
+            relative_position, seconds = self.move_to(self.slots[slot])
+            return f"Info: moved to slot {slot} in {seconds:.6f} seconds. relative position: {relative_position}"
+        if name == "move":
+            if args[0] not in ("left", "right"):
+                return "Error: Invalid direction"
+            self.direction = args[0].capitalize()
+            self.position = max(0, self.position + (1 if args[0] == "right" else -1))
+            return f"Success: Moved one step {self.direction}, current position: {self.position}"
+        if name == "addslot":
+            slot, position = args[0], int(args[1])
+            self.slots[slot] = position
+            return f"Success: Slot '{slot}' added at position {position}."
+        if name == "removeslot":
+            slot = args[0]
+            if self.slots.pop(slot, None) is None:
+                return f"Error: Slot '{slot}' not found"
+            return f"Success: Slot '{slot}' removed."
+        if name == "save_config":
+            self.saved_slots = dict(self.slots)
+            return f"Success: Configuration saved: {json.dumps(self.slots)}"
+        if name in ("shutdown", "reset"):
+            return f"Success: Autosampler {name} done"
+        return f"Error: Unknown command '{command}'"
+
+
+class PicoSimulator:
+    """Serve a virtual Pico on a pseudo-terminal or a TCP socket from a background thread.
+
+    Controllers connect to simulator.port, a pty device path (/dev/pts/N) or a socket:// url
+    pyserial's serial_for_url understands. Commands are handled one line at a time like on the
+    Pico. reply_latency adds a fixed processing delay, baudrate paces the reply bytes at the rate
+    of a real UART (10 bits per byte), None sends them as fast as the transport allows.
+    link_latency delays every reply on its way back without holding up the next command, like
+    the round trip of a USB link, so it rewards hosts that keep several commands in flight.
+    """
+
+    def __init__(
+        self,
+        device: VirtualPico,
+        transport: str = "pty",
+        reply_latency: float = 0.0,
+        baudrate: int = None,
+        host: str = "127.0.0.1",
+        tcp_port: int = 0,
+        link_latency: float = 0.0,
+    ):
+        if transport not in ("pty", "socket"):
+            raise ValueError(f"Unknown transport: {transport}")
+        self.device = device
+        self.transport = transport
+        self.reply_latency = reply_latency
+        self.baudrate = baudrate
+        self.link_latency = link_latency
+        self.host = host
+        self.tcp_port = tcp_port
+        self.port = None
+        self.bytes_sent = 0
+        self.running = False
+        self.thread = None
+        self.master_fd = None
+        self.slave_fd = None
+        self.server = None
+        self.client = None
+
+    def start(self) -> str:
+        """Start serving and return the port name controllers should connect to."""
+        if self.transport == "pty":
+            import tty  # POSIX only
+
+            self.master_fd, self.slave_fd = os.openpty()
+            tty.setraw(self.slave_fd)
+            self.port = os.ttyname(self.slave_fd)
+            target = self.serve_pty
+        else:
+            self.server = socket.create_server((self.host, self.tcp_port))
+            self.tcp_port = self.server.getsockname()[1]
+            self.port = f"socket://{self.host}:{self.tcp_port}"
+            target = self.serve_socket
+        self.running = True
+        self.thread = threading.Thread(target=target, daemon=True)
+        self.thread.start()
+        logging.info(f"{type(self.device).__name__} simulated on {self.port}")
+        return self.port
+
+    def stop(self) -> None:
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1)
+            self.thread = None
+        for fd in (self.master_fd, self.slave_fd):
+            if fd is not None:
+                os.close(fd)
+        self.master_fd = self.slave_fd = None
+        for sock in (self.client, self.server):
+            if sock is not None:
+                sock.close()
+        self.client = self.server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def serve_pty(self) -> None:
+        # the slave end stays open here, so reads don't fail while no controller is attached
+        self.serve(
+            lambda: os.read(self.master_fd, 4096),
+            lambda data: os.write(self.master_fd, data),
+            self.master_fd,
+        )
+
+    def serve_socket(self) -> None:
+        while self.running:
+            readable, _, _ = select.select([self.server], [], [], 0.1)
+            if not readable:
+                continue
+            self.client, _ = self.server.accept()
+            self.client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.serve(lambda: self.client.recv(4096), self.client.sendall, self.client)
+            self.client.close()
+            self.client = None
+            self.device.binary = False  # a new connection starts in text mode
+
+    def serve(self, read, write, waitable) -> None:
+        buffer = bytearray()
+        in_flight = deque()  # (due time, payload) of replies still on the link
+        while self.running:
+            timeout = 0.1
+            if in_flight:
+                timeout = max(in_flight[0][0] - time.perf_counter(), 0)
+            readable, _, _ = select.select([waitable], [], [], timeout)
+            if readable:
+                try:
+                    data = read()
+                except OSError:
+                    return
+                if not data:
+                    return  # the client closed the socket
+                buffer += data
+                while b"\n" in buffer:
+                    line, _, rest = buffer.partition(b"\n")
+                    buffer = bytearray(rest)
+                    command = line.decode("utf-8", errors="replace").strip()
+                    if not command:
+                        continue
+                    payload = self.reply(command)
+                    if self.link_latency:
+                        in_flight.append(
+                            (time.perf_counter() + self.link_latency, payload)
+                        )
+                    else:
+                        self.send(payload, write)
+            while in_flight and in_flight[0][0] <= time.perf_counter():
+                self.send(in_flight.popleft()[1], write)
+
+    def reply(self, command: str) -> bytes:
+        response = self.device.handle(command)
+        payload = self.device.encode(response)
+        if response == BINARY_ACK:
+            self.device.binary = True  # every reply after the ack is a frame
+        if self.reply_latency:
+            time.sleep(self.reply_latency)
+        if self.baudrate:
+            time.sleep(len(payload) * 10 / self.baudrate)
+        return payload
+
+    def send(self, payload: bytes, write) -> None:
+        try:
+            write(payload)
+        except OSError as e:
+            logging.error(f"Error: {e}")
+            return
+        self.bytes_sent += len(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a virtual Pico controller.")
+    parser.add_argument("device", choices=["pump", "autosampler"])
+    parser.add_argument("--transport", choices=["pty", "socket"], default="pty")
+    parser.add_argument("--tcp-port", type=int, default=0)
+    parser.add_argument("--pumps", type=int, default=2, help="number of pumps")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="reply latency in seconds"
+    )
+    parser.add_argument(
+        "--link-latency",
+        type=float,
+        default=0.0,
+        help="delay of every reply on the link in seconds",
+    )
+    parser.add_argument(
+        "--baudrate", type=int, default=None, help="pace replies at this baud rate"
+    )
+    parser.add_argument(
+        "--text-only", action="store_true", help="don't advertise binary mode"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.device == "pump":
+        device = VirtualPumpPico(args.pumps, binary_capable=not args.text_only)
+    else:
+        device = VirtualAutosamplerPico()
+    simulator = PicoSimulator(
+        device,
+        transport=args.transport,
+        reply_latency=args.latency,
+        baudrate=args.baudrate,
+        tcp_port=args.tcp_port,
+        link_latency=args.link_latency,
+    )
+    print(f"Simulated {args.device} controller on {simulator.start()}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import time
+import threading
+from typing import NamedTuple
+
+
+class PollCadence(NamedTuple):
+    min_interval: float  # seconds between polls right after the reply changed
+    max_interval: float  # the interval backs off up to this while nothing changes
+    active_interval: float  # upper bound for the interval while a procedure runs
+
+
+# the status and pump info queries of a pump controller
+PUMP_POLLING = {
+    "0:st": PollCadence(1.0, 30.0, 2.0),
+    "0:info": PollCadence(10.0, 600.0, 60.0),
+}
+# the status and slot configuration queries of an autosampler
+AUTOSAMPLER_POLLING = {
+    "status": PollCadence(1.0, 30.0, 2.0),
+    "config": PollCadence(30.0, 600.0, 120.0),
+}
+# the interval is multiplied by this after every reply that did not change
+BACKOFF = 2.0
+# bytes per second the polls of all controllers together may put on the serial links
+POLL_BUDGET = 2000
+POLL_BURST = 1000
+# reply size assumed for a query until its first reply arrives
+DEFAULT_REPLY_BYTES = 64
+# seconds before a poll is tried again while other commands are in flight
+BUSY_RETRY = 0.05
+
+
+class BandwidthBudget:
+    """Token bucket for the status polls of every controller, counted in bytes both ways.
+
+    A poll larger than the burst can never be covered in full, it goes out once the bucket is
+    full and leaves the bucket in debt, so the average rate still holds.
+    """
+
+    def __init__(self, rate: float = POLL_BUDGET, burst: float = POLL_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_spend(self, cost: float, now: float = None) -> bool:
+        with self.lock:
+            self.refill(now if now is not None else time.monotonic())
+            if self.tokens < min(cost, self.burst):
+                return False
+            self.tokens -= cost
+            return True
+
+    def wait_time(self, cost: float, now: float = None) -> float:
+        """Seconds until cost bytes are available."""
+        with self.lock:
+            self.refill(now if now is not None else time.monotonic())
+            return max(min(cost, self.burst) - self.tokens, 0) / self.rate
+
+
+class PollingScheduler:
+    """Decides when the status queries of one controller are sent.
+
+    Every query has its own cadence: after a reply that changed something it is polled again
+    after min_interval, every unchanged reply doubles the interval up to max_interval, and while
+    a procedure runs the interval is capped at active_interval. Queries the controller sends on
+    its own, like the status query after a toggle, reset the timer of the poll. Polls spend the
+    shared bandwidth budget and should only be queued while no other command is waiting, so they
+    never hold up the commands of a recipe.
+    """
+
+    def __init__(self, cadences: dict, budget: BandwidthBudget = None):
+        self.cadences = cadences
+        self.budget = budget if budget is not None else get_bandwidth_budget()
+        self.active = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, now: float = None) -> None:
+        """Start over at the fastest cadence, e.g. after connecting."""
+        now = now if now is not None else time.monotonic()
+        with self.lock:
+            self.queries = {
+                query: {
+                    "interval": cadence.min_interval,
+                    "sent": now,
+                    "next": now + cadence.min_interval,
+                    "reply_bytes": DEFAULT_REPLY_BYTES,
+                }
+                for query, cadence in self.cadences.items()
+            }
+
+    def set_active(self, active: bool) -> None:
+        """Poll at the procedure cadence while a procedure runs."""
+        with self.lock:
+            self.active = active
+            for query, state in self.queries.items():
+                state["next"] = state["sent"] + self.interval(query)
+
+    def interval(self, query: str) -> float:
+        interval = self.queries[query]["interval"]
+        if self.active:
+            interval = min(interval, self.cadences[query].active_interval)
+        return interval
+
+    def sent(self, query: str, now: float = None) -> None:
+        """Note a query sent outside of the schedule, its next poll is a full interval away."""
+        if query in self.queries:
+            now = now if now is not None else time.monotonic()
+            with self.lock:
+                state = self.queries[query]
+                state["sent"] = now
+                state["next"] = now + self.interval(query)
+
+    def result(self, query: str, changed: bool, reply_bytes: int = None) -> None:
+        """Adapt the cadence of query to its latest reply."""
+        if query not in self.queries:
+            return
+        with self.lock:
+            state = self.queries[query]
+            cadence = self.cadences[query]
+            if changed:
+                state["interval"] = cadence.min_interval
+            else:
+                state["interval"] = min(
+                    state["interval"] * BACKOFF, cadence.max_interval
+                )
+            if reply_bytes:
+                state["reply_bytes"] = reply_bytes
+            state["next"] = state["sent"] + self.interval(query)
+
+    def cost(self, query: str) -> int:
+        return len(query) + 1 + self.queries[query]["reply_bytes"]
+
+    def due(self, now: float = None) -> list:
+        """Return the queries to send now and count them as sent."""
+        now = now if now is not None else time.monotonic()
+        due = []
+        with self.lock:
+            for query, state in self.queries.items():
+                if state["next"] > now:
+                    continue
+                if self.budget.try_spend(self.cost(query), now):
+                    state["sent"] = now
+                    state["next"] = now + self.interval(query)
+                    due.append(query)
+        return due
+
+    def next_due_in(self, now: float = None) -> float:
+        """Seconds until due() returns a poll, counting the wait for the bandwidth budget."""
+        now = now if now is not None else time.monotonic()
+        with self.lock:
+            wait = min(
+                max(state["next"] - now, self.budget.wait_time(self.cost(query), now))
+                for query, state in self.queries.items()
+            )
+        return max(wait, 0.0)
+
+
+bandwidth_budget = None
+bandwidth_budget_lock = threading.Lock()
+
+
+def get_bandwidth_budget() -> BandwidthBudget:
+    """The polling budget shared by every controller in this process."""
+    global bandwidth_budget
+    with bandwidth_budget_lock:
+        if bandwidth_budget is None:
+            bandwidth_budget = BandwidthBudget()
+        return bandwidth_budget
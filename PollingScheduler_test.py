@@ -0,0 +1,79 @@
+import pytest
+
+from PollingScheduler import BandwidthBudget, PollCadence, PollingScheduler
+
+
+def test_budget_spends_up_to_burst():
+    budget = BandwidthBudget(rate=100, burst=200)
+    budget.updated = 0.0
+    assert budget.try_spend(150, now=0.0)
+    assert not budget.try_spend(100, now=0.0)
+    # half a second refills 50 bytes
+    assert budget.wait_time(100, now=0.0) == pytest.approx(0.5)
+    assert budget.try_spend(100, now=0.5)
+
+
+def test_budget_oversized_cost_waits_for_full_bucket():
+    budget = BandwidthBudget(rate=100, burst=200)
+    budget.updated = 0.0
+    assert budget.try_spend(150, now=0.0)
+    assert not budget.try_spend(500, now=0.0)
+    assert budget.wait_time(500, now=0.0) == pytest.approx(1.5)
+    # a full bucket lets the oversized poll through and leaves a debt
+    assert budget.try_spend(500, now=1.5)
+    assert budget.tokens == pytest.approx(-300)
+    assert budget.wait_time(10, now=1.5) == pytest.approx(3.1)
+
+
+def test_scheduler_polls_query_larger_than_burst():
+    budget = BandwidthBudget(rate=100, burst=200)
+    budget.updated = 0.0
+    polling = PollingScheduler({"0:info": PollCadence(1.0, 60.0, 2.0)}, budget)
+    polling.reset(now=0.0)
+    polling.result("0:info", changed=True, reply_bytes=1257)
+    assert polling.cost("0:info") > budget.burst
+
+    sent = []
+    now = 0.0
+    # follow the waits next_due_in() asks for, like the worker does
+    for _ in range(10):
+        now += polling.next_due_in(now)
+        due = polling.due(now)
+        assert due or polling.next_due_in(now) > 0
+        sent += [now for _ in due]
+    assert len(sent) >= 2
+    # the debt keeps the average rate within the budget
+    assert (len(sent) - 1) * polling.cost("0:info") / (sent[-1] - sent[0]) <= 100.0
+
+
+def test_next_due_in_matches_due():
+    budget = BandwidthBudget(rate=100, burst=100)
+    budget.updated = 0.0
+    polling = PollingScheduler(
+        {"big": PollCadence(0.1, 0.1, 0.1), "small": PollCadence(0.3, 0.3, 0.3)},
+        budget,
+    )
+    polling.reset(now=0.0)
+    polling.result("big", changed=True, reply_bytes=1000)
+    polling.result("small", changed=True, reply_bytes=10)
+    assert budget.try_spend(100, now=0.0)
+    # big is due first but waits for a full bucket, small fits once it is due
+    assert polling.due(now=0.1) == []
+    assert polling.next_due_in(now=0.1) == pytest.approx(0.2)
+    assert polling.due(now=0.3) == ["small"]
+    # small again at 0.6, big still short of a full bucket
+    assert polling.next_due_in(now=0.3) == pytest.approx(0.3)
+    assert polling.due(now=0.6) == ["small"]
+
+
+def test_unchanged_replies_back_off():
+    budget = BandwidthBudget(rate=1e6, burst=1e6)
+    polling = PollingScheduler({"0:st": PollCadence(1.0, 4.0, 2.0)}, budget)
+    polling.reset(now=0.0)
+    for interval in (2.0, 4.0, 4.0):
+        polling.result("0:st", changed=False)
+        assert polling.interval("0:st") == interval
+    polling.set_active(True)
+    assert polling.interval("0:st") == 2.0
+    polling.result("0:st", changed=True)
+    assert polling.interval("0:st") == 1.0
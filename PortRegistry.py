@@ -0,0 +1,201 @@
+import os
+import sys
+import time
+import struct
+import select
+import socket
+import logging
+import threading
+
+import serial.tools.list_ports
+
+# Define Pi Pico vendor ID
+pico_vid = 0x2E8A
+
+# rescan at this interval when no hotplug notifications are available
+POLL_INTERVAL = 5.0
+# udev creates the /dev node shortly after the kernel announces a device
+UEVENT_SETTLE_TIME = 0.5
+# serial ports appear in /dev under these prefixes on Linux
+TTY_PREFIXES = (b"ttyACM", b"ttyUSB", b"ttyS", b"ttyAMA")
+
+# inotify constants from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_EVENT = struct.Struct("iIII")  # wd, mask, cookie, name length
+# netlink constants from <linux/netlink.h>
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+
+
+def port_label(port) -> str:
+    """How a port is shown in the port lists, parsed back with split("(")[0]."""
+    return f"{port.device} (SN:{port.serial_number})"
+
+
+class PortRegistry:
+    """Cached list of the attached Pico serial ports, rescanned only when a device comes or goes.
+
+    On Linux a watcher thread marks the cache stale on inotify events for /dev or, without
+    inotify, on netlink uevents for the tty subsystem. Elsewhere the cache simply expires after
+    poll_interval. get_ports is a list lookup while nothing changed, generation tells callers
+    whether they need to redraw.
+    """
+
+    def __init__(self, vid: int = pico_vid, poll_interval: float = POLL_INTERVAL):
+        self.vid = vid
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.ports = []
+        self.generation = 0  # bumped every time the port list changes
+        self.stale = True
+        self.last_scan = 0.0
+        self.watch_method = "polling"
+        self.watcher_thread = None
+        self.running = False
+        self.listeners = []  # called with the new port list after a change
+
+    def start(self) -> None:
+        """Start watching for hotplug events, falls back to polling if none are available."""
+        if self.running:
+            return
+        self.running = True
+        if sys.platform.startswith("linux"):
+            for method, open_watch, read_watch in (
+                ("inotify", self.open_inotify, self.read_inotify),
+                ("netlink", self.open_netlink, self.read_netlink),
+            ):
+                try:
+                    fd = open_watch()
+                except Exception as e:
+                    logging.debug(f"{method} port watcher not available: {e}")
+                    continue
+                self.watch_method = method
+                self.watcher_thread = threading.Thread(
+                    target=self.watch,
+                    args=(fd, read_watch),
+                    name="port registry",
+                    daemon=True,
+                )
+                self.watcher_thread.start()
+                break
+        logging.info(f"Watching serial ports by {self.watch_method}")
+
+    def stop(self) -> None:
+        self.running = False
+        if self.watcher_thread:
+            self.watcher_thread.join(2)
+            self.watcher_thread = None
+        self.watch_method = "polling"
+
+    def invalidate(self) -> None:
+        self.stale = True
+
+    def get_ports(self, exclude=()) -> list:
+        """Return the Pico ports, minus the ones whose device is in exclude."""
+        if self.stale or (
+            self.watch_method == "polling"
+            and time.monotonic() - self.last_scan >= self.poll_interval
+        ):
+            self.scan()
+        return [port for port in self.ports if port.device not in exclude]
+
+    def scan(self) -> None:
+        with self.lock:
+            # clear first, an event arriving during the scan triggers another one
+            self.stale = False
+            self.last_scan = time.monotonic()
+            ports = sorted(
+                (
+                    port
+                    for port in serial.tools.list_ports.comports()
+                    if port.vid == self.vid
+                ),
+                key=lambda port: port.device,
+            )
+            if [port_label(port) for port in ports] == [
+                port_label(port) for port in self.ports
+            ]:
+                return
+            known = {port.device for port in self.ports}
+            for port in ports:
+                if port.device not in known:
+                    logging.debug(
+                        f"Port added: name: {port.name}, description: {port.description}, device: {port.device}, hwid: {port.hwid}, manufacturer: {port.manufacturer}, pid: {hex(port.pid or 0)}, serial_number: {port.serial_number}"
+                    )
+            self.ports = ports
+            self.generation += 1
+        for listener in self.listeners:
+            try:
+                listener(ports)
+            except Exception as e:
+                logging.error(f"Error: port listener failed: {e}")
+
+    def watch(self, fd: int, read_watch) -> None:
+        try:
+            while self.running:
+                # wake up regularly to notice stop()
+                readable, _, _ = select.select([fd], [], [], 1.0)
+                if readable and read_watch(fd):
+                    self.invalidate()
+        except Exception as e:
+            logging.error(f"Error: port watcher stopped, polling instead: {e}")
+            self.watch_method = "polling"
+        finally:
+            os.close(fd)
+
+    def open_inotify(self) -> int:
+        import ctypes
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(fd, b"/dev", IN_CREATE | IN_DELETE | IN_ATTRIB) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, "inotify_add_watch failed")
+        return fd
+
+    def read_inotify(self, fd: int) -> bool:
+        """Return True if a tty node was created, deleted or changed its permissions."""
+        data = os.read(fd, 4096)
+        changed = False
+        offset = 0
+        while offset + IN_EVENT.size <= len(data):
+            _, _, _, length = IN_EVENT.unpack_from(data, offset)
+            offset += IN_EVENT.size
+            name = data[offset : offset + length].rstrip(b"\x00")
+            offset += length
+            changed = changed or name.startswith(TTY_PREFIXES)
+        return changed
+
+    def open_netlink(self) -> int:
+        sock = socket.socket(
+            socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT
+        )
+        sock.bind((0, UEVENT_KERNEL_GROUP))
+        return sock.detach()
+
+    def read_netlink(self, fd: int) -> bool:
+        message = os.read(fd, 8192)
+        if b"SUBSYSTEM=tty" not in message:
+            return False
+        # the kernel event comes before udev creates the /dev node pyserial lists
+        threading.Timer(UEVENT_SETTLE_TIME, self.invalidate).start()
+        return True
+
+
+port_registry = None
+port_registry_lock = threading.Lock()
+
+
+def get_port_registry() -> PortRegistry:
+    """The registry shared by everything in this process, started on first use."""
+    global port_registry
+    with port_registry_lock:
+        if port_registry is None:
+            port_registry = PortRegistry()
+            port_registry.start()
+        return port_registry
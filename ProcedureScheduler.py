@@ -0,0 +1,248 @@
+import heapq
+import logging
+import threading
+import time
+from itertools import islice
+from typing import NamedTuple
+
+# the last stretch before a deadline is spun instead of slept, it starts at this many nanoseconds
+SPIN_NS = 1_000_000
+# the spin window follows the measured oversleep of the waits, within these bounds, the spin
+# holds the GIL so it is kept short even where the sleeps overshoot by more
+MIN_SPIN_NS = 200_000
+MAX_SPIN_NS = 1_000_000
+# weight of the latest oversleep in its running average
+OVERSLEEP_WEIGHT = 0.1
+# steps taken from the source at a time, the heap is refilled once it holds less than half
+LOOKAHEAD = 64
+# returned by next_step() when the heap needs steps from the source
+REFILL = "refill"
+
+
+class StepTiming(NamedTuple):
+    index: int
+    # the deadline of the step, nanoseconds from the start of the procedure
+    planned_ns: int
+    # when the step was fired, on the same clock
+    actual_ns: int
+
+    @property
+    def lateness_ns(self) -> int:
+        return self.actual_ns - self.planned_ns
+
+
+class ProcedureScheduler:
+    """Fire the steps of a procedure at their deadlines from a thread of its own.
+
+    Pending steps are kept in a heap of (deadline, index), filled LOOKAHEAD at a time from the
+    steps passed to start(), so they can be produced lazily, e.g. by a streamed recipe. The
+    thread sleeps on a condition until the earliest deadline is a spin window of at most a
+    millisecond away and spins for the rest, so a step fires within microseconds of its deadline
+    however busy the GUI is, while the other threads only lose the GIL for that millisecond. The
+    window adapts to how much the sleeps overshoot on this machine. Deadlines count from the
+    start of the procedure, a late step does not push back the ones after it, steps that are
+    already due fire right away in order. Pausing shifts the start by the paused time.
+    fire(index) runs on the scheduler thread and must only do thread safe work, e.g. put
+    commands on a queue.
+    """
+
+    def __init__(self, fire, name: str = "procedure scheduler", spin_ns: int = SPIN_NS):
+        self.fire = fire
+        self.name = name
+        self.spin_ns = spin_ns
+        self.oversleep_ns = 0.0
+        self.heap = []
+        self.start_ns = None  # monotonic time of deadline 0
+        self.paused_at = None
+        self.timings = []
+        # iterator of the steps not in the heap yet, None once it is exhausted
+        self.steps = None
+        # the step being fired, done() waits for it
+        self.firing = False
+        # the exception the steps raised, if any
+        self.error = None
+        # counts start() and cancel(), a step popped before either is dropped
+        self.generation = 0
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def start(self, steps, start_ns: int = None) -> None:
+        """Schedule the steps, (deadline, index) pairs in order of their deadlines.
+
+        Deadlines are in nanoseconds after start_ns, steps may be any iterable, it is only read
+        as the procedure gets to the steps.
+        """
+        start_ns = start_ns if start_ns is not None else time.monotonic_ns()
+        with self.condition:
+            self.heap = []
+            self.steps = iter(steps)
+            self.error = None
+            self.start_ns = start_ns
+            self.paused_at = None
+            self.timings = []
+            self.generation += 1
+            if not self.running:
+                self.running = True
+                self.thread = threading.Thread(
+                    target=self.run, name=self.name, daemon=True
+                )
+                self.thread.start()
+            self.condition.notify()
+
+    def schedule(self, deadline_ns: int, index: int) -> None:
+        """Add one step to the running procedure."""
+        with self.condition:
+            heapq.heappush(self.heap, (int(deadline_ns), index))
+            self.condition.notify()
+
+    def pause(self, now_ns: int = None) -> None:
+        with self.condition:
+            if self.paused_at is None:
+                self.paused_at = now_ns if now_ns is not None else time.monotonic_ns()
+                self.condition.notify()
+
+    def resume(self, now_ns: int = None) -> None:
+        """Continue after a pause, every remaining deadline moves by the paused time."""
+        with self.condition:
+            if self.paused_at is not None:
+                now_ns = now_ns if now_ns is not None else time.monotonic_ns()
+                self.start_ns += now_ns - self.paused_at
+                self.paused_at = None
+                self.condition.notify()
+
+    def cancel(self) -> None:
+        """Drop every pending step, the thread keeps running for the next procedure."""
+        with self.condition:
+            self.heap = []
+            self.steps = None
+            self.paused_at = None
+            self.generation += 1
+            self.condition.notify()
+
+    def stop(self) -> None:
+        """Drop every pending step and end the thread."""
+        with self.condition:
+            self.heap = []
+            self.steps = None
+            self.running = False
+            self.condition.notify()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def pending(self) -> int:
+        """Steps in the heap, the source may hold more."""
+        with self.condition:
+            return len(self.heap)
+
+    def done(self) -> bool:
+        """Whether every step has been fired, or dropped by cancel() or an error."""
+        with self.condition:
+            return self.steps is None and not self.heap and not self.firing
+
+    def refill(self) -> None:
+        """Move the next LOOKAHEAD steps from the source to the heap."""
+        with self.condition:
+            steps, generation = self.steps, self.generation
+            if steps is None:
+                return
+        # without the lock, a streamed source may read from disk
+        batch, error = [], None
+        try:
+            for deadline_ns, index in islice(steps, LOOKAHEAD):
+                batch.append((int(deadline_ns), index))
+        except Exception as e:
+            # the steps before the error still run
+            logging.error(f"Error: {e}")
+            error = e
+        with self.condition:
+            if generation != self.generation:
+                # restarted or cancelled meanwhile
+                return
+            for step in batch:
+                heapq.heappush(self.heap, step)
+            if error is not None or len(batch) < LOOKAHEAD:
+                self.steps = None
+                self.error = error
+
+    def next_step(self):
+        """Wait until a step is due and pop it.
+
+        Returns (index, deadline_ns, target_ns, generation) once the rest of the wait is shorter
+        than the spin window, target_ns is the monotonic time the caller spins until and
+        generation tells whether start() or cancel() dropped the step meanwhile. Returns REFILL
+        when the heap runs low and None when the thread should stop.
+        """
+        with self.condition:
+            while True:
+                if not self.running:
+                    return None
+                if self.steps is not None and len(self.heap) < LOOKAHEAD // 2:
+                    return REFILL
+                if not self.heap or self.paused_at is not None:
+                    self.condition.wait()
+                    continue
+                deadline_ns, index = self.heap[0]
+                target_ns = self.start_ns + deadline_ns
+                sleep_ns = target_ns - time.monotonic_ns() - self.spin_ns
+                if sleep_ns <= 0:
+                    heapq.heappop(self.heap)
+                    self.firing = True
+                    return index, deadline_ns, target_ns, self.generation
+                wake_ns = time.monotonic_ns() + sleep_ns
+                if not self.condition.wait(sleep_ns / 1e9):
+                    # timed out, learn how late the wait returns
+                    self.adapt(time.monotonic_ns() - wake_ns)
+
+    def adapt(self, oversleep_ns: int) -> None:
+        self.oversleep_ns += OVERSLEEP_WEIGHT * (oversleep_ns - self.oversleep_ns)
+        self.spin_ns = int(min(max(2 * self.oversleep_ns, MIN_SPIN_NS), MAX_SPIN_NS))
+
+    def run(self) -> None:
+        while True:
+            step = self.next_step()
+            if step is None:
+                return
+            if step == REFILL:
+                self.refill()
+                continue
+            index, planned_ns, target_ns, generation = step
+            # spin without the lock, pause() and schedule() are not held up
+            while time.monotonic_ns() < target_ns:
+                pass
+            with self.condition:
+                if not self.running:
+                    return
+                if generation != self.generation:
+                    # restarted or cancelled while spinning
+                    self.firing = False
+                    continue
+                if (
+                    self.paused_at is not None
+                    or self.start_ns + planned_ns != target_ns
+                ):
+                    # paused while spinning, the step waits for its new target
+                    heapq.heappush(self.heap, (planned_ns, index))
+                    self.firing = False
+                    continue
+                actual_ns = time.monotonic_ns() - self.start_ns
+                self.timings.append(StepTiming(index, planned_ns, actual_ns))
+            try:
+                self.fire(index)
+            except Exception as e:
+                logging.error(f"Error: {e}")
+            finally:
+                self.firing = False
+
+    def lateness_summary(self) -> dict:
+        """Lateness of the fired steps in milliseconds."""
+        lateness = sorted(timing.lateness_ns for timing in self.timings)
+        if not lateness:
+            return {"steps": 0}
+        return {
+            "steps": len(lateness),
+            "mean_ms": round(sum(lateness) / len(lateness) / 1e6, 3),
+            "p99_ms": round(lateness[int(0.99 * (len(lateness) - 1))] / 1e6, 3),
+            "max_ms": round(lateness[-1] / 1e6, 3),
+        }
@@ -0,0 +1,114 @@
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+from datetime import datetime
+
+from ProcedureScheduler import ProcedureScheduler
+
+NANOSECONDS_PER_MILLISECOND = 1_000_000
+
+
+def legacy_run(deadlines_ns: list, start_ns: int) -> tuple:
+    """The half-interval rule execute_procedure used with master.after(), on a plain sleep.
+
+    Returns the lateness of every step in nanoseconds and the number of wakeups.
+    """
+    lateness, wakeups = [], 0
+    for deadline_ns in deadlines_ns:
+        while True:
+            wakeups += 1
+            remaining_ns = deadline_ns - (time.monotonic_ns() - start_ns)
+            if remaining_ns <= 0:
+                lateness.append(-remaining_ns)
+                break
+            sleep_ms = max(100, remaining_ns // 2 // NANOSECONDS_PER_MILLISECOND)
+            time.sleep(sleep_ms / 1000)
+    return lateness, wakeups
+
+
+def scheduler_run(deadlines_ns: list, start_ns: int) -> list:
+    done = threading.Event()
+    last = len(deadlines_ns) - 1
+    scheduler = ProcedureScheduler(lambda index: index == last and done.set())
+    scheduler.start(zip(deadlines_ns, range(len(deadlines_ns))), start_ns)
+    done.wait()
+    scheduler.stop()
+    return [timing.lateness_ns for timing in scheduler.timings]
+
+
+def busy_gui(stop: threading.Event, block_ms: float) -> None:
+    """Stand in for a loaded Tk thread: Python work in blocks of block_ms."""
+    while not stop.is_set():
+        end = time.perf_counter() + block_ms / 1000
+        while time.perf_counter() < end:
+            pass
+        time.sleep(0.001)
+
+
+def summary(lateness: list) -> dict:
+    lateness = sorted(lateness)
+    return {
+        "mean_ms": round(sum(lateness) / len(lateness) / 1e6, 3),
+        "p99_ms": round(lateness[int(0.99 * (len(lateness) - 1))] / 1e6, 3),
+        "max_ms": round(lateness[-1] / 1e6, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare step lateness of the procedure scheduler with the half-interval polling it replaced."
+    )
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument(
+        "--interval", type=float, default=0.25, help="seconds between steps"
+    )
+    parser.add_argument(
+        "--load-ms",
+        type=float,
+        default=20,
+        help="block length of the simulated GUI load, 0 to run without",
+    )
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    # an uneven step spacing, so the deadlines do not line up with the sleeps
+    deadlines_ns = [
+        int((index * args.interval + (index % 7) * 0.013) * 1e9)
+        for index in range(args.steps)
+    ]
+
+    stop = threading.Event()
+    if args.load_ms:
+        threading.Thread(
+            target=busy_gui, args=(stop, args.load_ms), daemon=True
+        ).start()
+    legacy_lateness, wakeups = legacy_run(deadlines_ns, time.monotonic_ns())
+    scheduler_lateness = scheduler_run(deadlines_ns, time.monotonic_ns())
+    stop.set()
+
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "options": {
+            "steps": args.steps,
+            "interval_s": args.interval,
+            "load_ms": args.load_ms,
+        },
+        "results": {
+            "legacy": {**summary(legacy_lateness), "wakeups": wakeups},
+            "scheduler": summary(scheduler_lateness),
+        },
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
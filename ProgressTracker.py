@@ -0,0 +1,106 @@
+from typing import NamedTuple
+
+# the remaining times are shown in tenths of a second
+DISPLAY_RESOLUTION_NS = 100_000_000
+
+
+class RowProgress(NamedTuple):
+    index: int
+    percent: int
+    # rounded to the display resolution
+    remaining_ns: int
+
+
+class ProgressTracker:
+    """Progress of a running procedure, updated incrementally from the step deadlines.
+
+    The rows before the cursor have started. Once the row after it has started too a row stays
+    at 100 % with nothing remaining, so a refresh only recomputes the latest started row and the
+    rows the cursor passed since the last refresh. Refreshes closer together than the display
+    resolution are skipped, and a value is only returned if what it shows has changed.
+    deadlines_ns may be any sequence, e.g. the deadlines of a streamed recipe, which grow as it
+    is read, total_ns can then be set once the end is known.
+    """
+
+    def __init__(self, deadlines_ns, resolution_ns: int = DISPLAY_RESOLUTION_NS):
+        # plain ints, the refresh reads single values, other sequences are used as they are
+        if hasattr(deadlines_ns, "tolist"):
+            deadlines_ns = deadlines_ns.tolist()
+        self.deadlines_ns = deadlines_ns
+        self.total_ns = int(deadlines_ns[-1]) if len(deadlines_ns) else 0
+        self.resolution_ns = resolution_ns
+        self.reset()
+
+    def reset(self) -> None:
+        self.cursor = 0
+        self.last_refresh_ns = None
+        self.shown_total = None
+        # the row still changing and what it shows
+        self.shown_row = None
+
+    def quantize(self, ns: int) -> int:
+        return (ns + self.resolution_ns // 2) // self.resolution_ns * self.resolution_ns
+
+    def total(self, elapsed_ns: int) -> tuple:
+        """(percent, remaining ns) of the whole procedure."""
+        if self.total_ns <= 0:
+            return 100, 0
+        percent = int(min(100, elapsed_ns / self.total_ns * 100))
+        return percent, self.quantize(max(0, self.total_ns - elapsed_ns))
+
+    def row(self, index: int, elapsed_ns: int) -> RowProgress:
+        """Progress of a started row, measured against the deadline of the next row."""
+        if index + 1 >= len(self.deadlines_ns):
+            return RowProgress(index, 100, 0)
+        start_ns = self.deadlines_ns[index]
+        interval_ns = self.deadlines_ns[index + 1] - start_ns
+        if interval_ns <= 0:
+            # the next row has the same time point
+            return RowProgress(index, 100, 0)
+        percent = int(min(100, (elapsed_ns - start_ns) / interval_ns * 100))
+        remaining_ns = max(0, self.deadlines_ns[index + 1] - elapsed_ns)
+        return RowProgress(index, percent, self.quantize(remaining_ns))
+
+    def shown(self, index: int) -> RowProgress:
+        """What a row shows as of the last refresh, None if it had not started."""
+        if index >= self.cursor:
+            return None
+        if self.shown_row is not None and self.shown_row.index == index:
+            return self.shown_row
+        return RowProgress(index, 100, 0)
+
+    def refresh(self, elapsed_ns: int, force: bool = False):
+        """Return (total, rows) that changed since the last refresh, None if it is too early.
+
+        total is (percent, remaining ns) or None if unchanged, rows is a list of RowProgress for
+        consecutive rows.
+        """
+        if (
+            not force
+            and self.last_refresh_ns is not None
+            and 0 <= elapsed_ns - self.last_refresh_ns < self.resolution_ns
+        ):
+            return None
+        self.last_refresh_ns = elapsed_ns
+
+        total = self.total(elapsed_ns)
+        if total == self.shown_total:
+            total = None
+        else:
+            self.shown_total = total
+
+        # move the cursor past the rows that have started by now
+        cursor = self.cursor
+        while (
+            cursor < len(self.deadlines_ns) and self.deadlines_ns[cursor] <= elapsed_ns
+        ):
+            cursor += 1
+        rows = []
+        # the row that was still changing, then the rows started since
+        for index in range(max(self.cursor - 1, 0), cursor):
+            progress = self.row(index, elapsed_ns)
+            if progress != self.shown_row:
+                rows.append(progress)
+        self.cursor = cursor
+        self.shown_row = rows[-1] if rows else self.shown_row
+        return total, rows
@@ -0,0 +1,67 @@
+import numpy as np
+
+from ProgressTracker import ProgressTracker, RowProgress
+
+SECOND = 1_000_000_000
+DEADLINES = np.array([0, 10, 20, 20, 40], dtype=np.int64) * SECOND
+
+
+def test_total_progress():
+    tracker = ProgressTracker(DEADLINES)
+    assert tracker.total_ns == 40 * SECOND
+    assert tracker.total(0) == (0, 40 * SECOND)
+    assert tracker.total(10 * SECOND) == (25, 30 * SECOND)
+    assert tracker.total(50 * SECOND) == (100, 0)
+    # remaining times are rounded to the display resolution
+    assert tracker.total(int(10.04 * SECOND)) == (25, 30 * SECOND)
+
+
+def test_row_progress():
+    tracker = ProgressTracker(DEADLINES)
+    assert tracker.row(0, 5 * SECOND) == RowProgress(0, 50, 5 * SECOND)
+    # the next row has the same time point
+    assert tracker.row(2, 20 * SECOND) == RowProgress(2, 100, 0)
+    # the last row is done once it started
+    assert tracker.row(4, 40 * SECOND) == RowProgress(4, 100, 0)
+
+
+def test_refresh_returns_only_changes():
+    tracker = ProgressTracker(DEADLINES)
+    total, rows = tracker.refresh(5 * SECOND)
+    assert total == (12, 35 * SECOND)
+    assert rows == [RowProgress(0, 50, 5 * SECOND)]
+    # within the display resolution nothing is recomputed
+    assert tracker.refresh(5 * SECOND + 1) is None
+    # the cursor passes rows 1 to 3, row 0 finishes
+    total, rows = tracker.refresh(25 * SECOND)
+    assert [row.index for row in rows] == [0, 1, 2, 3]
+    assert rows[0] == RowProgress(0, 100, 0)
+    assert rows[-1] == RowProgress(3, 25, 15 * SECOND)
+    assert tracker.shown(1) == RowProgress(1, 100, 0)
+    assert tracker.shown(3) == rows[-1]
+    assert tracker.shown(4) is None
+    # forced refreshes at the same time report nothing new
+    assert tracker.refresh(25 * SECOND, force=True) == (None, [])
+
+
+def test_reset_starts_over():
+    tracker = ProgressTracker(DEADLINES)
+    tracker.refresh(25 * SECOND)
+    tracker.reset()
+    assert tracker.shown(0) is None
+    total, rows = tracker.refresh(0)
+    assert total == (0, 40 * SECOND)
+    assert rows == [RowProgress(0, 0, 10 * SECOND)]
+
+
+def test_growing_sequence_and_late_total():
+    # like the deadlines of a streamed recipe, read as the procedure runs
+    deadlines = [0, 10 * SECOND]
+    tracker = ProgressTracker(deadlines)
+    assert tracker.deadlines_ns is deadlines
+    tracker.refresh(15 * SECOND)
+    deadlines.append(20 * SECOND)
+    tracker.total_ns = 100 * SECOND
+    total, rows = tracker.refresh(15 * SECOND, force=True)
+    assert total == (15, 85 * SECOND)
+    assert rows == [RowProgress(1, 50, 5 * SECOND)]
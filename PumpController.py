@@ -3,24 +3,47 @@ import serial
 import serial.tools.list_ports
 
 # other library
-import re
+import copy
+import time
 import logging
-from queue import Queue
+from threading import Lock
 from datetime import datetime
 
 # Custom imports
 from Message import simple_Message
+from CommandQueue import CoalescingQueue, DEFAULT_MAX_BURST_BYTES
+from BinaryProtocol import ReplyReader, supports_binary, BINARY_COMMAND, BINARY_ACK
+from Handshake import Handshake
+from PollingScheduler import PollingScheduler, PUMP_POLLING
 
 
 class PumpController:
-    def __init__(self, controller_id: int, port_name: str, serial_timeout: int):
-        self.serial_port = serial.Serial()  # Init the serial port but don't open it yet
-        self.serial_port.port = port_name
+    def __init__(
+        self,
+        controller_id: int,
+        port_name: str,
+        serial_timeout: int,
+        max_burst_bytes: int = DEFAULT_MAX_BURST_BYTES,
+        binary_protocol: bool = True,
+    ):
+        # Init the serial port but don't open it yet, port_name may also be a pyserial url (socket://)
+        self.serial_port = serial.serial_for_url(port_name, do_not_open=True)
         self.serial_port.baudrate = 115200
         self.serial_port.timeout = serial_timeout
+        self.serial_timeout = serial_timeout
+        self.max_burst_bytes = max_burst_bytes  # upper bound for one batched write
+        # switch to the compact binary replies if the Pico supports them
+        self.binary_protocol = binary_protocol
+        # reads everything buffered on the port with one read, text lines or binary frames
+        self.reply_reader = ReplyReader(self.serial_port)
+
+        # a queue to store commands to be sent to the pump controller, duplicate queries are collapsed
+        self.send_command_queue = CoalescingQueue()
 
-        # a queue to store commands to be sent to the pump controller
-        self.send_command_queue = Queue()
+        # stage timings of the last connect handshake
+        self.handshake_report = None
+        # when to refresh the status and pump info, driven by PumpControllerWorker
+        self.polling = PollingScheduler(PUMP_POLLING)
 
         # Dictionary to store status of this pump controller, this will be read by the backend to update their info
         self.status = {
@@ -31,45 +54,115 @@ class PumpController:
             "pumps_info": {},
             "rtc_time": -1,
         }
+        # guards self.status, the reader thread updates it while the backend copies it
+        self.lock = Lock()
+        self.status_version = 0  # bumped on every status update
+        # called with this controller after every status update
+        self.status_listener = None
+        # set once a read or write on the port failed
+        self.lost = False
+        # called with this controller when the port failed, disconnects right away if None
+        self.connection_lost_listener = None
         logging.info(f"Pump controller {controller_id} created.")
 
     def is_connected(self) -> bool:
         return self.serial_port is not None and self.serial_port.is_open
 
+    def status_changed(self) -> None:
+        self.status_version += 1
+        if self.status_listener:
+            self.status_listener(self)
+
+    def snapshot_status(self) -> dict:
+        """Return a deep copy of the status that stays consistent while the Pico keeps talking."""
+        with self.lock:
+            return copy.deepcopy(self.status)
+
     # a function to process all remaining messages in the queue
     def process_all_messages(self) -> None:
-        while not self.send_command_queue.empty():
+        # a failed write or read may close the port on the way
+        while self.is_connected() and not self.send_command_queue.empty():
             self.send_command()
-        while self.serial_port.in_waiting:
+        while self.is_connected() and self.serial_port.in_waiting:
             self.read_serial()
 
     def connect(self) -> simple_Message:
         """Connect to the serial port."""
         if self.is_connected():
             self.disconnect()
+        self.lost = False
+        handshake = Handshake(self.serial_port.name)
         try:
             self.serial_port.open()
             self.serial_port.reset_input_buffer()  # flush the input and output buffers
             self.serial_port.reset_output_buffer()
-            # identify Pico type
+            self.reply_reader.clear()
+            # identify Pico type, every other stage depends on the reply
+            started = time.perf_counter()
             self.serial_port.write("0:ping\n".encode())
-            response = self.serial_port.readline().decode("utf-8").strip()
-            if "Pico Pump Control Version" not in response:
+            replies = self.wait_for_replies(
+                {"ping": lambda kind, response: kind == "ping"},
+                handshake.stage_deadline(started),
+            )
+            ping_response = replies.get("ping", (None, ""))[1]
+            if not handshake.record(
+                "ping",
+                started,
+                "Pico Pump Control Version" in ping_response,
+                detail=ping_response,
+            ):
                 self.disconnect()  # we connect to the wrong device
                 return simple_Message(
                     "Error",
                     "Connected to the wrong device. Please reconnect to continue.",
                 )
-            # synchronize the RTC with the PC time
-            now = datetime.now()
-            sync_command = f"0:stime:{now.year}:{now.month}:{now.day}:{now.hour}:{now.minute}:{now.second}"
-            self.serial_port.write(f"{sync_command}\n".encode())
-            response = self.serial_port.readline().decode("utf-8").strip()
+
+            # the remaining stages are pipelined, their commands go out in one write and the
+            # replies are matched as they arrive
+            configure = {
+                "stime": lambda kind, response: kind == "success"
+                and response != BINARY_ACK
+            }
+            query = {
+                "rtc_time": lambda kind, response: kind == "rtc_time",
+                "pump_info": lambda kind, response: kind == "pump_info",
+            }
+            self.sync_rtc_with_pc_time()  # synchronize the RTC with the PC time
+            if self.binary_protocol and supports_binary(ping_response):
+                # the reply reader switches to frames right after the ack
+                self.send_command_queue.put(BINARY_COMMAND)
+                configure["binary"] = lambda kind, response: response == BINARY_ACK
             self.query_rtc_time()  # Query RTC time
             self.query_pump_info()  # issue a pump info query
+            started = time.perf_counter()
+            while not self.send_command_queue.empty():
+                self.send_command()
+            replies = self.wait_for_replies(
+                {**configure, **query}, handshake.stage_deadline(started)
+            )
+            for stage, wanted in (("configure", configure), ("query", query)):
+                done = all(name in replies for name in wanted)
+                handshake.record(
+                    stage,
+                    started,
+                    done,
+                    finished=max(
+                        (replies[name][0] for name in wanted if name in replies),
+                        default=None,
+                    ),
+                    detail=f"missing {[name for name in wanted if name not in replies]}",
+                )
+            if self.reply_reader.binary:
+                logging.info(f"Binary protocol enabled on {self.serial_port.name}")
+
             logging.info(f"Connected to {self.serial_port.name}")
-            self.status.update({"connected": True})
-            self.process_all_messages()
+            with self.lock:
+                self.status.update({"connected": True})
+            self.status_changed()
+            self.handshake_report = handshake.report()
+            logging.info(handshake.summary())
+            # the handshake just read the status, start polling at the fastest cadence
+            self.polling.reset()
             return simple_Message("Success", f"Connected to {self.serial_port.name}")
         except Exception as e:
             # attempt to disconnect if connection fails
@@ -78,81 +171,149 @@ class PumpController:
             return simple_Message(
                 "Error", f"Failed to connect to {self.serial_port.name}: {e}"
             )
+        finally:
+            self.serial_port.timeout = self.serial_timeout
+
+    def wait_for_replies(self, wanted: dict, deadline: float) -> dict:
+        """Handle replies until every matcher in wanted matched a reply or deadline passes.
+
+        wanted is {name: match(kind, response)}, returns {name: (arrival time, response)}.
+        """
+        matched = {}
+        while len(matched) < len(wanted):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            self.serial_port.timeout = remaining
+            for kind, value, response, size in self.reply_reader.read_replies(
+                wait=True
+            ):
+                self.handle_reply(kind, value, response, size)
+                for name, match in wanted.items():
+                    if name not in matched and match(kind, response):
+                        matched[name] = (time.perf_counter(), response)
+                        break
+        return matched
 
     def disconnect(self) -> simple_Message:
         """Disconnect from the serial port."""
         try:
             if self.is_connected():
-                self.shutdown()  # send a shutdown signal
-                self.process_all_messages()  # process any remaining messages in the queue
+                # a lost port takes no more messages
+                if not self.lost:
+                    self.shutdown()  # send a shutdown signal
+                    self.process_all_messages()  # process any remaining messages in the queue
                 self.serial_port.close()
                 logging.info(f"Disconnected from {self.serial_port.name}")
-                self.status.update(
-                    {"connected": False, "pumps_info": {}, "rtc_time": -1}
+                logging.debug(
+                    f"{self.send_command_queue.coalesced} duplicate queries coalesced in the send queue"
                 )
+                with self.lock:
+                    self.status.update(
+                        {"connected": False, "pumps_info": {}, "rtc_time": -1}
+                    )
+                self.status_changed()
                 return simple_Message(
                     "Success", f"Disconnected from {self.serial_port.name}"
                 )
+            return simple_Message(
+                "Success", f"{self.serial_port.name} is already disconnected"
+            )
         except Exception as e:
             logging.error(f"Failed to disconnect from {self.serial_port.name}: {e}")
             return simple_Message(
                 "Error", f"Failed to disconnect from {self.serial_port.name}: {e}"
             )
 
-    # send_command will remove the first item from the queue and send it to force chronological order
+    def connection_lost(self) -> None:
+        """Mark the port as failed after a read or write error and hand it to the listener."""
+        self.lost = True
+        with self.lock:
+            self.status["connected"] = False
+        self.status_changed()
+        if self.connection_lost_listener:
+            self.connection_lost_listener(self)
+        else:
+            self.disconnect()
+
+    # send_command removes every ready command from the queue, in order, and writes them with a single call
     def send_command(self) -> None:
         try:
             if self.is_connected() and not self.send_command_queue.empty():
-                command = self.send_command_queue.get(block=False)
-                self.serial_port.write(f"{command.strip()}\n".encode())
-                # don't log the RTC time sync command
-                if "time" not in command:
-                    logging.debug(f"PC -> Pico: {command}")
+                commands, payload = self.send_command_queue.get_burst(
+                    self.max_burst_bytes
+                )
+                self.serial_port.write(payload)
+                for command in commands:
+                    # don't log the RTC time sync command
+                    if "time" not in command:
+                        logging.debug(f"PC -> Pico: {command}")
         except serial.SerialException as e:
-            self.disconnect()
+            self.connection_lost()
             logging.error(f"Error: SerialException from {self.serial_port.name}: {e}")
             return simple_Message("Error", f"SerialException: {e}")
         except serial.SerialTimeoutException as e:
-            self.disconnect()
+            self.connection_lost()
             logging.error(f"Timeout error: {e}")
             return simple_Message("Error", f"Serial Timeout: {e}")
         except Exception as e:
-            self.disconnect()
+            self.connection_lost()
             logging.error(f"Error: {e}")
             return simple_Message("Error", f"Error occurred: {e}")
 
+    # read_serial handles every complete line waiting on the port in one pass
     # set wait to true forces the function to wait for a response
+    # returns the last Success or Error reply, or a placeholder message if there is none
     def read_serial(self, wait=False) -> simple_Message:
         try:
             if self.is_connected() and (self.serial_port.in_waiting or wait):
-                response = self.serial_port.readline().decode("utf-8").strip()
-                if "RTC Time" not in response:  # don't log the RTC time response
-                    logging.debug(f"Pico -> PC: {response}")
-                if "Info" in response:
-                    self.parse_pump_info(response=response)
-                elif "Status" in response:
-                    self.parse_pump_status(response)
-                elif "RTC Time" in response:
-                    self.parse_rtc_time(response)
-                elif "Success" in response:
-                    return simple_Message("Success", response)
-                elif "Error" in response:
-                    return simple_Message("Error", response)
-                # return a placeholder message if no response will be returned
-                return simple_Message("", "")
+                message = simple_Message("", "")
+                for kind, value, response, size in self.reply_reader.read_replies(wait):
+                    reply = self.handle_reply(kind, value, response, size)
+                    if reply.title:
+                        message = reply
+                return message
         except serial.SerialException as e:
-            self.disconnect()
+            self.connection_lost()
             logging.error(f"Error: SerialException from {self.serial_port.name}: {e}")
             return simple_Message("Error", f"SerialException: {e}")
         except serial.SerialTimeoutException as e:
-            self.disconnect()
+            self.connection_lost()
             logging.error(f"Timeout error: {e}")
             return simple_Message("Error", f"Serial Timeout: {e}")
         except Exception as e:
-            self.disconnect()
+            self.connection_lost()
             logging.error(f"Error: {e}")
             return simple_Message("Error", f"Error occurred: {e}")
 
+    def handle_reply(
+        self, kind: str, value, response: str, size: int
+    ) -> simple_Message:
+        """Handle one reply, size is the number of bytes it took on the link."""
+        if kind != "rtc_time":  # don't log the RTC time response
+            logging.debug(f"Pico -> PC: {response}")
+        if kind == "pump_info":
+            self.poll_result("0:info", self.update_pump_info(value), size)
+        elif kind == "pump_status":
+            self.poll_result("0:st", self.update_pump_status(value), size)
+        elif kind == "rtc_time":
+            self.update_rtc_time(value)
+        elif kind == "success":
+            return simple_Message("Success", response)
+        elif kind == "error":
+            return simple_Message("Error", response)
+        return simple_Message("", "")
+
+    def sync_rtc_with_pc_time(self) -> None:
+        """Synchronize the Pico's RTC with the PC's time."""
+        if self.is_connected():
+            try:
+                now = datetime.now()
+                sync_command = f"0:stime:{now.year}:{now.month}:{now.day}:{now.hour}:{now.minute}:{now.second}"
+                self.send_command_queue.put(sync_command)
+            except Exception as e:
+                logging.error(f"Error synchronizing RTC with PC time: {e}")
+
     def query_rtc_time(self) -> None:
         """Query the RTC time from the Pico."""
         if self.is_connected():
@@ -162,92 +323,88 @@ class PumpController:
                 logging.error(f"Error: {e}")
                 return simple_Message("Error", f"An error occurred: {e}")
 
-    def parse_rtc_time(self, response: str) -> None:
-        """Parse the RTC time from the response."""
-        try:
-            # response format: RTC Time: 2024-9-26 11:47:39
-            match = re.search(r"RTC Time: (\d+-\d+-\d+ \d+:\d+:\d+)", response)
-            rtc_time = match.group(1)
-            if rtc_time:  # update the status dictionary
-                self.status["rtc_time"] = datetime.strptime(
-                    rtc_time, "%Y-%m-%d %H:%M:%S"
-                ).timestamp()
-        except Exception as e:
-            logging.error(f"Error updating RTC time display: {e}")
+    def update_rtc_time(self, rtc_time: datetime) -> None:
+        """Store the parsed RTC time in the status dictionary."""
+        if rtc_time:
+            with self.lock:
+                self.status["rtc_time"] = rtc_time.timestamp()
+            self.status_changed()
+        else:
+            logging.error("Error updating RTC time: malformed response")
 
     def query_pump_info(self) -> None:
         if self.is_connected():
             try:
                 self.send_command_queue.put("0:info")
+                self.polling.sent("0:info")
             except Exception as e:
                 logging.error(f"Error: {e}")
                 return simple_Message("Error", f"An error occurred: {e}")
 
-    def parse_pump_info(self, response: str, clear_existing=True) -> None:
-        """Parse the pump info response and update the status."""
-        # clear the existing pump info
-        if clear_existing:
-            self.status["pumps_info"].clear()
-        try:
-            info_pattern = re.compile(
-                r"Pump(\d+) Info: Power Pin: (-?\d+), Direction Pin: (-?\d+), Initial Power Pin Value: (\d+), Initial Direction Pin Value: (\d+), Current Power Status: (ON|OFF), Current Direction Status: (CW|CCW)"
-            )
-            matches = info_pattern.findall(response)
-            # sort the matches by pump_id in ascending order
-            matches = sorted(matches, key=lambda x: int(x[0]))
-            for match in matches:
-                (
-                    pump_id,
-                    power_pin,
-                    direction_pin,
-                    initial_power_pin_value,
-                    initial_direction_pin_value,
-                    current_power_status,
-                    current_direction_status,
-                ) = match
-                self.status["pumps_info"].update(
-                    {
-                        int(pump_id): {
-                            "power_pin": power_pin,
-                            "direction_pin": direction_pin,
-                            "initial_power_pin_value": initial_power_pin_value,
-                            "initial_direction_pin_value": initial_direction_pin_value,
-                            "current_power_status": current_power_status,
-                            "current_direction_status": current_direction_status,
-                        }
-                    }
-                )
-        except Exception as e:
-            logging.error(f"Error: {e}")
+    def update_pump_info(self, pumps_info: dict, clear_existing=True) -> bool:
+        """Store the parsed pump info in the status dictionary, returns True if it changed."""
+        with self.lock:
+            previous = copy.deepcopy(self.status["pumps_info"])
+            # clear the existing pump info
+            if clear_existing:
+                self.status["pumps_info"].clear()
+            for pump_id, info in pumps_info.items():
+                self.status["pumps_info"][pump_id] = {
+                    "power_pin": info["power_pin"],
+                    "direction_pin": info["direction_pin"],
+                    "initial_power_pin_value": info["initial_power_pin_value"],
+                    "initial_direction_pin_value": info["initial_direction_pin_value"],
+                    "current_power_status": info["power_status"],
+                    "current_direction_status": info["direction_status"],
+                }
+            changed = self.status["pumps_info"] != previous
+        self.status_changed()
+        return changed
 
     def query_status(self) -> None:
         if self.is_connected():
             try:
                 self.send_command_queue.put("0:st")
+                self.polling.sent("0:st")
             except Exception as e:
                 logging.error(f"Error: {e}")
                 return simple_Message("Error", f"An error occurred: {e}")
 
-    def parse_pump_status(self, response: str) -> None:
-        status_pattern = re.compile(
-            r"Pump(\d+) Status: Power: (ON|OFF), Direction: (CW|CCW)"
-        )
-        matches = status_pattern.findall(response)
-
-        for match in matches:
-            pump_id, power_status, direction_status = match
-            pump_id = int(pump_id)
+    def update_pump_status(self, pumps_status: dict) -> bool:
+        """Store the parsed pump status, returns True if any pump changed."""
+        changed = False
+        with self.lock:
             pumps_info = self.status["pumps_info"]
-            if pump_id in pumps_info:
-                pumps_info[pump_id]["current_power_status"] = power_status
-                pumps_info[pump_id]["current_direction_status"] = direction_status
-            else:
-                # This mean we somehow received a status update for a pump that does not exist
-                # re-query the pump info
-                self.query_pump_info()
-                logging.error(
-                    f"We received a status update for a pump that does not exist: {pump_id}"
-                )
+            for pump_id, (power_status, direction_status) in pumps_status.items():
+                if pump_id in pumps_info:
+                    changed = changed or (
+                        pumps_info[pump_id]["current_power_status"],
+                        pumps_info[pump_id]["current_direction_status"],
+                    ) != (power_status, direction_status)
+                    pumps_info[pump_id]["current_power_status"] = power_status
+                    pumps_info[pump_id]["current_direction_status"] = direction_status
+                else:
+                    # This mean we somehow received a status update for a pump that does not exist
+                    # re-query the pump info
+                    self.query_pump_info()
+                    logging.error(
+                        f"We received a status update for a pump that does not exist: {pump_id}"
+                    )
+                    changed = True
+        self.status_changed()
+        return changed
+
+    def poll_result(self, query: str, changed: bool, size: int) -> None:
+        self.polling.result(query, changed, size)
+        if changed:
+            # the next poll moved closer, let the worker recompute how long it may sleep
+            self.send_command_queue.wake()
+
+    def poll_status(self) -> None:
+        """Queue the status queries that are due, only while no other command is waiting."""
+        if self.is_connected() and self.send_command_queue.empty():
+            for query in self.polling.due():
+                self.send_command_queue.put(query)
 
     def shutdown(self) -> None:
         if self.is_connected():
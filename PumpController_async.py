@@ -1,10 +1,21 @@
-import re
 import json
+import time
 import serial
 import asyncio
 import logging
 from datetime import datetime
-from multiprocessing import Lock, Manager
+from multiprocessing import Lock
+
+from SerialTransport import open_serial_connection
+from ResponseRouter import ResponseRouter
+from SharedStatusTable import PumpStatusTable
+from Handshake import Handshake
+import ResponseParser
+
+# a Pico without pumps answers both queries with "Info: No pumps registered."
+NO_PUMPS = "Info: No pumps registered."
+INFO_KEYWORDS = ("Info: Power Pin", NO_PUMPS)
+STATUS_KEYWORDS = ("Status: Power", NO_PUMPS)
 
 
 class PumpController:
@@ -14,62 +25,115 @@ class PumpController:
         port_name: str,
         serial_timeout: int,
         lock: Lock,
-        manager: Manager,
         logger: logging.Logger,
     ):
-        self.serial_port = (
-            serial.Serial()
-        )  # Initialize the serial port but don't open it yet
-        self.serial_port.port = port_name
+        # Initialize the serial port but don't open it yet, port_name may also be a pyserial url (socket://)
+        self.serial_port = serial.serial_for_url(port_name, do_not_open=True)
         self.serial_port.baudrate = 115200
-        self.serial_port.timeout = None  # Non-blocking read
-        self.lock = lock  # Lock to ensure safe access to shared dictionary
+        self.serial_timeout = serial_timeout  # seconds to wait for a reply
+        # asyncio stream pair created on connect, reads never block the event loop
+        self.reader = None
+        self.writer = None
+        self.router = None  # pairs replies with the commands waiting for them
+        self.handshake_report = None  # stage timings of the last connect handshake
+        self.lock = lock  # Lock to ensure safe access to the status
         self.logger = logger
 
-        # Shared dictionary to store the status
-        self.status = manager.dict(
-            {
-                "serial_port": self.serial_port.name,
-                "controller_id": controller_id,
-                "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "connected": False,
-                "pumps_info": {},
-                "rtc_time": -1,
-            }
-        )
+        # Dictionary to store the status, copied to the shared status table after every update
+        self.status = {
+            "serial_port": self.serial_port.name,
+            "controller_id": controller_id,
+            "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "connected": False,
+            "pumps_info": {},
+            "rtc_time": -1,
+        }
+        # other processes attach to it with PumpStatusTable(status_table.name)
+        self.status_table = PumpStatusTable()
+        self.status_table.publish(self.status)
+        self.status_version = 0  # bumped on every status update
+        # called with this controller after every status update
+        self.status_listener = None
         self.logger.info(f"Pump controller {controller_id} created.")
 
-    def __is_connected(self) -> bool:
-        return self.serial_port is not None and self.serial_port.is_open
+    def is_connected(self) -> bool:
+        return self.writer is not None and not self.writer.is_closing()
+
+    def status_changed(self) -> None:
+        with self.lock:
+            self.status_table.publish(self.status)
+        self.status_version += 1
+        if self.status_listener:
+            self.status_listener(self)
+
+    def snapshot_status(self) -> dict:
+        """Return a consistent copy of the status from the shared status table."""
+        return self.status_table.snapshot()
 
     async def connect(self) -> str:
         """Connect to the serial port asynchronously."""
-        if self.__is_connected():
+        if self.is_connected():
             await self.disconnect()
         try:
             self.serial_port.open()
             self.serial_port.reset_input_buffer()
             self.serial_port.reset_output_buffer()
+            self.reader, self.writer = await open_serial_connection(self.serial_port)
+            self.router = ResponseRouter(
+                self.reader,
+                self.logger,
+                device_name="Pico",
+                unsolicited_callback=self.handle_unsolicited,
+                disconnect_callback=self.disconnect,
+            )
+            self.router.start()
+            handshake = Handshake(self.serial_port.name)
 
             # Identify Pico type
-            self.serial_port.write("0:ping\n".encode())
-            response = self.serial_port.readline().decode("utf-8").strip()
-            if "Pico Pump Control Version" not in response:
+            started = time.perf_counter()
+            response = await self.request(
+                "0:ping",
+                "Control Version",
+                handshake.remaining(handshake.stage_deadline(started)),
+            )
+            if not handshake.record(
+                "ping",
+                started,
+                bool(response) and "Pico Pump Control Version" in response,
+                detail=response or "",
+            ):
                 await self.disconnect()  # Wrong device
                 return "Error: Connected to the wrong device."
 
-            # Synchronize the time with PC
+            # Synchronize the time with PC and query time and pump information, all in flight
+            # at once, the router pairs the replies
             now = datetime.now()
             sync_command = f"0:stime:{now.year}:{now.month}:{now.day}:{now.hour}:{now.minute}:{now.second}"
-            self.serial_port.write(f"{sync_command}\n".encode())
-            response = self.serial_port.readline().decode("utf-8").strip()
-
-            await self.query_rtc_time()  # Query time
-            await self.query_pump_info()  # Query pump information
+            started = time.perf_counter()
+            timeout = handshake.remaining(handshake.stage_deadline(started))
+            configure, rtc_time, pump_info = await asyncio.gather(
+                self.timed_request(sync_command, "Success", timeout),
+                self.timed_request("0:time", "RTC Time", timeout),
+                self.timed_request("0:info", INFO_KEYWORDS, timeout),
+            )
+            if rtc_time[1]:
+                await self.parse_rtc_time(rtc_time[1])
+            if pump_info[1]:
+                await self.parse_pump_info(pump_info[1])
+            handshake.record("configure", started, bool(configure[1]), configure[0])
+            handshake.record(
+                "query",
+                started,
+                bool(rtc_time[1] and pump_info[1]),
+                max(rtc_time[0], pump_info[0]),
+            )
 
             # Safely update the shared status dictionary
             with self.lock:
                 self.status.update({"connected": True})
+            self.status_changed()
+            self.handshake_report = handshake.report()
+            self.logger.info(handshake.summary())
             self.logger.info(f"Connected to {self.serial_port.name}")
             return f"Success: Connected to {self.serial_port.name}"
         except Exception as e:
@@ -80,24 +144,40 @@ class PumpController:
     async def disconnect(self) -> str:
         """Disconnect from the serial port asynchronously."""
         try:
-            if self.__is_connected():
-                await self.shutdown()  # Send shutdown signal
-                self.serial_port.close()
+            if self.writer is not None:
+                if self.is_connected():
+                    await self.shutdown()  # Send shutdown signal
+                await self.close_connection()
                 self.logger.info(f"Disconnected from {self.serial_port.name}")
                 # Reset the status dictionary
                 with self.lock:
                     self.status.update(
                         {"connected": False, "pumps_info": {}, "rtc_time": -1}
                     )
+                self.status_changed()
                 return f"Success: Disconnected from {self.serial_port.name}"
         except Exception as e:
             self.logger.error(f"Failed to disconnect from {self.serial_port.name}: {e}")
             return f"Error: Failed to disconnect from {self.serial_port.name}: {e}"
 
+    async def close_connection(self) -> None:
+        """Close the stream pair, the transport closes the serial port once pending data is written."""
+        writer, router = self.writer, self.router
+        self.reader, self.writer, self.router = None, None, None
+        if router is not None:
+            await router.stop()
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception as e:
+            # the transport already reported the error that closed it
+            self.logger.debug(f"Serial transport closed with error: {e}")
+
     async def send_command(self, command: str) -> str:
         """Send command asynchronously."""
         try:
-            self.serial_port.write(f"{command.strip()}\n".encode())
+            self.writer.write(f"{command.strip()}\n".encode())
+            await self.writer.drain()
             if "time" not in command:
                 self.logger.debug(f"PC -> Pico: {command}")
             return f"Success: Command sent: {command}"
@@ -116,141 +196,114 @@ class PumpController:
             self.logger.error(f"Error: Failed to send command: {e}")
             return f"Error: Failed to send command: {e}"
 
-    async def read_serial(self, keyword: str = None) -> str:
-        """Read serial data asynchronously, check if specific keyword is in the response."""
-        response = None
-        try:
-            # Read the serial port, will block until a response is received
-            response = self.serial_port.readline().decode("utf-8").strip()
-            if "RTC Time" not in response:  # Don't log the RTC time sync response
-                self.logger.debug(f"Pico -> PC: {response}")
-            if "Error" in response:
-                self.logger.error(f"{response}")
-                response = None
-            # Check if the keyword is in the response
-            if keyword and response and keyword not in response:
-                self.logger.warning(
-                    f"Expected keyword '{keyword}' not found in response '{response}'"
-                )
-                response = None
-        except serial.SerialException as e:
-            await self.disconnect()
-            self.logger.error(
-                f"Error: SerialException from {self.serial_port.name}: {e}"
-            )
-        except serial.SerialTimeoutException as e:
-            await self.disconnect()
-            self.logger.error(f"Timeout error: {e}")
-        except Exception as e:
-            await self.disconnect()
-            self.logger.error(f"Error: {e}")
-        finally:
-            return response
+    async def request(self, command: str, keyword, timeout: float = None) -> str:
+        """Send a command and wait for the reply containing keyword, other commands may be in flight."""
+        # register before writing so the reply can't be missed
+        future = self.router.expect(keyword)
+        result = await self.send_command(command)
+        if not result.startswith("Success"):
+            self.router.discard(future)
+            return None
+        return await self.router.wait(
+            future, self.serial_timeout if timeout is None else timeout
+        )
+
+    async def timed_request(self, command: str, keyword, timeout: float) -> tuple:
+        """Like request, returns (time the reply arrived or the wait ended, reply)."""
+        response = await self.request(command, keyword, timeout)
+        return time.perf_counter(), response
 
-    async def run_command_and_read(self, command: str, keyword: str, callback):
-        """Run send_command and read_serial concurrently using TaskGroup."""
+    async def run_command_and_read(self, command: str, keyword, callback):
+        """Send a command and pass its reply to callback once the router resolves it."""
         try:
-            if self.__is_connected():
-                async with asyncio.TaskGroup() as tg:
-                    # Add send_command task to the group
-                    tg.create_task(self.send_command(command))
-                    # Add read_serial task to the group
-                    read_task = tg.create_task(self.read_serial(keyword))
-                response = read_task.result()
+            if self.is_connected():
+                response = await self.request(command, keyword)
                 if response:
                     await callback(response)
             else:
                 with self.lock:
                     self.status["connected"] = False
+                self.status_changed()
                 self.logger.error("Not connected to any device.")
         except Exception as e:
             self.logger.error(f"Error in run_command_and_read: {e}")
 
+    async def handle_unsolicited(self, response: str) -> None:
+        """Keep the status up to date from replies no command was waiting for."""
+        kind, value = ResponseParser.PUMP_RESPONSES.parse(response)
+        if kind == "rtc_time":
+            await self.update_rtc_time(value)
+        elif kind == "pump_info":
+            await self.update_pump_info(value)
+        elif kind == "pump_status":
+            await self.update_pump_status(value)
+        else:
+            self.logger.debug(f"Unsolicited response ignored: {response}")
+
     async def query_rtc_time(self) -> None:
         """Query the RTC time asynchronously."""
         await self.run_command_and_read("0:time", "RTC Time", self.parse_rtc_time)
 
     async def parse_rtc_time(self, response: str) -> None:
         """Parse the RTC time from the response."""
-        try:
-            # Response format: RTC Time: 2024-9-26 11:47:39
-            match = re.search(r"RTC Time: (\d+-\d+-\d+ \d+:\d+:\d+)", response)
-            if match:
-                rtc_time = match.group(1)
-                with self.lock:
-                    self.status["rtc_time"] = datetime.strptime(
-                        rtc_time, "%Y-%m-%d %H:%M:%S"
-                    ).timestamp()
-            else:
-                self.logger.error(f"Failed to parse RTC time from response: {response}")
-        except Exception as e:
-            self.logger.error(f"Error parsing RTC time: {e}")
+        await self.update_rtc_time(ResponseParser.parse_rtc_time(response))
+
+    async def update_rtc_time(self, rtc_time: datetime) -> None:
+        if rtc_time:
+            with self.lock:
+                self.status["rtc_time"] = rtc_time.timestamp()
+            self.status_changed()
+        else:
+            self.logger.error("Failed to parse RTC time from response")
 
     async def query_pump_info(self) -> None:
         """Query pump information asynchronously."""
-        await self.run_command_and_read("0:info", "Pump", self.parse_pump_info)
+        await self.run_command_and_read("0:info", INFO_KEYWORDS, self.parse_pump_info)
 
     async def parse_pump_info(self, response: str, clear_existing=True) -> None:
         """Parse the pump info response and update the status."""
+        await self.update_pump_info(
+            ResponseParser.parse_pump_info(response), clear_existing
+        )
+
+    async def update_pump_info(self, pumps_info: dict, clear_existing=True) -> None:
         try:
-            info_pattern = re.compile(
-                r"Pump(\d+) Info: Power Pin: (\d+), Direction Pin: (\d+), Initial Power Pin Value: (\d+), Initial Direction Pin Value: (\d+), Current Power Status: (ON|OFF), Current Direction Status: (CW|CCW)"
-            )
-            matches = info_pattern.findall(response)
-            # Sort the matches by pump_id in ascending order
-            matches = sorted(matches, key=lambda x: int(x[0]))
             with self.lock:
                 if clear_existing:
                     self.status["pumps_info"].clear()
-                for match in matches:
-                    (
-                        pump_id,
-                        power_pin,
-                        direction_pin,
-                        initial_power_pin_value,
-                        initial_direction_pin_value,
-                        current_power_status,
-                        current_direction_status,
-                    ) = match
-                    self.status["pumps_info"].update(
-                        {
-                            int(pump_id): {
-                                "power_pin": int(power_pin),
-                                "direction_pin": int(direction_pin),
-                                "initial_power_pin_value": int(initial_power_pin_value),
-                                "initial_direction_pin_value": int(
-                                    initial_direction_pin_value
-                                ),
-                                "current_power_status": current_power_status,
-                                "current_direction_status": current_direction_status,
-                            }
-                        }
-                    )
+                for pump_id, info in pumps_info.items():
+                    self.status["pumps_info"][pump_id] = {
+                        "power_pin": info["power_pin"],
+                        "direction_pin": info["direction_pin"],
+                        "initial_power_pin_value": info["initial_power_pin_value"],
+                        "initial_direction_pin_value": info[
+                            "initial_direction_pin_value"
+                        ],
+                        "current_power_status": info["power_status"],
+                        "current_direction_status": info["direction_status"],
+                    }
+            self.status_changed()
         except Exception as e:
             self.logger.error(f"Error parsing pump info: {e}")
 
     async def query_status(self) -> None:
         """Query the pump status asynchronously."""
-        await self.run_command_and_read("0:st", "Pump", self.parse_pump_status)
+        await self.run_command_and_read("0:st", STATUS_KEYWORDS, self.parse_pump_status)
 
     async def parse_pump_status(self, response: str) -> None:
         """Parse pump status and update the status."""
+        await self.update_pump_status(ResponseParser.parse_pump_status(response))
+
+    async def update_pump_status(self, pumps_status: dict) -> None:
         try:
-            status_pattern = re.compile(
-                r"Pump(\d+) Status: Power: (ON|OFF), Direction: (CW|CCW)"
-            )
-            matches = status_pattern.findall(response)
             re_query = False
 
             with self.lock:
-                for match in matches:
-                    pump_id, power_status, direction_status = match
-                    pump_id = int(pump_id)
-                    if pump_id in self.status["pumps_info"]:
-                        self.status["pumps_info"][pump_id][
-                            "current_power_status"
-                        ] = power_status
-                        self.status["pumps_info"][pump_id][
+                pumps_info = self.status["pumps_info"]
+                for pump_id, (power_status, direction_status) in pumps_status.items():
+                    if pump_id in pumps_info:
+                        pumps_info[pump_id]["current_power_status"] = power_status
+                        pumps_info[pump_id][
                             "current_direction_status"
                         ] = direction_status
                     else:
@@ -259,6 +312,7 @@ class PumpController:
                             f"Received status update for unknown pump: {pump_id}"
                         )
                         re_query = True
+            self.status_changed()
             if re_query:
                 await self.query_pump_info()
         except Exception as e:
@@ -296,8 +350,8 @@ class PumpController:
             await self.disconnect()
         else:
             self.logger.error(f"Reset failed: {response}")
-            
-##############################################################################################################
+
+    ##############################################################################################################
     async def toggle_power(self, pump_id: int) -> None:
         """Toggle power of the specified pump."""
         if self.is_connected():
@@ -1,6 +1,8 @@
+import sys
 import time
 import logging
 from PumpController import PumpController
+from PicoSimulator import PicoSimulator, VirtualPumpPico
 from Message import simple_Message
 
 # Set up logging
@@ -11,8 +13,12 @@ logging.basicConfig(
 
 def test_pump_controller():
     # Initialize the pump controller for COM10 with a 2-second timeout
+    # run with --simulate to test against a virtual Pico instead
     controller_id = 1
     port_name = "COM10"
+    if "--simulate" in sys.argv:
+        simulator = PicoSimulator(VirtualPumpPico())
+        port_name = simulator.start()
     serial_timeout = 2
     pump_controller = PumpController(controller_id, port_name, serial_timeout)
 
@@ -27,12 +33,12 @@ def test_pump_controller():
     if not pump_controller.is_connected():
         print("Failed to connect to the pump controller. Exiting test.")
         return
-    
+
     pump_controller.send_command()
     pump_controller.read_serial(wait=True)
-    
+
     print(f"Step 1: Status: {pump_controller.status}")
-    
+
     # Step 3: Register a new pump with ID 6
     pump_id = 6
     power_pin = 2
@@ -42,7 +48,7 @@ def test_pump_controller():
     initial_power_status = "OFF"
     initial_direction_status = "CW"
 
-    register_message = pump_controller.register_pump(
+    pump_controller.register_pump(
         pump_id,
         power_pin,
         direction_pin,
@@ -57,7 +63,7 @@ def test_pump_controller():
     pump_controller.send_command()
     pump_controller.send_command()
     print(f"----------------------------------------------------")
-    print(f"Register Pump: {register_message.title} - {register_message.message}")
+    print(f"Register Pump: {pump_id}")
     # print the status dictionary
     print(f"Step 3: Status: {pump_controller.status}")
 
@@ -84,9 +90,9 @@ def test_pump_controller():
     print(f"Status: {pump_controller.status}")
 
     # Step 6: Save the pump configuration
-    save_message = pump_controller.save_config(pump_id)
+    pump_controller.save_config(pump_id)
     print(f"----------------------------------------------------")
-    print(f"Save Config: {save_message.title} - {save_message.message}")
+    print(f"Save Config: {pump_id}")
     pump_controller.send_command()
     pump_controller.read_serial(wait=True)
     pump_controller.send_command()
@@ -95,18 +101,19 @@ def test_pump_controller():
 
     # Step 7: Remove the newly added pump
     print(f"----------------------------------------------------")
-    remove_message = pump_controller.remove_pump(pump_id)
+    pump_controller.remove_pump(pump_id)
     pump_controller.send_command()
     pump_controller.read_serial(wait=True)
     pump_controller.send_command()
     pump_controller.read_serial(wait=True)
-    print(f"Remove Pump: {remove_message.title} - {remove_message.message}")
+    print(f"Remove Pump: {pump_id}")
     print(f"Status: {pump_controller.status}")
 
     # Step 8: Read any remaining serial messages (if needed)
     read_message = pump_controller.read_serial()
     print(f"----------------------------------------------------")
-    print(f"Read Serial: {read_message.title} - {read_message.message}")
+    if read_message:  # None when nothing is waiting
+        print(f"Read Serial: {read_message.title} - {read_message.message}")
 
     # Step 9: Sync RTC with PC time
     print("Syncing RTC with PC time...")
@@ -117,19 +124,22 @@ def test_pump_controller():
     # Step 10: Query the RTC time
     print("Querying RTC time...")
     print(f"----------------------------------------------------")
-    response = pump_controller.query_rtc_time()
-    print(f"RTC Time: {response.title} - {response.message}")
+    pump_controller.query_rtc_time()
+    pump_controller.process_all_messages()
+    print(f"RTC Time: {pump_controller.status['rtc_time']}")
     print(f"Status: {pump_controller.status}")
-    
+
     # Step 12: Shutdown the pump controller
-    shutdown_message = pump_controller.shutdown()
-    print(f"Shutdown Pico: {shutdown_message.title} - {shutdown_message.message}")
+    pump_controller.shutdown()
+    pump_controller.process_all_messages()
+    print("Shutdown Pico")
     print(f"Status: {pump_controller.status}")
-    
+
     # Step 13: Disconnect the controller
     disconnect_message = pump_controller.disconnect()
     print(f"Disconnect: {disconnect_message.title} - {disconnect_message.message}")
     print(f"Status: {pump_controller.status}")
 
+
 # Run the test
 test_pump_controller()
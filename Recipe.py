@@ -0,0 +1,475 @@
+import re
+import logging
+import threading
+from collections import deque
+from decimal import Decimal
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+# the anchor cell names the time column, e.g. "Time point (min)"
+TIME_KEYWORD = "time"
+# when several cells mention time, the anchor must contain one of these
+TIME_HEADERS = ("time (min)", "time point (min)")
+NANOSECONDS_PER_MINUTE = 60 * 1_000_000_000
+# rows parsed at a time when a recipe is streamed
+CHUNK_ROWS = 2_000
+# chunks a streamed recipe keeps in memory
+WINDOW_CHUNKS = 8
+
+
+def read_recipe_file(
+    file_path: str, source=None, allowed_formats: tuple = None
+) -> pd.DataFrame:
+    """Read a recipe spreadsheet as raw cells, no header and no type conversion.
+
+    The format follows the extension of file_path, the data is read from source instead if
+    given, e.g. an uploaded file. allowed_formats limits the extensions that are read.
+    """
+    if allowed_formats is not None and not file_path.lower().endswith(allowed_formats):
+        raise ValueError("Unsupported file format.")
+    source = source if source is not None else file_path
+    if file_path.endswith(".csv"):
+        return pd.read_csv(source, header=None, keep_default_na=False, dtype=object)
+    elif file_path.endswith(".xlsx") or file_path.endswith(".xls"):
+        return pd.read_excel(source, header=None, keep_default_na=False, dtype=object)
+    elif file_path.endswith(".pkl"):
+        return pd.read_pickle(source, compression=None)
+    elif file_path.endswith(".json"):
+        return pd.read_json(source, dtype=False)
+    raise ValueError("Unsupported file format.")
+
+
+def find_time_anchor(raw_df: pd.DataFrame) -> tuple:
+    """Return the (row, column) position of the cell that heads the time column.
+
+    All cells are matched at once. Spreadsheets repeat the same few values over and over, so the
+    flattened cells are factorized first and only the distinct values are lower cased and
+    searched with the pandas string methods, the codes map the matches back to positions.
+    """
+    codes, values = pd.factorize(raw_df.to_numpy(dtype=object).ravel())
+    try:
+        # non string values become NaN and never match
+        lowered = pd.Series(values, dtype=object).str.lower()
+    except AttributeError:
+        # there is not a single string cell
+        raise ValueError("No cell containing the keyword 'time'.")
+    matches = lowered.str.contains(TIME_KEYWORD, regex=False, na=False).to_numpy()
+    # empty cells have the code -1, a sheet of only empty cells has no values at all
+    time_cells = np.flatnonzero(codes >= 0)
+    time_cells = time_cells[matches[codes[time_cells]]]
+    # we need at least one "time" cell as the anchor
+    if len(time_cells) == 0:
+        raise ValueError("No cell containing the keyword 'time'.")
+    elif len(time_cells) == 1:
+        anchor = time_cells[0]
+    else:
+        # Filter to choose the most relevant "Time (min)" cell as the anchor
+        relevant = np.zeros(len(values), dtype=bool)
+        for header in TIME_HEADERS:
+            relevant |= lowered.str.contains(header, regex=False, na=False).to_numpy()
+        relevant_time_cells = time_cells[relevant[codes[time_cells]]]
+        if len(relevant_time_cells) == 0:
+            raise ValueError(
+                "Multiple cell containing the keyword 'time' found, but none of them contain 'Time (min)' or 'Time point (min)'."
+            )
+        elif len(relevant_time_cells) > 1:
+            raise ValueError(
+                "Multiple cell containing the keyword 'time' found, multiple of them contain 'Time (min)' or 'Time point (min)'."
+            )
+        anchor = relevant_time_cells[0]
+    row, column = divmod(int(anchor), raw_df.shape[1])
+    return row, column
+
+
+def clean_recipe(raw_df: pd.DataFrame) -> pd.DataFrame:
+    """Cut the recipe table out of the raw cells and convert the time column to float.
+
+    The table starts at the time anchor, its first row holds the column names. Rows without a
+    time point are dropped and the time points must be unique and increasing.
+    """
+    row, column = find_time_anchor(raw_df)
+    cells = raw_df.iloc[row:, column:].to_numpy(dtype=object)
+    recipe_df = table_rows(cells[1:], cells[0])
+    check_time_points(recipe_df.iloc[:, 0].to_numpy())
+    return recipe_df
+
+
+def table_rows(cells: np.ndarray, columns, start: int = 0) -> pd.DataFrame:
+    """The rows of cells that have a time point as a recipe DataFrame indexed from start."""
+    times = cells[:, 0]
+    # keep the rows that have a time point, NaN or an empty cell is no time point
+    keep = ~(pd.isna(times) | (times == ""))
+    recipe_df = pd.DataFrame(
+        cells[keep],
+        columns=columns,
+        dtype=object,
+        index=pd.RangeIndex(start, start + int(keep.sum())),
+    )
+    time_column = recipe_df.columns[0]
+    recipe_df[time_column] = recipe_df[time_column].astype(float)
+    return recipe_df
+
+
+def check_time_points(time_points: np.ndarray, previous: float = None) -> None:
+    """Raise ValueError unless the time points increase, previous is the one before them."""
+    if previous is not None:
+        time_points = np.concatenate(([previous], time_points))
+    steps = np.diff(time_points)
+    # check if the time points are in ascending order, NaN compares false
+    if not np.all(steps >= 0):
+        raise ValueError("Time points are required in monotonically increasing order.")
+    # check if there is duplicate time points
+    if np.any(steps == 0):
+        raise ValueError("Duplicate time points are not allowed.")
+
+
+def read_recipe_chunks(file_path: str, chunk_rows: int = CHUNK_ROWS):
+    """Yield the cleaned recipe as DataFrames of at most chunk_rows rows, checked as they come.
+
+    CSV files are parsed chunk by chunk. pandas cannot read the other formats incrementally,
+    they are read whole and then cut into chunks. The time anchor has to be in the first chunk.
+    The index of the chunks counts the rows of the whole recipe.
+    """
+    if file_path.endswith(".csv"):
+        raw_chunks = pd.read_csv(
+            file_path,
+            header=None,
+            keep_default_na=False,
+            dtype=object,
+            chunksize=chunk_rows,
+        )
+    else:
+        raw_df = read_recipe_file(file_path)
+        raw_chunks = (
+            raw_df.iloc[start : start + chunk_rows]
+            for start in range(0, len(raw_df), chunk_rows)
+        )
+    columns, column, previous, start = None, 0, None, 0
+    for raw_df in raw_chunks:
+        if columns is None:
+            row, column = find_time_anchor(raw_df)
+            cells = raw_df.iloc[row:, column:].to_numpy(dtype=object)
+            columns, cells = cells[0], cells[1:]
+        else:
+            cells = raw_df.iloc[:, column:].to_numpy(dtype=object)
+        recipe_df = table_rows(cells, columns, start)
+        time_points = recipe_df.iloc[:, 0].to_numpy()
+        check_time_points(time_points, previous)
+        if len(recipe_df):
+            previous = time_points[-1]
+            start += len(recipe_df)
+            yield recipe_df
+
+
+def load_recipe(
+    file_path: str, source=None, allowed_formats: tuple = None
+) -> pd.DataFrame:
+    """Read and clean a recipe file, raises ValueError if it is not a valid recipe."""
+    return clean_recipe(read_recipe_file(file_path, source, allowed_formats))
+
+
+def format_rows(recipe_df: pd.DataFrame, start: int, end: int) -> list:
+    """The cells of the rows start to end - 1 as display strings."""
+    cells = recipe_df.iloc[start:end].to_numpy(dtype=object)
+    # Convert all cells to strings, preserving precision for numbers
+    return [
+        [
+            f"{cell:.15g}" if isinstance(cell, (float, Decimal)) else str(cell)
+            for cell in row
+        ]
+        for row in cells
+    ]
+
+
+# what an action of a recipe plan does
+POWER = 0
+DIRECTION = 1
+AUTOSAMPLER = 2
+
+
+class RecipePlan:
+    """A recipe compiled for execution, running a step needs neither pandas nor a column scan.
+
+    deadlines_ns holds the time point of every step in nanoseconds from the start. The actions
+    of all steps are stored like a sparse matrix, sorted by step: the actions of step i are at
+    offsets[i]:offsets[i + 1] of the kinds, pump_ids, states and commands arrays. Every cell
+    that sets a pump or valve is an action, also if it repeats the target of the row before, so
+    a pump switched by hand is set back. It carries the target state and the toggle command to
+    send if the pump is not in that state. Autosampler actions are always sent.
+    """
+
+    def __init__(self, deadlines_ns, offsets, kinds, pump_ids, states, commands):
+        self.deadlines_ns = deadlines_ns
+        self.offsets = offsets
+        self.kinds = kinds
+        self.pump_ids = pump_ids
+        self.states = states
+        self.commands = commands
+
+    def __len__(self) -> int:
+        return len(self.deadlines_ns)
+
+    @property
+    def total_ns(self) -> int:
+        return int(self.deadlines_ns[-1]) if len(self.deadlines_ns) else 0
+
+    def steps(self):
+        """Iterate (deadline ns, index) over every step."""
+        return zip(self.deadlines_ns.tolist(), range(len(self.deadlines_ns)))
+
+    def actions(self, index: int):
+        """Iterate (kind, pump id, target state, command) over the actions of a step."""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return zip(
+            self.kinds[start:end].tolist(),
+            self.pump_ids[start:end].tolist(),
+            self.states[start:end].tolist(),
+            self.commands[start:end].tolist(),
+        )
+
+
+def column_id(column: str) -> int:
+    """The pump id in a column name such as "Pump3", None if there is none."""
+    match = re.search(r"\d+", column)
+    return int(match.group()) if match else None
+
+
+def set_cells(recipe_df: pd.DataFrame, position: int) -> tuple:
+    """Return (row positions, values as str) of the cells of a column that are not empty.
+
+    A column holds a handful of distinct values, they are converted once and mapped back.
+    """
+    codes, values = pd.factorize(recipe_df.iloc[:, position].to_numpy(dtype=object))
+    values = np.array([str(value) for value in values], dtype=object)
+    # empty cells have the code -1, a column of only empty cells has no values at all
+    rows = np.flatnonzero(codes >= 0)
+    rows = rows[(values != "")[codes[rows]]]
+    return rows, codes[rows], values
+
+
+def compile_recipe(recipe_df: pd.DataFrame) -> RecipePlan:
+    """Turn a cleaned recipe into a RecipePlan, column by column with array operations.
+
+    The time is the first column. Pump and valve columns are named "Pump<id>" and "Valve<id>",
+    autosampler columns start with "Autosampler_slot" or "Autosampler_position". Within a step
+    the actions keep the order the procedure always used: pumps, valves, slots, positions.
+    """
+    deadlines_ns = (
+        recipe_df.iloc[:, 0].to_numpy(dtype=float) * NANOSECONDS_PER_MINUTE
+    ).astype(np.int64)
+    # one array of each per column, concatenated and sorted at the end
+    rows, orders, kinds, pump_ids, states, commands = [], [], [], [], [], []
+
+    for position, column in enumerate(recipe_df.columns[1:], start=1):
+        name = str(column)
+        if name.startswith("Pump") or name.startswith("Valve"):
+            pump_id = column_id(name)
+            if pump_id is None:
+                continue
+            kind = POWER if name.startswith("Pump") else DIRECTION
+            column_rows, codes, values = set_cells(recipe_df, position)
+            # compared with the upper cased live status of the pump
+            targets = np.array([value.upper() for value in values], dtype=object)
+            column_states = targets[codes]
+            command = f"{pump_id}:pw" if kind == POWER else f"{pump_id}:di"
+            column_commands = np.full(len(column_rows), command, dtype=object)
+            order = kind
+        elif name.startswith("Autosampler_slot"):
+            kind, pump_id, order = AUTOSAMPLER, -1, 2
+            column_rows, codes, values = set_cells(recipe_df, position)
+            column_states = np.full(len(column_rows), None, dtype=object)
+            column_commands = np.array([f"slot:{value}" for value in values])[codes]
+        elif name.startswith("Autosampler_position"):
+            kind, pump_id, order = AUTOSAMPLER, -1, 3
+            column_rows, codes, values = set_cells(recipe_df, position)
+            valid = np.array([value.isdigit() for value in values], dtype=bool)[codes]
+            for row, code in zip(column_rows[~valid], codes[~valid]):
+                logging.error(
+                    f"Warning: Invalid autosampler position: {values[code]} at index {row}"
+                )
+            column_rows, codes = column_rows[valid], codes[valid]
+            column_states = np.full(len(column_rows), None, dtype=object)
+            # int() drops leading zeros like the manual position entry
+            column_commands = np.array(
+                [
+                    f"position:{int(value)}" if value.isdigit() else ""
+                    for value in values
+                ]
+            )[codes]
+        else:
+            continue
+        rows.append(column_rows)
+        orders.append(np.full(len(column_rows), order, dtype=np.int8))
+        kinds.append(np.full(len(column_rows), kind, dtype=np.int8))
+        pump_ids.append(np.full(len(column_rows), pump_id, dtype=np.int32))
+        states.append(column_states)
+        commands.append(column_commands.astype(object))
+
+    if rows:
+        rows = np.concatenate(rows)
+        # stable sort by step, then by action type, columns keep their order
+        sort = np.lexsort((np.concatenate(orders), rows))
+        rows = rows[sort]
+        kinds = np.concatenate(kinds)[sort]
+        pump_ids = np.concatenate(pump_ids)[sort]
+        states = np.concatenate(states)[sort]
+        commands = np.concatenate(commands)[sort]
+    else:
+        rows = np.zeros(0, dtype=np.int64)
+        kinds = np.zeros(0, dtype=np.int8)
+        pump_ids = np.zeros(0, dtype=np.int32)
+        states = commands = np.zeros(0, dtype=object)
+    offsets = np.searchsorted(rows, np.arange(len(deadlines_ns) + 1))
+    return RecipePlan(deadlines_ns, offsets, kinds, pump_ids, states, commands)
+
+
+class RecipeChunk(NamedTuple):
+    start: int  # index of the first row in the whole recipe
+    recipe_df: pd.DataFrame
+    plan: RecipePlan
+
+
+class RecipeStream:
+    """A recipe read and compiled chunk by chunk while it runs, for recipes too long to load.
+
+    steps() reads the file as the procedure consumes the steps, so it can start once the first
+    chunk is compiled, and only the last few chunks stay in memory. actions(), deadlines_ns and
+    format_rows() answer for the rows in that window. The file is read once per run, the number
+    of rows and the last time point are known once a run has read it to the end, until then
+    len() counts the rows read so far. An error further down the file is raised by steps() when
+    the run gets there. steps() starts over from the first row every time it is called.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        chunk_rows: int = CHUNK_ROWS,
+        window_chunks: int = WINDOW_CHUNKS,
+    ):
+        self.file_path = file_path
+        self.chunk_rows = chunk_rows
+        self.window = deque(maxlen=window_chunks)
+        self.lock = threading.Lock()
+        self.run = 0
+        self.rows_read = 0
+        # set once a run has read the file to the end, None until then
+        self.row_count = None
+        self.total_ns = None
+        # what a run found wrong with the file, if anything
+        self.error = None
+        # read the first chunk now, a file that is not a recipe fails here
+        chunks = read_recipe_chunks(file_path, chunk_rows)
+        first = next(chunks, None)
+        if first is None:
+            raise ValueError("The recipe has no time points.")
+        self.columns = list(first.columns)
+        self.window.append(RecipeChunk(0, first, compile_recipe(first)))
+        self.rows_read = len(first)
+        # the first run goes on with this reader instead of reading the first chunk again
+        self.opened = chunks
+        self.deadlines_ns = WindowDeadlines(self)
+
+    def __len__(self) -> int:
+        return self.row_count if self.row_count is not None else self.rows_read
+
+    def steps(self):
+        """Yield (deadline ns, index) of every step, reading and compiling the chunks as needed."""
+        with self.lock:
+            self.run += 1
+            run = self.run
+            opened, self.opened = self.opened, None
+            first = self.window[0] if opened is not None else None
+        if opened is not None:
+            chunks = opened
+            yield from first.plan.steps()
+        else:
+            chunks = read_recipe_chunks(self.file_path, self.chunk_rows)
+        last = first
+        while True:
+            try:
+                recipe_df = next(chunks, None)
+            except Exception as e:
+                self.error = e
+                raise
+            if recipe_df is None:
+                break
+            plan = compile_recipe(recipe_df)
+            start = recipe_df.index[0]
+            last = RecipeChunk(start, recipe_df, plan)
+            with self.lock:
+                if run != self.run:
+                    # a newer run started over
+                    return
+                if not self.window or self.window[-1].start < start:
+                    self.window.append(RecipeChunk(start, recipe_df, plan))
+                    self.rows_read = max(self.rows_read, start + len(plan))
+                else:
+                    # read again from the start, the window keeps the newest chunks
+                    self.window.clear()
+                    self.window.append(RecipeChunk(start, recipe_df, plan))
+            for deadline_ns, index in plan.steps():
+                yield deadline_ns, start + index
+        # read to the end
+        if last is not None:
+            self.total_ns = int(last.plan.deadlines_ns[-1])
+            self.row_count = last.start + len(last.plan)
+
+    def chunk(self, index: int) -> RecipeChunk:
+        with self.lock:
+            for chunk in self.window:
+                if chunk.start <= index < chunk.start + len(chunk.plan):
+                    return chunk
+        return None
+
+    def actions(self, index: int):
+        chunk = self.chunk(index)
+        if chunk is None:
+            logging.error(f"Error: recipe step {index} is no longer in memory")
+            return iter(())
+        return chunk.plan.actions(index - chunk.start)
+
+    def format_rows(self, start: int, end: int) -> list:
+        """Like format_rows, rows outside the window are shown as placeholders."""
+        rows = []
+        index = start
+        while index < end:
+            chunk = self.chunk(index)
+            if chunk is None:
+                rows.append(["…"] * len(self.columns))
+                index += 1
+                continue
+            stop = min(end, chunk.start + len(chunk.plan))
+            rows += format_rows(
+                chunk.recipe_df, index - chunk.start, stop - chunk.start
+            )
+            index = stop
+        return rows
+
+
+class WindowDeadlines:
+    """The deadlines of a RecipeStream as a sequence over the rows read so far.
+
+    Rows that already left the window report the oldest deadline still in it, they have passed
+    anyway. Index -1 is the last deadline read.
+    """
+
+    def __init__(self, stream: RecipeStream):
+        self.stream = stream
+
+    def __len__(self) -> int:
+        return self.stream.rows_read
+
+    def __getitem__(self, index: int) -> int:
+        stream = self.stream
+        with stream.lock:
+            window = list(stream.window)
+        if index < 0:
+            return int(window[-1].plan.deadlines_ns[index])
+        for chunk in window:
+            if index < chunk.start:
+                return int(chunk.plan.deadlines_ns[0])
+            if index < chunk.start + len(chunk.plan):
+                return int(chunk.plan.deadlines_ns[index - chunk.start])
+        raise IndexError(index)
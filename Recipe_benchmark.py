@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from Recipe import (
+    read_recipe_file,
+    clean_recipe,
+    compile_recipe,
+    load_recipe,
+    RecipeStream,
+)
+
+PUMPS = 8
+
+
+# the loader PicoController.load_recipe used before, kept to compare against
+def legacy_clean_recipe(recipe_df: pd.DataFrame) -> pd.DataFrame:
+    time_cells = [
+        (row_idx, col_idx, cell)
+        for row_idx, row in recipe_df.iterrows()
+        for col_idx, cell in enumerate(row)
+        if isinstance(cell, str) and "time" in cell.lower()
+    ]
+    if len(time_cells) == 0:
+        raise ValueError("No cell containing the keyword 'time'.")
+    elif len(time_cells) == 1:
+        time_row_idx, time_col_idx, _ = time_cells[0]
+    else:
+        relevant_time_cells = [
+            cell
+            for cell in time_cells
+            if "time (min)" in cell[2].lower() or "time point (min)" in cell[2].lower()
+        ]
+        if len(relevant_time_cells) != 1:
+            raise ValueError("No single 'Time (min)' or 'Time point (min)' cell.")
+        time_row_idx, time_col_idx, _ = relevant_time_cells[0]
+
+    recipe_df = recipe_df.iloc[time_row_idx:, time_col_idx:]
+    recipe_df.columns = recipe_df.iloc[0]
+    recipe_df = recipe_df[1:].reset_index(drop=True)
+    recipe_df.dropna(subset=[recipe_df.columns[0]], inplace=True)
+    recipe_df = recipe_df[recipe_df.iloc[:, 0] != ""]
+    recipe_df[recipe_df.columns[0]] = recipe_df[recipe_df.columns[0]].apply(float)
+    if not recipe_df[recipe_df.columns[0]].is_monotonic_increasing:
+        raise ValueError("Time points are required in monotonically increasing order.")
+    if recipe_df[recipe_df.columns[0]].duplicated().any():
+        raise ValueError("Duplicate time points are not allowed.")
+    return recipe_df
+
+
+# what PicoController.execute_procedure did per step before the recipe was compiled
+def legacy_step(recipe_df: pd.DataFrame, index: int) -> tuple:
+    row = recipe_df.iloc[index]
+    target_time_ns = int(float(row["Time point (min)"]) * 60 * 1_000_000_000)
+    actions = [
+        {col: row[col] for col in row.index if col.startswith(prefix)}
+        for prefix in ("Pump", "Valve", "Autosampler_slot", "Autosampler_position")
+    ]
+    return target_time_ns, actions
+
+
+def step_times(recipe_df: pd.DataFrame, plan, steps: int) -> tuple:
+    """Mean seconds per step to get the deadline and actions, before and now."""
+    indices = range(min(steps, len(plan)))
+    legacy_s, _ = timed(lambda: [legacy_step(recipe_df, i) for i in indices])
+    plan_s, _ = timed(
+        lambda: [(int(plan.deadlines_ns[i]), list(plan.actions(i))) for i in indices]
+    )
+    return legacy_s / len(indices), plan_s / len(indices)
+
+
+def synthetic_recipe(rows: int, note_columns: int, seed: int = 0) -> pd.DataFrame:
+    """Raw cells of a recipe sheet: a title block, the header and rows with long notes.
+
+    Some notes mention time as well, so the anchor has to be picked by its header.
+    """
+    rng = np.random.default_rng(seed)
+    header = (
+        ["", "Time point (min)"]
+        + [f"Pump{i}" for i in range(1, PUMPS + 1)]
+        + [f"Valve{i}" for i in range(1, PUMPS + 1)]
+        + ["Autosampler_slot"]
+        + ["Notes"] * note_columns
+    )
+    width = len(header)
+    # step every half minute, with blank spacer rows in between
+    times = np.round(np.arange(rows) * 0.5, 2).astype(str)
+    times[rng.random(rows) < 0.02] = ""
+    on_off = np.where(rng.random((rows, PUMPS)) < 0.5, "On", "Off")
+    cw_ccw = np.where(rng.random((rows, PUMPS)) < 0.5, "CW", "CCW")
+    slots = np.where(rng.random(rows) < 0.1, "1", "")
+    notes = np.where(
+        rng.random((rows, note_columns)) < 0.05,
+        "flush the line, wait time depends on the batch " * 4,
+        "sample collected and logged for the batch record " * 4,
+    )
+    body = np.column_stack(
+        [np.full(rows, ""), times, on_off, cw_ccw, slots, notes]
+    ).astype(object)
+    title = np.full((3, width), "", dtype=object)
+    title[0, 0] = "Recipe generated for the benchmark"
+    title[1, 0] = f"created at time {datetime.now():%H:%M}"
+    cells = np.vstack([title, np.array(header, dtype=object), body])
+    return pd.DataFrame(cells)
+
+
+def timed(function, *args) -> tuple:
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def stream_figures(csv_path: str, plan) -> dict:
+    """Time to the first step and peak memory of a streamed run and of loading the file whole."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    stream = RecipeStream(csv_path)
+    steps = stream.steps()
+    next(steps)
+    first_step_s = time.perf_counter() - start
+    count = 1 + sum(1 for _ in steps)
+    stream_peak = tracemalloc.get_traced_memory()[1]
+    if count != len(plan) or stream.total_ns != plan.total_ns:
+        raise RuntimeError("the streamed recipe differs")
+    del stream, steps
+
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    whole_plan = compile_recipe(load_recipe(csv_path))
+    whole_s = time.perf_counter() - start
+    whole_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del whole_plan
+    return {
+        "stream_first_step_s": round(first_step_s, 4),
+        "load_first_step_s": round(whole_s, 4),
+        "stream_peak_mb": round(stream_peak / 1e6, 1),
+        "load_peak_mb": round(whole_peak / 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the recipe loader with the row by row one it replaced."
+    )
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--notes", type=int, default=4, help="note columns")
+    parser.add_argument(
+        "--steps", type=int, default=2000, help="steps to time the execution on"
+    )
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    raw_df = synthetic_recipe(args.rows, args.notes)
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "recipe.csv")
+        raw_df.to_csv(csv_path, header=False, index=False)
+        read_s, csv_df = timed(read_recipe_file, csv_path)
+
+        legacy_s, legacy = timed(legacy_clean_recipe, csv_df.copy())
+        clean_s, recipe = timed(clean_recipe, csv_df)
+        if not recipe.equals(legacy.reset_index(drop=True)):
+            raise RuntimeError("the cleaned recipes differ")
+        compile_s, plan = timed(compile_recipe, recipe)
+        stream = stream_figures(csv_path, plan)
+    legacy_step_s, plan_step_s = step_times(recipe, plan, args.steps)
+
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "options": {"rows": args.rows, "note_columns": args.notes, "steps": args.steps},
+        "results": {
+            "cells": int(csv_df.size),
+            "read_csv_s": round(read_s, 4),
+            "legacy_clean_s": round(legacy_s, 4),
+            "clean_s": round(clean_s, 4),
+            "speedup": round(legacy_s / clean_s, 1),
+            "recipe_rows": len(recipe),
+            "compile_s": round(compile_s, 4),
+            "plan_actions": len(plan.commands),
+            "legacy_step_us": round(legacy_step_s * 1e6, 2),
+            "plan_step_us": round(plan_step_s * 1e6, 2),
+            **stream,
+        },
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
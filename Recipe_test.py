@@ -0,0 +1,195 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import Recipe
+from Recipe import (
+    AUTOSAMPLER,
+    DIRECTION,
+    NANOSECONDS_PER_MINUTE,
+    POWER,
+    clean_recipe,
+    compile_recipe,
+    format_rows,
+    load_recipe,
+    read_recipe_chunks,
+    RecipeStream,
+)
+
+HEADER = [
+    "Time point (min)",
+    "Pump1",
+    "Pump2",
+    "Valve1",
+    "Autosampler_slot",
+    "Autosampler_position",
+    "Notes",
+]
+
+
+def raw_recipe(rows: list) -> pd.DataFrame:
+    """Raw cells with a title row above the header, like a recipe sheet."""
+    title = ["Recipe", "", "", "", "", "", ""]
+    return pd.DataFrame([title, HEADER] + rows, dtype=object)
+
+
+ROWS = [
+    ["0", "On", "", "CW", "1", "", "start"],
+    ["", "", "", "", "", "", "spacer without a time point"],
+    ["0.5", "ON", "Off", "", "", "12", ""],
+    ["1", "on", "", "ccw", "", "x", ""],
+    ["2.25", "Off", "On", "CCW", "2", "007", "done"],
+]
+
+
+def test_clean_recipe_cuts_the_table():
+    recipe_df = clean_recipe(raw_recipe(ROWS))
+    assert list(recipe_df.columns) == HEADER
+    assert recipe_df.iloc[:, 0].tolist() == [0.0, 0.5, 1.0, 2.25]
+    assert list(recipe_df.index) == [0, 1, 2, 3]
+
+
+@pytest.mark.parametrize(
+    "times, message",
+    [(["0", "2", "1"], "increasing"), (["0", "1", "1"], "Duplicate")],
+)
+def test_clean_recipe_checks_time_points(times, message):
+    rows = [[time, "On", "", "", "", "", ""] for time in times]
+    with pytest.raises(ValueError, match=message):
+        clean_recipe(raw_recipe(rows))
+
+
+def test_clean_recipe_needs_a_time_cell():
+    # a sheet without any text, e.g. a JSON recipe of empty cells
+    with pytest.raises(ValueError, match="keyword 'time'"):
+        clean_recipe(pd.DataFrame([[np.nan, np.nan], [np.nan, 1]], dtype=object))
+    with pytest.raises(ValueError, match="keyword 'time'"):
+        clean_recipe(pd.DataFrame([[np.nan, np.nan]], dtype=object))
+
+
+def test_compile_recipe_keeps_every_set_target():
+    plan = compile_recipe(clean_recipe(raw_recipe(ROWS)))
+    assert len(plan) == 4
+    assert plan.deadlines_ns.tolist() == [
+        0,
+        NANOSECONDS_PER_MINUTE // 2,
+        NANOSECONDS_PER_MINUTE,
+        int(2.25 * NANOSECONDS_PER_MINUTE),
+    ]
+    assert list(plan.actions(0)) == [
+        (POWER, 1, "ON", "1:pw"),
+        (DIRECTION, 1, "CW", "1:di"),
+        (AUTOSAMPLER, -1, None, "slot:1"),
+    ]
+    # pump 1 repeats its target, the action stays so a pump switched by hand is set back
+    assert list(plan.actions(1)) == [
+        (POWER, 1, "ON", "1:pw"),
+        (POWER, 2, "OFF", "2:pw"),
+        (AUTOSAMPLER, -1, None, "position:12"),
+    ]
+    # an invalid position is skipped
+    assert list(plan.actions(2)) == [
+        (POWER, 1, "ON", "1:pw"),
+        (DIRECTION, 1, "CCW", "1:di"),
+    ]
+    assert list(plan.actions(3)) == [
+        (POWER, 1, "OFF", "1:pw"),
+        (POWER, 2, "ON", "2:pw"),
+        (DIRECTION, 1, "CCW", "1:di"),
+        (AUTOSAMPLER, -1, None, "slot:2"),
+        (AUTOSAMPLER, -1, None, "position:7"),
+    ]
+    assert list(plan.steps()) == list(zip(plan.deadlines_ns.tolist(), range(4)))
+
+
+def test_compile_recipe_skips_columns_without_set_cells():
+    # JSON and pickled recipes keep empty cells as NaN
+    rows = [row[:2] + [np.nan] + row[3:] for row in ROWS]
+    plan = compile_recipe(clean_recipe(raw_recipe(rows)))
+    assert len(plan) == 4
+    assert list(plan.actions(1)) == [
+        (POWER, 1, "ON", "1:pw"),
+        (AUTOSAMPLER, -1, None, "position:12"),
+    ]
+
+
+def test_format_rows():
+    recipe_df = clean_recipe(raw_recipe(ROWS))
+    assert format_rows(recipe_df, 1, 2) == [["0.5", "ON", "Off", "", "", "12", ""]]
+
+
+def test_chunks_match_the_whole_recipe(tmp_path):
+    rows = [
+        [str(i * 0.5), "On" if i % 3 else "Off", "", "CW", "", "", ""]
+        for i in range(25)
+    ]
+    path = tmp_path / "recipe.csv"
+    raw_recipe(rows).to_csv(path, header=False, index=False)
+    whole = load_recipe(str(path))
+    chunks = list(read_recipe_chunks(str(path), chunk_rows=7))
+    assert len(chunks) > 1
+    assert pd.concat(chunks).equals(whole)
+    plan = compile_recipe(whole)
+    index = 0
+    for chunk in chunks:
+        chunk_plan = compile_recipe(chunk)
+        for row in range(len(chunk_plan)):
+            assert list(chunk_plan.actions(row)) == list(plan.actions(index))
+            index += 1
+    assert index == len(plan)
+
+
+def test_chunks_check_time_points_across_chunks(tmp_path):
+    rows = [[str(time), "On", "", "", "", "", ""] for time in (0, 1, 2, 3, 2.5)]
+    path = tmp_path / "recipe.csv"
+    raw_recipe(rows).to_csv(path, header=False, index=False)
+    chunks = read_recipe_chunks(str(path), chunk_rows=3)
+    with pytest.raises(ValueError, match="increasing"):
+        list(chunks)
+
+
+def test_stream_reads_the_file_once_per_run(tmp_path, monkeypatch):
+    rows = [[str(i), "On" if i % 2 else "Off", "", "", "", "", ""] for i in range(50)]
+    path = tmp_path / "recipe.csv"
+    raw_recipe(rows).to_csv(path, header=False, index=False)
+    plan = compile_recipe(load_recipe(str(path)))
+    reads = []
+    read = Recipe.read_recipe_chunks
+    monkeypatch.setattr(
+        Recipe,
+        "read_recipe_chunks",
+        lambda *args: reads.append(args) or read(*args),
+    )
+
+    stream = RecipeStream(str(path), chunk_rows=8, window_chunks=2)
+    # the title and the header take two rows of the first chunk
+    assert len(stream) == 6
+    assert stream.total_ns is None
+    steps = stream.steps()
+    assert list(steps) == list(plan.steps())
+    # the first run goes on with the reader that read the first chunk
+    assert len(reads) == 1
+    assert len(stream) == 50
+    assert stream.total_ns == plan.total_ns
+    # only the last chunks are kept
+    assert stream.chunk(0) is None
+    assert list(stream.actions(49)) == list(plan.actions(49))
+    assert stream.format_rows(0, 1) == [["…"] * len(HEADER)]
+
+    # a second run starts over
+    assert list(stream.steps()) == list(plan.steps())
+    assert len(reads) == 2
+
+
+def test_stream_raises_errors_further_down(tmp_path):
+    times = [0, 1, 2, 3, 4, 5, 4.5]
+    rows = [[str(time), "On", "", "", "", "", ""] for time in times]
+    path = tmp_path / "recipe.csv"
+    raw_recipe(rows).to_csv(path, header=False, index=False)
+    stream = RecipeStream(str(path), chunk_rows=3)
+    steps = stream.steps()
+    assert [next(steps) for _ in range(3)][-1][1] == 2
+    with pytest.raises(ValueError, match="increasing"):
+        list(steps)
+    assert stream.error is not None
+    assert stream.row_count is None
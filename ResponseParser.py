@@ -0,0 +1,164 @@
+import re
+import json
+from datetime import datetime
+
+# Patterns are compiled once at import, every parser below reuses them
+PUMP_INFO_PATTERN = re.compile(
+    r"Pump(\d+) Info: Power Pin: (-?\d+), Direction Pin: (-?\d+), Initial Power Pin Value: (\d+), Initial Direction Pin Value: (\d+), Current Power Status: (ON|OFF), Current Direction Status: (CW|CCW)"
+)
+PUMP_STATUS_PATTERN = re.compile(
+    r"Pump(\d+) Status: Power: (ON|OFF), Direction: (CW|CCW)"
+)
+# response format: RTC Time: 2024-9-26 11:47:39
+RTC_TIME_PATTERN = re.compile(r"RTC Time: (\d+)-(\d+)-(\d+) (\d+):(\d+):(\d+)")
+AUTOSAMPLER_STATUS_PATTERN = re.compile(r"position: (\d+), direction: (Left|Right)")
+# response format: moved to position 1000 in 0.004037 seconds. relative position: 0
+GOTO_POSITION_PATTERN = re.compile(
+    r"moved to position (\d+) in (\S+) seconds. relative position: (\d+)"
+)
+# response format: Info: moved to slot 1 in 0.005856 seconds. relative position: 0
+GOTO_SLOT_PATTERN = re.compile(r"moved to slot (\S+)")
+# response format: Success: Moved one step Left, current position: 701
+MOVE_ONE_STEP_PATTERN = re.compile(r"Moved one step (\S+), current position: (\d+)")
+
+
+def parse_text(response: str) -> str:
+    return response
+
+
+def parse_pump_info(response: str) -> dict:
+    """Return {pump_id: info} for every pump in the response, sorted by pump_id."""
+    pumps_info = {}
+    for match in sorted(PUMP_INFO_PATTERN.findall(response), key=lambda x: int(x[0])):
+        (
+            pump_id,
+            power_pin,
+            direction_pin,
+            initial_power_pin_value,
+            initial_direction_pin_value,
+            power_status,
+            direction_status,
+        ) = match
+        pumps_info[int(pump_id)] = {
+            "power_pin": int(power_pin),
+            "direction_pin": int(direction_pin),
+            "initial_power_pin_value": int(initial_power_pin_value),
+            "initial_direction_pin_value": int(initial_direction_pin_value),
+            "power_status": power_status,
+            "direction_status": direction_status,
+        }
+    return pumps_info
+
+
+def parse_pump_status(response: str) -> dict:
+    """Return {pump_id: (power_status, direction_status)} for every pump in the response."""
+    return {
+        int(pump_id): (power_status, direction_status)
+        for pump_id, power_status, direction_status in PUMP_STATUS_PATTERN.findall(
+            response
+        )
+    }
+
+
+def parse_rtc_time(response: str) -> datetime:
+    """Return the RTC time as a datetime, None if the response is malformed."""
+    match = RTC_TIME_PATTERN.search(response)
+    if match:
+        return datetime(*map(int, match.groups()))
+    return None
+
+
+def parse_autosampler_config(response: str) -> dict:
+    """Return the slot configuration {slot: position}, None if the JSON can't be decoded."""
+    try:
+        return json.loads(response.partition("Autosampler Configuration:")[2])
+    except json.JSONDecodeError:
+        return None
+
+
+def parse_autosampler_status(response: str) -> tuple:
+    """Return (position, direction), None if the response is malformed."""
+    match = AUTOSAMPLER_STATUS_PATTERN.search(response)
+    if match:
+        return int(match.group(1)), match.group(2)
+    return None
+
+
+def parse_goto_position(response: str) -> tuple:
+    """Return (position, seconds, relative_position), None if the response is malformed."""
+    match = GOTO_POSITION_PATTERN.search(response)
+    if match:
+        return int(match.group(1)), float(match.group(2)), int(match.group(3))
+    return None
+
+
+def parse_goto_slot(response: str) -> str:
+    match = GOTO_SLOT_PATTERN.search(response)
+    if match:
+        return match.group(1)
+    return None
+
+
+def parse_move_one_step(response: str) -> tuple:
+    """Return (direction, position), None if the response is malformed."""
+    match = MOVE_ONE_STEP_PATTERN.search(response)
+    if match:
+        return match.group(1), int(match.group(2))
+    return None
+
+
+class ResponseTable:
+    """Dispatch table mapping a response to its kind and parsed value.
+
+    A response is looked up by the last word before its first colon ("Pump3 Info: ..." -> "Info",
+    "RTC Time: ..." -> "Time"), a single dict lookup for every well formed line. Lines with an
+    unknown prefix fall back to scanning the markers in order, like the old if/elif chains did.
+    """
+
+    def __init__(self, entries):
+        # entries: (prefix, marker, kind, parser), in the priority order of the old chains
+        self.entries = tuple(entries)
+        self.prefixes = {prefix: (kind, parser) for prefix, _, kind, parser in entries}
+
+    def parse(self, response: str) -> tuple:
+        """Return (kind, value), kind is None for responses no entry matches."""
+        head = response.partition(":")[0].rpartition(" ")[2]
+        entry = self.prefixes.get(head)
+        if entry is None:
+            for _, marker, kind, parser in self.entries:
+                if marker in response:
+                    entry = (kind, parser)
+                    break
+            else:
+                return None, response
+        kind, parser = entry
+        return kind, parser(response)
+
+
+PUMP_RESPONSES = ResponseTable(
+    [
+        ("Info", "Info", "pump_info", parse_pump_info),
+        ("Ping", "Ping", "ping", parse_text),
+        ("Status", "Status", "pump_status", parse_pump_status),
+        ("Time", "RTC Time", "rtc_time", parse_rtc_time),
+        ("Success", "Success", "success", parse_text),
+        ("Error", "Error", "error", parse_text),
+    ]
+)
+
+AUTOSAMPLER_RESPONSES = ResponseTable(
+    [
+        (
+            "Configuration",
+            "Autosampler Configuration:",
+            "config",
+            parse_autosampler_config,
+        ),
+        ("Ping", "Ping", "ping", parse_text),
+        ("Time", "RTC Time", "rtc_time", parse_rtc_time),
+        ("Status", "Autosampler Status", "status", parse_autosampler_status),
+        ("Info", "moved to", "moved", parse_text),
+        ("Error", "Error", "error", parse_text),
+        ("Success", "Success", "success", parse_text),
+    ]
+)
@@ -0,0 +1,91 @@
+import re
+import time
+import json
+from datetime import datetime
+
+from ResponseParser import PUMP_RESPONSES, AUTOSAMPLER_RESPONSES
+
+# a mix of the lines a pump and an autosampler controller send during a procedure
+PUMP_LINES = [
+    "Pump1 Info: Power Pin: 0, Direction Pin: 1, Initial Power Pin Value: 0, Initial Direction Pin Value: 0, Current Power Status: OFF, Current Direction Status: CW, "
+    "Pump2 Info: Power Pin: 2, Direction Pin: 3, Initial Power Pin Value: 0, Initial Direction Pin Value: 0, Current Power Status: ON, Current Direction Status: CCW",
+    "Pump1 Status: Power: ON, Direction: CW, Pump2 Status: Power: OFF, Direction: CCW",
+    "RTC Time: 2024-9-26 11:47:39",
+    "Success: Pump 1 power toggled",
+    "RTC Time: 2024-9-26 11:47:40",
+    "Error: Invalid command",
+]
+AUTOSAMPLER_LINES = [
+    'Autosampler Configuration: {"1": 100, "2": 200, "waste": 0}',
+    "Autosampler Status: position: 100, direction: Left",
+    "Info: moved to position 1000 in 0.004037 seconds. relative position: 0",
+    "RTC Time: 2024-9-26 11:47:39",
+    "Success: Moved one step Left, current position: 701",
+]
+
+
+# the substring chains with per call regexes the controllers used before
+def legacy_parse_pump(response):
+    if "Info" in response:
+        info_pattern = re.compile(
+            r"Pump(\d+) Info: Power Pin: (-?\d+), Direction Pin: (-?\d+), Initial Power Pin Value: (\d+), Initial Direction Pin Value: (\d+), Current Power Status: (ON|OFF), Current Direction Status: (CW|CCW)"
+        )
+        return sorted(info_pattern.findall(response), key=lambda x: int(x[0]))
+    elif "Ping" in response:
+        return response
+    elif "Status" in response:
+        status_pattern = re.compile(
+            r"Pump(\d+) Status: Power: (ON|OFF), Direction: (CW|CCW)"
+        )
+        return status_pattern.findall(response)
+    elif "RTC Time" in response:
+        match = re.search(r"RTC Time: (\d+-\d+-\d+ \d+:\d+:\d+)", response)
+        return datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S")
+    return response
+
+
+def legacy_parse_autosampler(response):
+    if "Autosampler Configuration:" in response:
+        return json.loads(response.replace("Autosampler Configuration:", "").strip())
+    elif "Autosampler Status" in response:
+        return re.search(r"position: (\d+), direction: (Left|Right)", response)
+    elif "moved to position" in response:
+        return re.search(
+            r"moved to position (\d+) in (\S+) seconds. relative position: (\d+)",
+            response,
+        )
+    elif "RTC Time" in response:
+        match = re.search(r"RTC Time: (\d+-\d+-\d+ \d+:\d+:\d+)", response)
+        return datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S")
+    elif "Moved one step" in response:
+        return re.search(r"Moved one step (\S+), current position: (\d+)", response)
+    return response
+
+
+def lines_per_second(parse, lines, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for line in lines:
+            parse(line)
+    return rounds * len(lines) / (time.perf_counter() - start)
+
+
+def main(rounds=20000):
+    for name, legacy, table, lines in [
+        ("pump", legacy_parse_pump, PUMP_RESPONSES.parse, PUMP_LINES),
+        (
+            "autosampler",
+            legacy_parse_autosampler,
+            AUTOSAMPLER_RESPONSES.parse,
+            AUTOSAMPLER_LINES,
+        ),
+    ]:
+        before = lines_per_second(legacy, lines, rounds)
+        after = lines_per_second(table, lines, rounds)
+        print(
+            f"{name}: before {before:,.0f} lines/s, after {after:,.0f} lines/s ({after / before:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+from collections import deque
+
+
+class ResponseRouter:
+    """Read every line from a controller and hand it to the command waiting for that reply type.
+
+    Each outstanding command registers the keyword its reply must contain. Replies resolve the
+    oldest pending command with a matching keyword, so several commands can be in flight at once
+    and answered out of order. Lines nobody is waiting for (late replies, periodic RTC updates)
+    go to the unsolicited callback instead of being paired with the wrong command.
+    """
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        logger: logging.Logger,
+        device_name: str = "Pico",
+        unsolicited_callback=None,
+        disconnect_callback=None,
+    ):
+        self.reader = reader
+        self.logger = logger
+        self.device_name = device_name
+        self.unsolicited_callback = unsolicited_callback  # async callable(response)
+        self.disconnect_callback = disconnect_callback  # async callable()
+        self.pending = deque()  # (keywords, future) in the order the commands were sent
+        self.read_task = None
+        # keep references to callback tasks so they are not garbage collected
+        self.callback_tasks = set()
+
+    def start(self) -> None:
+        if self.read_task is None:
+            self.read_task = asyncio.create_task(self.read_loop())
+
+    async def stop(self) -> None:
+        if self.read_task is not None:
+            self.read_task.cancel()
+            try:
+                await self.read_task
+            except asyncio.CancelledError:
+                pass
+            self.read_task = None
+        self.fail_pending()
+
+    def expect(self, keyword) -> asyncio.Future:
+        """Register a reply keyword, must be called before the command is written.
+
+        keyword may also be a tuple of keywords, a reply containing any of them matches.
+        """
+        keywords = (keyword,) if isinstance(keyword, str) else tuple(keyword)
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((keywords, future))
+        return future
+
+    async def wait(self, future: asyncio.Future, timeout: float) -> str:
+        """Wait for a reply registered with expect, returns None on error or timeout."""
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        except TimeoutError:
+            self.logger.warning(
+                f"No response from {self.device_name} within {timeout} s"
+            )
+            return None
+        finally:
+            self.discard(future)
+
+    def discard(self, future: asyncio.Future) -> None:
+        for entry in self.pending:
+            if entry[1] is future:
+                self.pending.remove(entry)
+                break
+
+    def fail_pending(self) -> None:
+        while self.pending:
+            _, future = self.pending.popleft()
+            if not future.done():
+                future.set_result(None)
+
+    async def read_loop(self) -> None:
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:  # EOF, the device is gone
+                    self.logger.error(f"Connection to {self.device_name} lost.")
+                    break
+                response = line.decode("utf-8").strip()
+                if response:
+                    self.dispatch(response)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error(f"Error: {e}")
+        # only reached when the connection dropped
+        self.fail_pending()
+        if self.disconnect_callback:
+            self.schedule(self.disconnect_callback())
+
+    def dispatch(self, response: str) -> None:
+        if "RTC Time" not in response:  # Don't log the RTC time response
+            self.logger.debug(f"{self.device_name} -> PC: {response}")
+        if "Error" in response:
+            # the device answers in order, an error belongs to the oldest unanswered command
+            self.logger.error(f"{response}")
+            if self.pending:
+                _, future = self.pending.popleft()
+                if not future.done():
+                    future.set_result(None)
+            return
+        for entry in self.pending:
+            keywords, future = entry
+            if any(keyword in response for keyword in keywords):
+                self.pending.remove(entry)
+                if not future.done():
+                    future.set_result(response)
+                return
+        if self.unsolicited_callback:
+            self.schedule(self.unsolicited_callback(response))
+        else:
+            self.logger.debug(f"Unsolicited response ignored: {response}")
+
+    def schedule(self, coroutine) -> None:
+        # callbacks may issue new commands, so never run them inside the read loop
+        task = asyncio.create_task(coroutine)
+        self.callback_tasks.add(task)
+        task.add_done_callback(self.callback_tasks.discard)
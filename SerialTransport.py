@@ -0,0 +1,256 @@
+import io
+import os
+import serial
+import asyncio
+import logging
+
+# buffer limits used for write flow control, same defaults as the asyncio selector transports
+WRITE_BUFFER_HIGH_WATER = 64 * 1024
+WRITE_BUFFER_LOW_WATER = 16 * 1024
+READ_CHUNK_SIZE = 4096
+
+
+class SerialTransport(asyncio.Transport):
+    """asyncio transport for a pyserial port, driven by the event loop instead of blocking reads.
+
+    On POSIX the port's file descriptor is registered with the loop's selector, so a silent
+    device costs nothing until it sends data. Ports without a selectable descriptor (Windows
+    COM ports, socket:// urls) fall back to polling the port from the loop with a zero timeout.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        protocol: asyncio.Protocol,
+        serial_port: serial.SerialBase,
+        poll_interval: float = 0.005,
+    ):
+        super().__init__()
+        self._loop = loop
+        self._protocol = protocol
+        self._serial = serial_port
+        self._poll_interval = poll_interval
+        self._write_buffer = bytearray()
+        self._closing = False
+        self._reading_paused = False
+        self._writing_paused = False
+        self._reader_registered = False
+        self._writer_registered = False
+        self._poll_handle = None
+
+        # never let pyserial block the loop
+        self._serial.timeout = 0
+        self._serial.write_timeout = 0
+        # Windows ports and URL handlers such as loop:// raise io.UnsupportedOperation
+        try:
+            self._fd = self._serial.fileno()
+        except (
+            AttributeError,
+            NotImplementedError,
+            io.UnsupportedOperation,
+            serial.SerialException,
+        ):
+            self._fd = None  # no selectable descriptor, poll the port instead
+
+    def _start(self) -> None:
+        self._protocol.connection_made(self)
+        self._resume_io()
+
+    # transport interface
+    def get_extra_info(self, name, default=None):
+        if name == "serial":
+            return self._serial
+        return super().get_extra_info(name, default)
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def is_reading(self) -> bool:
+        return not self._closing and not self._reading_paused
+
+    def pause_reading(self) -> None:
+        if self._closing or self._reading_paused:
+            return
+        self._reading_paused = True
+        if self._reader_registered:
+            self._loop.remove_reader(self._fd)
+            self._reader_registered = False
+
+    def resume_reading(self) -> None:
+        if self._closing or not self._reading_paused:
+            return
+        self._reading_paused = False
+        self._resume_io()
+
+    def get_write_buffer_size(self) -> int:
+        return len(self._write_buffer)
+
+    def can_write_eof(self) -> bool:
+        return False
+
+    def write(self, data) -> None:
+        if self._closing:
+            return
+        if not data:
+            return
+        self._write_buffer += data
+        # try to push the data right away, whatever is left is flushed when the port is writable
+        self._flush_write_buffer()
+        if self._closing:
+            return
+        if self._write_buffer:
+            self._resume_io()
+        self._maybe_pause_protocol()
+
+    def close(self) -> None:
+        if self._closing:
+            return
+        self._closing = True
+        self._remove_reader()
+        if not self._write_buffer:
+            self._loop.call_soon(self._call_connection_lost, None)
+        # otherwise the connection is lost once the pending data is written
+
+    def abort(self) -> None:
+        self._force_close(None)
+
+    # internal helpers
+    def _resume_io(self) -> None:
+        if self._fd is None:
+            if self._poll_handle is None:
+                self._poll_handle = self._loop.call_soon(self._poll)
+            return
+        if (
+            not self._reading_paused
+            and not self._closing
+            and not self._reader_registered
+        ):
+            self._loop.add_reader(self._fd, self._read_ready)
+            self._reader_registered = True
+        if self._write_buffer and not self._writer_registered:
+            self._loop.add_writer(self._fd, self._write_ready)
+            self._writer_registered = True
+
+    def _remove_reader(self) -> None:
+        if self._reader_registered:
+            self._loop.remove_reader(self._fd)
+            self._reader_registered = False
+
+    def _remove_writer(self) -> None:
+        if self._writer_registered:
+            self._loop.remove_writer(self._fd)
+            self._writer_registered = False
+
+    def _read_chunk(self) -> bytes:
+        if self._fd is not None:
+            try:
+                data = os.read(self._fd, READ_CHUNK_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return b""
+            if not data:
+                # the descriptor was readable but returned nothing: device is gone
+                raise serial.SerialException("device disconnected")
+            return data
+        waiting = self._serial.in_waiting
+        return self._serial.read(waiting) if waiting else b""
+
+    def _read_ready(self) -> None:
+        try:
+            data = self._read_chunk()
+        except Exception as e:
+            self._fatal_error(e)
+            return
+        if data:
+            self._protocol.data_received(data)
+
+    def _flush_write_buffer(self) -> None:
+        try:
+            if self._fd is not None:
+                try:
+                    written = os.write(self._fd, self._write_buffer)
+                except (BlockingIOError, InterruptedError):
+                    written = 0
+            else:
+                written = self._serial.write(bytes(self._write_buffer)) or 0
+        except Exception as e:
+            self._fatal_error(e)
+            return
+        del self._write_buffer[:written]
+
+    def _write_ready(self) -> None:
+        self._flush_write_buffer()
+        if self._write_buffer:
+            return
+        self._remove_writer()
+        self._maybe_resume_protocol()
+        if self._closing:
+            self._call_connection_lost(None)
+
+    def _poll(self) -> None:
+        self._poll_handle = None
+        if not self._reading_paused and not self._closing:
+            self._read_ready()
+        if self._write_buffer:
+            self._write_ready()
+        # the last write of a closing transport already lost the connection
+        if self._serial is None:
+            return
+        if self._serial.is_open and (not self._closing or self._write_buffer):
+            self._poll_handle = self._loop.call_later(self._poll_interval, self._poll)
+
+    def _maybe_pause_protocol(self) -> None:
+        if (
+            not self._writing_paused
+            and len(self._write_buffer) > WRITE_BUFFER_HIGH_WATER
+        ):
+            self._writing_paused = True
+            self._protocol.pause_writing()
+
+    def _maybe_resume_protocol(self) -> None:
+        if self._writing_paused and len(self._write_buffer) <= WRITE_BUFFER_LOW_WATER:
+            self._writing_paused = False
+            self._protocol.resume_writing()
+
+    def _fatal_error(self, exc: Exception) -> None:
+        logging.error(f"Error: SerialException from {self._serial.name}: {exc}")
+        self._force_close(exc)
+
+    def _force_close(self, exc) -> None:
+        if self._serial is None:
+            return
+        self._write_buffer.clear()
+        self._remove_writer()
+        if not self._closing:
+            self._closing = True
+            self._remove_reader()
+        self._loop.call_soon(self._call_connection_lost, exc)
+
+    def _call_connection_lost(self, exc) -> None:
+        if self._serial is None:
+            return
+        self._remove_reader()
+        self._remove_writer()
+        if self._poll_handle is not None:
+            self._poll_handle.cancel()
+            self._poll_handle = None
+        try:
+            self._protocol.connection_lost(exc)
+        finally:
+            self._serial.close()
+            self._serial = None
+            self._protocol = None
+
+
+async def open_serial_connection(
+    serial_port: serial.SerialBase, limit: int = 2**16
+) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """Open the serial port (if needed) and wrap it in an asyncio reader/writer pair."""
+    loop = asyncio.get_running_loop()
+    if not serial_port.is_open:
+        serial_port.open()
+    reader = asyncio.StreamReader(limit=limit, loop=loop)
+    protocol = asyncio.StreamReaderProtocol(reader, loop=loop)
+    transport = SerialTransport(loop, protocol, serial_port)
+    transport._start()
+    writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    return reader, writer
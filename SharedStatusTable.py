@@ -0,0 +1,243 @@
+import sys
+import time
+import struct
+import logging
+from multiprocessing import shared_memory
+
+from BinaryProtocol import (
+    PUMP_INFO_ENTRY,
+    pack_pump_info,
+    decode_pump_info,
+)
+
+# Fixed layout status records in shared memory, written by the process that owns the controller
+# and read by any process that attaches to the table by name.
+#
+# layout: sequence (u32) | header | entry * max_entries
+# The sequence is a seqlock: the writer makes it odd before changing the record and even again
+# afterwards. A reader copies the whole record and keeps it only if the sequence was even and did
+# not change meanwhile, so a snapshot is always consistent and no lock is shared between processes.
+SEQUENCE = struct.Struct("<I")
+# give up on a read if the writer was mid update for this long, it most likely died
+READ_TIMEOUT = 1.0
+
+MAX_PUMPS = 255  # pump ids are one byte on the Pico
+MAX_SLOTS = 64
+SLOT_NAME_SIZE = 32
+
+# controller id, connected, rtc time, created, serial port, pump count
+PUMP_HEADER = struct.Struct("<H?d20s64sH")
+# controller id, connected, rtc time, created, serial port, has position, position, direction,
+# slot count
+AUTOSAMPLER_HEADER = struct.Struct("<H?d20s64s?i16sH")
+SLOT_ENTRY = struct.Struct(f"<{SLOT_NAME_SIZE}si")
+
+
+def pack_string(value: str, size: int) -> bytes:
+    encoded = value.encode("utf-8")
+    if len(encoded) > size:
+        logging.warning(
+            f"'{value}' is longer than {size} bytes, truncated in the status table"
+        )
+    return encoded[:size]
+
+
+def unpack_string(value: bytes) -> str:
+    return value.rstrip(b"\x00").decode("utf-8", errors="replace")
+
+
+class SharedStatusTable:
+    """A seqlock protected record in shared memory, created by the writer and attached by name.
+
+    Only one writer may publish at a time, the controllers publish while holding their lock.
+    """
+
+    def __init__(
+        self, header: struct.Struct, entry: struct.Struct, max_entries: int, name=None
+    ):
+        self.header = header
+        self.entry = entry
+        self.max_entries = max_entries
+        self.entries_offset = SEQUENCE.size + header.size
+        size = self.entries_offset + entry.size * max_entries
+        # the process that creates the table owns it and unlinks it on close
+        self.owner = name is None
+        if self.owner or sys.version_info < (3, 13):
+            # before 3.13 attaching always registers with the resource tracker, readers started
+            # through multiprocessing share the owner's tracker so the block is not unlinked early
+            self.shared_memory = shared_memory.SharedMemory(
+                name=name, create=self.owner, size=size
+            )
+        else:
+            # only the owner may unlink the block
+            self.shared_memory = shared_memory.SharedMemory(name=name, track=False)
+        self.name = self.shared_memory.name
+        self.buffer = self.shared_memory.buf
+
+    def write(self, header: tuple, entries: bytes) -> None:
+        """Replace the record, entries is the packed entry array."""
+        sequence = SEQUENCE.unpack_from(self.buffer, 0)[0]
+        SEQUENCE.pack_into(self.buffer, 0, sequence + 1)
+        self.header.pack_into(self.buffer, SEQUENCE.size, *header)
+        self.buffer[self.entries_offset : self.entries_offset + len(entries)] = entries
+        SEQUENCE.pack_into(self.buffer, 0, sequence + 2)
+
+    def read(self) -> tuple:
+        """Return a consistent (sequence, header, entries) copy of the record."""
+        deadline = None
+        while True:
+            sequence = SEQUENCE.unpack_from(self.buffer, 0)[0]
+            if not sequence & 1:
+                record = bytes(self.buffer)
+                if SEQUENCE.unpack_from(self.buffer, 0)[0] == sequence:
+                    header = self.header.unpack_from(record, SEQUENCE.size)
+                    return sequence, header, record[self.entries_offset :]
+            # the writer is mid update, let it finish
+            deadline = deadline or time.perf_counter() + READ_TIMEOUT
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"Status table {self.name} is stuck in an update")
+            time.sleep(0)
+
+    @property
+    def version(self) -> int:
+        """Number of writes so far, readers can skip decoding when it has not changed."""
+        return SEQUENCE.unpack_from(self.buffer, 0)[0] // 2
+
+    def close(self) -> None:
+        self.buffer = None
+        self.shared_memory.close()
+        if self.owner:
+            self.shared_memory.unlink()
+
+
+class PumpStatusTable(SharedStatusTable):
+    """Status of one pump controller, same dictionary layout as PumpController.status.
+
+    Each pump is an entry of the binary pump info frame, so the pin numbers and the power and
+    direction flags of every pump are updated together.
+    """
+
+    def __init__(self, name=None, max_pumps: int = MAX_PUMPS):
+        super().__init__(PUMP_HEADER, PUMP_INFO_ENTRY, max_pumps, name)
+
+    def publish(self, status: dict) -> None:
+        pumps_info = status["pumps_info"]
+        if len(pumps_info) > self.max_entries:
+            logging.error(
+                f"Error: {len(pumps_info)} pumps do not fit in the status table, only {self.max_entries} kept"
+            )
+            pumps_info = dict(list(pumps_info.items())[: self.max_entries])
+        entries = pack_pump_info(
+            {
+                pump_id: {
+                    "power_pin": info["power_pin"],
+                    "direction_pin": info["direction_pin"],
+                    "initial_power_pin_value": info["initial_power_pin_value"],
+                    "initial_direction_pin_value": info["initial_direction_pin_value"],
+                    "power_status": info["current_power_status"],
+                    "direction_status": info["current_direction_status"],
+                }
+                for pump_id, info in pumps_info.items()
+            }
+        )
+        self.write(
+            (
+                status["controller_id"],
+                status["connected"],
+                status["rtc_time"],
+                pack_string(status["created"], 20),
+                pack_string(status["serial_port"], 64),
+                len(pumps_info),
+            ),
+            entries,
+        )
+
+    def snapshot(self) -> dict:
+        _, header, entries = self.read()
+        controller_id, connected, rtc_time, created, serial_port, count = header
+        pumps_info = decode_pump_info(entries[: count * self.entry.size])
+        return {
+            "serial_port": unpack_string(serial_port),
+            "controller_id": controller_id,
+            "created": unpack_string(created),
+            "connected": connected,
+            "pumps_info": {
+                pump_id: {
+                    "power_pin": info["power_pin"],
+                    "direction_pin": info["direction_pin"],
+                    "initial_power_pin_value": info["initial_power_pin_value"],
+                    "initial_direction_pin_value": info["initial_direction_pin_value"],
+                    "current_power_status": info["power_status"],
+                    "current_direction_status": info["direction_status"],
+                }
+                for pump_id, info in pumps_info.items()
+            },
+            "rtc_time": rtc_time,
+        }
+
+
+class AutosamplerStatusTable(SharedStatusTable):
+    """Status of one autosampler controller, same dictionary layout as AutosamplerController.status."""
+
+    def __init__(self, name=None, max_slots: int = MAX_SLOTS):
+        super().__init__(AUTOSAMPLER_HEADER, SLOT_ENTRY, max_slots, name)
+
+    def publish(self, status: dict) -> None:
+        configuration = status["slots_configuration"]
+        # entries are kept in the sorted slot order
+        slots = [slot for slot in status["slots"] if slot in configuration]
+        if len(slots) > self.max_entries:
+            logging.error(
+                f"Error: {len(slots)} slots do not fit in the status table, only {self.max_entries} kept"
+            )
+            slots = slots[: self.max_entries]
+        entries = b"".join(
+            SLOT_ENTRY.pack(pack_string(slot, SLOT_NAME_SIZE), int(configuration[slot]))
+            for slot in slots
+        )
+        position = status["position"]
+        self.write(
+            (
+                status["controller_id"],
+                status["connected"],
+                status["rtc_time"],
+                pack_string(status["created"], 20),
+                pack_string(status["serial_port"], 64),
+                position is not None,
+                position if position is not None else 0,
+                pack_string(status["direction"] or "", 16),
+                len(slots),
+            ),
+            entries,
+        )
+
+    def snapshot(self) -> dict:
+        _, header, entries = self.read()
+        (
+            controller_id,
+            connected,
+            rtc_time,
+            created,
+            serial_port,
+            has_position,
+            position,
+            direction,
+            count,
+        ) = header
+        configuration = {
+            unpack_string(slot): slot_position
+            for slot, slot_position in SLOT_ENTRY.iter_unpack(
+                entries[: count * self.entry.size]
+            )
+        }
+        return {
+            "serial_port": unpack_string(serial_port),
+            "controller_id": controller_id,
+            "created": unpack_string(created),
+            "connected": connected,
+            "slots": list(configuration),
+            "slots_configuration": configuration,
+            "position": position if has_position else None,
+            "direction": unpack_string(direction) or None,
+            "rtc_time": rtc_time,
+        }
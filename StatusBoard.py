@@ -0,0 +1,127 @@
+import json
+import time
+from collections import deque
+from itertools import islice
+from threading import Condition, Lock
+from typing import NamedTuple
+
+# number of deltas kept for clients that resume a status stream
+HISTORY_SIZE = 1000
+
+
+class StatusSnapshot(NamedTuple):
+    version: int
+    created: float  # time.time() when the snapshot was published
+    status: dict  # never modified after publishing, treat as read only
+
+
+def merge_patch(old: dict, new: dict) -> dict:
+    """Return the JSON merge patch (RFC 7386) that turns old into new, removed keys map to None."""
+    patch = {}
+    for key, value in new.items():
+        previous = old.get(key)
+        if key in old and previous == value:
+            continue
+        if isinstance(value, dict) and isinstance(previous, dict):
+            patch[key] = merge_patch(previous, value)
+        else:
+            patch[key] = value
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    return patch
+
+
+def drop_none(status: dict) -> dict:
+    """Return status without the keys set to None, merge patches treat None as removed."""
+    return {
+        key: drop_none(value) if isinstance(value, dict) else value
+        for key, value in status.items()
+        if value is not None
+    }
+
+
+class StatusBoard:
+    """Holds the latest status snapshot, published by writers and read without any lock.
+
+    Writers build a new status dict and publish it, the board swaps its snapshot reference in
+    one assignment, so a reader always sees a complete snapshot and never waits for serial I/O.
+    Readers that want to block until something changes use wait_for_change, streams catch up
+    with changes_since. to_json serializes each version once, however many readers ask for it.
+    """
+
+    def __init__(self, history_size: int = HISTORY_SIZE):
+        self.condition = Condition()
+        self.snapshot = StatusSnapshot(0, time.time(), {})
+        # (version, merge patch from the previous version as JSON), oldest first
+        self.history = deque(maxlen=history_size)
+        # versions start over when the backend restarts, the epoch keeps ETags and event ids apart
+        self.epoch = f"{time.time_ns():x}"
+        self.serialize_lock = Lock()
+        # (version, JSON bytes) of the last serialized snapshot
+        self.serialized = (None, b"")
+
+    def get(self) -> StatusSnapshot:
+        return self.snapshot
+
+    def publish(self, status: dict) -> StatusSnapshot:
+        # snapshots hold what a client applying the deltas ends up with
+        status = drop_none(status)
+        with self.condition:
+            delta = merge_patch(self.snapshot.status, status)
+            if not delta:
+                # nothing changed, don't wake the readers
+                return self.snapshot
+            version = self.snapshot.version + 1
+            self.history.append((version, json.dumps(delta, separators=(",", ":"))))
+            self.snapshot = StatusSnapshot(version, time.time(), status)
+            self.condition.notify_all()
+            return self.snapshot
+
+    def etag(self, snapshot: StatusSnapshot) -> str:
+        return self.event_id(snapshot.version)
+
+    def event_id(self, version: int) -> str:
+        return f"{self.epoch}-{version}"
+
+    def version_of(self, event_id: str) -> int:
+        """The version an event id of this board stands for, None if it is from another epoch."""
+        epoch, _, version = (event_id or "").rpartition("-")
+        if epoch != self.epoch or not version.isdigit():
+            return None
+        return int(version)
+
+    def to_json(self, snapshot: StatusSnapshot) -> bytes:
+        """Return the snapshot and its version as JSON, serialized once per version."""
+        version, data = self.serialized
+        if version == snapshot.version:
+            return data
+        # concurrent requests for a new version wait here for the first one to serialize it
+        with self.serialize_lock:
+            version, data = self.serialized
+            if version == snapshot.version:
+                return data
+            data = json.dumps(dict(snapshot.status, version=snapshot.version)).encode()
+            # an older snapshot from a slow reader must not replace a newer cached one
+            if version is None or snapshot.version > version:
+                self.serialized = (snapshot.version, data)
+            return data
+
+    def wait_for_change(self, version: int, timeout: float = None) -> StatusSnapshot:
+        """Return the first snapshot newer than version, or the current one after timeout."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.snapshot.version != version, timeout)
+            return self.snapshot
+
+    def changes_since(self, version: int) -> list:
+        """Return [(version, delta JSON)] published after version, None if they are not kept."""
+        with self.condition:
+            if version == self.snapshot.version:
+                return []
+            if not self.history:
+                return None
+            first = self.history[0][0]
+            # a version from before a restart or already dropped from the history
+            if version > self.snapshot.version or version < first - 1:
+                return None
+            return list(islice(self.history, version - first + 1, None))
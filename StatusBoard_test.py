@@ -0,0 +1,100 @@
+import json
+
+from StatusBoard import StatusBoard, drop_none, merge_patch
+
+
+def apply_patch(target: dict, patch: dict) -> dict:
+    """Apply a JSON merge patch like the web UI does."""
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            apply_patch(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
+def test_merge_patch():
+    old = {"a": 1, "pumps": {"1": {"power": "ON", "direction": "CW"}}, "gone": 3}
+    new = {"a": 1, "pumps": {"1": {"power": "OFF", "direction": "CW"}}, "added": 4}
+    patch = merge_patch(old, new)
+    assert patch == {"pumps": {"1": {"power": "OFF"}}, "gone": None, "added": 4}
+    assert apply_patch(json.loads(json.dumps(old)), patch) == new
+
+
+def test_none_values_are_dropped_like_removed_keys():
+    board = StatusBoard()
+    first = {"a": 1, "pumps": {"1": {"controller_id": 1, "power": "ON"}}}
+    second = {"a": None, "pumps": {"1": {"controller_id": None, "power": "ON"}}}
+    assert drop_none(second) == {"pumps": {"1": {"power": "ON"}}}
+    board.publish(first)
+    snapshot = board.publish(second)
+    # a polling client gets the same status as a client applying the deltas
+    status = json.loads(json.dumps(first))
+    for _, delta in board.changes_since(1):
+        apply_patch(status, json.loads(delta))
+    assert status == snapshot.status == drop_none(second)
+    assert json.loads(board.to_json(snapshot)) == dict(status, version=2)
+    # publishing None again for a dropped key changes nothing
+    assert board.publish({"a": None, "pumps": {"1": {"power": "ON"}}}) is snapshot
+
+
+def test_publish_skips_unchanged_status():
+    board = StatusBoard()
+    first = board.publish({"a": 1})
+    assert first.version == 1
+    assert board.publish({"a": 1}) is first
+    assert board.publish({"a": 2}).version == 2
+
+
+def test_changes_since_replays_deltas():
+    board = StatusBoard()
+    statuses = [{"a": 1}, {"a": 1, "b": 2}, {"b": 3}]
+    for status in statuses:
+        board.publish(status)
+    assert board.changes_since(3) == []
+    status = dict(statuses[0])
+    changes = board.changes_since(1)
+    assert [version for version, _ in changes] == [2, 3]
+    for _, delta in changes:
+        apply_patch(status, json.loads(delta))
+    assert status == statuses[-1]
+    # newer than the board, e.g. from before a restart
+    assert board.changes_since(7) is None
+
+
+def test_changes_since_outside_history():
+    board = StatusBoard(history_size=2)
+    for value in range(5):
+        board.publish({"a": value})
+    assert board.changes_since(1) is None
+    assert [version for version, _ in board.changes_since(3)] == [4, 5]
+
+
+def test_event_ids_carry_the_epoch():
+    board = StatusBoard()
+    board.publish({"a": 1})
+    event_id = board.event_id(1)
+    assert board.etag(board.get()) == event_id
+    assert board.version_of(event_id) == 1
+    # ids of another run or without an epoch are not resumed
+    restarted = StatusBoard()
+    restarted.epoch = board.epoch + "0"
+    assert restarted.version_of(event_id) is None
+    assert board.version_of("1") is None
+    assert board.version_of(None) is None
+    assert board.version_of(f"{board.epoch}-x") is None
+
+
+def test_to_json_serializes_each_version_once():
+    board = StatusBoard()
+    snapshot = board.publish({"a": 1})
+    data = board.to_json(snapshot)
+    assert json.loads(data) == {"a": 1, "version": 1}
+    assert board.to_json(snapshot) is data
+    newer = board.publish({"a": 2})
+    assert json.loads(board.to_json(newer))["a"] == 2
+    # an older snapshot does not replace the cached newer one
+    board.to_json(snapshot)
+    assert board.serialized[0] == 2
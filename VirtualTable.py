@@ -0,0 +1,106 @@
+from tkinter import ttk
+
+# used until the Treeview style reports its row height
+DEFAULT_ROW_HEIGHT = 20
+HEADING_HEIGHT = 25
+DEFAULT_VISIBLE_ROWS = 10
+
+
+class VirtualTable(ttk.Frame):
+    """A table of any length that only keeps the rows in view as Treeview items.
+
+    The Treeview holds a fixed pool of items, one per visible row. Scrolling moves the window
+    over the table and fills the items with fetch(start, end), which returns the values of the
+    rows start to end - 1. Loading a table therefore costs the same for ten rows or a hundred
+    thousand, and refresh_rows() only redraws the rows that are in view.
+    """
+
+    def __init__(self, master, columns, fetch, row_count: int, column_width=100):
+        super().__init__(master)
+        self.columns = list(columns)
+        self.fetch = fetch
+        self.row_count = row_count
+        self.offset = 0
+        self.visible_rows = DEFAULT_VISIBLE_ROWS
+        self.items = []
+
+        self.tree = ttk.Treeview(self, columns=self.columns, show="headings")
+        for col in self.columns:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=column_width, anchor="center")
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.tree.grid(row=0, column=0, sticky="NSEW")
+        self.scrollbar.grid(row=0, column=1, sticky="NS")
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+
+        row_height = ttk.Style().lookup("Treeview", "rowheight")
+        self.row_height = int(row_height) if row_height else DEFAULT_ROW_HEIGHT
+        # the Treeview scrolls its own items on the wheel, move the window instead
+        self.tree.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.tree.bind("<Button-4>", lambda event: self.scroll_by(-1))
+        self.tree.bind("<Button-5>", lambda event: self.scroll_by(1))
+        self.tree.bind("<Configure>", self.on_configure)
+        self.resize(DEFAULT_VISIBLE_ROWS)
+
+    def column(self, col, **options):
+        self.tree.column(col, **options)
+
+    def resize(self, visible_rows: int) -> None:
+        """Keep one item per visible row, never more than there are rows."""
+        self.visible_rows = visible_rows
+        size = max(0, min(visible_rows, self.row_count))
+        while len(self.items) < size:
+            self.items.append(self.tree.insert("", "end"))
+        if len(self.items) > size:
+            self.tree.delete(*self.items[size:])
+            del self.items[size:]
+        self.scroll_to(self.offset)
+
+    def on_configure(self, event) -> None:
+        visible_rows = max(1, (event.height - HEADING_HEIGHT) // self.row_height)
+        if visible_rows != self.visible_rows:
+            self.resize(visible_rows)
+
+    def set_row_count(self, row_count: int) -> None:
+        """Change the length of the table, e.g. while it is still being read."""
+        if row_count != self.row_count:
+            self.row_count = row_count
+            self.resize(self.visible_rows)
+
+    def on_mouse_wheel(self, event) -> str:
+        # one row per notch, the delta is 120 per notch on Windows and 1 on macOS
+        self.scroll_by(-1 if event.delta > 0 else 1)
+        return "break"
+
+    def scroll_by(self, rows: int) -> str:
+        self.scroll_to(self.offset + rows)
+        return "break"
+
+    def scroll_to(self, offset: int) -> None:
+        offset = max(0, min(offset, self.row_count - len(self.items)))
+        self.offset = offset
+        self.refresh_rows(offset, offset + len(self.items))
+        if self.row_count:
+            self.scrollbar.set(
+                offset / self.row_count, (offset + len(self.items)) / self.row_count
+            )
+        else:
+            self.scrollbar.set(0, 1)
+
+    def yview(self, *args) -> None:
+        """Scrollbar command: ("moveto", fraction) or ("scroll", count, "units" or "pages")."""
+        if args[0] == "moveto":
+            self.scroll_to(round(float(args[1]) * self.row_count))
+        elif args[0] == "scroll":
+            step = len(self.items) if args[2] == "pages" else 1
+            self.scroll_by(int(args[1]) * step)
+
+    def refresh_rows(self, start: int, end: int) -> None:
+        """Redraw the rows start to end - 1 that are in view, e.g. after their values changed."""
+        start = max(start, self.offset)
+        end = min(end, self.offset + len(self.items))
+        if start >= end:
+            return
+        for index, values in enumerate(self.fetch(start, end), start=start):
+            self.tree.item(self.items[index - self.offset], values=values)
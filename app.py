@@ -2,6 +2,7 @@
 
 from flask import Flask, render_template, request, jsonify
 from backend import pico_controller  # Import the PicoController instance
+from PortRegistry import get_port_registry, port_label
 import threading
 
 app = Flask(__name__)
@@ -14,7 +15,8 @@ def index():
 
 @app.route("/get_ports")
 def get_ports():
-    ports = pico_controller.get_available_ports()
+    # cached, the registry only enumerates again after a device is plugged in or removed
+    ports = [port_label(port) for port in get_port_registry().get_ports()]
     return jsonify({"ports": ports})
 
 
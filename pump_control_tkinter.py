@@ -13,20 +13,33 @@ from PIL import Image, ImageDraw
 
 # other library
 import os
-import re
 import sys
 import time
-import json
 import logging
 
 # from decimal import Decimal
 from datetime import datetime, timedelta
-from decimal import Decimal
-from queue import Queue
 import pandas as pd
 
-# Define Pi Pico vendor ID
-pico_vid = 0x2E8A
+# Custom imports
+from CommandQueue import CoalescingQueue, DEFAULT_MAX_BURST_BYTES
+from LineReader import LineReader
+from ResponseParser import AUTOSAMPLER_RESPONSES
+from BinaryProtocol import ReplyReader, supports_binary, BINARY_COMMAND, BINARY_ACK
+from PortRegistry import get_port_registry, port_label
+from ClockModel import ClockModel
+from PollingScheduler import PollingScheduler, PUMP_POLLING, AUTOSAMPLER_POLLING
+from Recipe import (
+    load_recipe,
+    compile_recipe,
+    format_rows,
+    RecipeStream,
+    POWER,
+    DIRECTION,
+)
+from ProcedureScheduler import ProcedureScheduler
+from ProgressTracker import ProgressTracker
+from VirtualTable import VirtualTable
 
 global_pad_x = 2
 global_pad_y = 2
@@ -43,6 +56,9 @@ NANOSECONDS_PER_SECOND = 1_000_000_000
 NANOSECONDS_PER_MILLISECOND = 1_000_000
 NANOSECONDS_PER_MICROSECOND = 1_000
 
+# recipe files larger than this are read chunk by chunk while they run instead of loaded whole
+STREAMED_RECIPE_BYTES = 20_000_000
+
 
 class PicoController:
     def __init__(self, master) -> None:
@@ -50,33 +66,39 @@ class PicoController:
         self.master.title("Pump Control via Pi Pico")
         self.main_loop_interval_ms = 20  # Main loop interval in milliseconds
 
-        # port refresh timer
-        self.port_refresh_interval_ns = (
-            5 * NANOSECONDS_PER_SECOND
-        )  # Refresh rate for COM ports when not connected
-        self.last_port_refresh_ns = -1
+        # cached Pico ports, rescanned when a device is plugged in or removed
+        self.port_registry = get_port_registry()
+        self.port_generation = -1  # registry generation shown in the port lists
         self.timeout = 1  # Serial port timeout in seconds
+        # upper bound for one batched write
+        self.max_burst_bytes = DEFAULT_MAX_BURST_BYTES
 
         # instance fields for the serial port and queue
         self.serial_port = None
         self.current_port = None
+        # reads everything buffered on the port, text lines or binary frames
+        self.reply_reader = None
 
         # instance field for the autosampler serial port
         self.serial_port_as = None
         self.current_port_as = None
+        self.line_reader_as = None
 
-        # a queue to store commands to be sent to the Pico
-        self.send_command_queue = Queue()
+        # a queue to store commands to be sent to the Pico, duplicate queries are collapsed
+        self.send_command_queue = CoalescingQueue()
 
         # a queue to store commands to be sent to the autosampler
-        self.send_command_queue_as = Queue()
+        self.send_command_queue_as = CoalescingQueue()
 
         # Dictionary to store pump information
         self.pumps = {}
 
         # Dataframe to store the recipe
         self.recipe_df = pd.DataFrame()
-        self.recipe_rows = []
+        # the recipe compiled for execution, see Recipe.compile_recipe, or a Recipe.RecipeStream
+        self.recipe_plan = None
+        # what the progress bars show, only changed rows are redrawn
+        self.progress_tracker = None
 
         # time stamp for the start of the procedure
         self.start_time_ns = -1
@@ -84,10 +106,21 @@ class PicoController:
         self.current_index = -1
         self.pause_timepoint_ns = -1
         self.pause_duration_ns = 0
-        self.scheduled_task = None
+        # fires the recipe steps from its own thread, independent of the Tk event loop
+        self.procedure_scheduler = ProcedureScheduler(self.execute_procedure)
+
+        # RTC times estimated on the PC, the Picos are only queried when a model needs a sample
+        self.pump_clock = ClockModel("Pump controller")
+        self.autosampler_clock = ClockModel("Autosampler")
 
-        # time stamp for the RTC time query
-        self.last_time_query = time.monotonic_ns()
+        # when to refresh the pump status and info and the autosampler slots
+        self.pump_polling = PollingScheduler(PUMP_POLLING)
+        self.autosampler_polling = PollingScheduler(
+            {"config": AUTOSAMPLER_POLLING["config"]}
+        )
+        # last replies, to tell the polling schedulers whether anything changed
+        self.last_pump_info = None
+        self.last_slots_configuration = None
 
         # define pumps per row in the manual control frame
         self.pumps_per_row = 3
@@ -392,7 +425,6 @@ class PicoController:
         self.recipe_table.grid(
             row=0, column=0, padx=global_pad_x, pady=global_pad_y, sticky="NSEW"
         )
-        self.scrollbar = ttk.Scrollbar()
         # update the current row
         current_row += self.recipe_frame.grid_size()[1]
 
@@ -476,7 +508,11 @@ class PicoController:
             self.read_serial_as()
             self.send_command_as()
             self.update_progress()
+            self.update_recipe_stream()
+            self.check_procedure()
             self.query_rtc_time()
+            self.update_rtc_time_displays()
+            self.poll_status()
             self.master.after(self.main_loop_interval_ms, self.main_loop)
         except Exception as e:
             logging.error(f"Error: {e}")
@@ -486,45 +522,23 @@ class PicoController:
 
     def refresh_ports(self, instant=False):
         if not self.serial_port or not self.serial_port_as:
-            if (
-                time.monotonic_ns() - self.last_port_refresh_ns
-                < self.port_refresh_interval_ns
-                and not instant
-            ):
+            # the registry only rescans after a hotplug event, so this is cheap every tick
+            if instant:
+                self.port_registry.invalidate()
+            ports = self.port_registry.get_ports()
+            if self.port_registry.generation == self.port_generation and not instant:
                 return
-            # filter by vendor id and ignore already connected ports
-            if self.serial_port:
-                pump_controller_port = self.serial_port.name.strip()
-            else:
-                pump_controller_port = None
-            if self.serial_port_as:
-                autosampler_port = self.serial_port_as.name.strip()
-            else:
-                autosampler_port = None
-
-            ports = [
-                port.device + " (SN:" + str(port.serial_number) + ")"
-                for port in serial.tools.list_ports.comports()
-                if port.vid == pico_vid
-                and port.name.strip() != pump_controller_port
-                and port.name.strip() != autosampler_port
+            # ignore already connected ports
+            connected = [
+                serial_port.name.strip()
+                for serial_port in (self.serial_port, self.serial_port_as)
+                if serial_port
             ]
-            ports_list = [
-                port
-                for port in serial.tools.list_ports.comports()
-                if port.vid == pico_vid
-                and port.name.strip() != pump_controller_port
-                and port.name.strip() != autosampler_port
+            ports = [
+                port_label(port)
+                for port in ports
+                if port.device not in connected and port.name not in connected
             ]
-            # print detail information of the ports to the console
-            for port in ports_list:
-                try:
-                    # put these into one line
-                    logging.debug(
-                        f"name: {port.name}, description: {port.description}, device: {port.device}, hwid: {port.hwid}, manufacturer: {port.manufacturer}, pid: {hex(port.pid)}, serial_number: {port.serial_number}, vid: {hex(port.vid)}"
-                    )
-                except Exception as e:
-                    logging.error(f"Error: {e}")
 
             if not self.serial_port:
                 self.port_combobox["values"] = ports
@@ -538,7 +552,7 @@ class PicoController:
                     self.port_combobox_as.current(0)
                 else:
                     self.port_combobox_as.set("")
-            self.last_port_refresh_ns = time.monotonic_ns()
+            self.port_generation = self.port_registry.generation
 
     def connect_to_pico(self):
         selected_port = self.port_combobox.get()
@@ -558,7 +572,10 @@ class PicoController:
                     return
 
             try:  # Attempt to connect to the selected port
-                self.serial_port = serial.Serial(parsed_port, timeout=self.timeout)
+                self.serial_port = serial.serial_for_url(
+                    parsed_port, timeout=self.timeout
+                )
+                self.reply_reader = ReplyReader(self.serial_port)
                 self.current_port = selected_port
 
                 self.status_label.config(
@@ -568,8 +585,9 @@ class PicoController:
                 self.send_command_queue.put("0:ping")  # ping to identify the Pico
                 self.refresh_ports(instant=True)  # refresh the ports immediately
 
-                self.sync_rtc_with_pc_time(queue=self.send_command_queue)
+                self.sync_rtc_with_pc_time()
                 self.query_pump_info()  # issue a pump info query
+                self.pump_polling.reset()
                 self.enable_disable_pumps_buttons(tk.NORMAL)  # enable the buttons
             except serial.SerialException as e:
                 self.status_label.config(text="Pump Controller Status: Not connected")
@@ -599,7 +617,10 @@ class PicoController:
                 else:
                     return
             try:
-                self.serial_port_as = serial.Serial(parsed_port, timeout=self.timeout)
+                self.serial_port_as = serial.serial_for_url(
+                    parsed_port, timeout=self.timeout
+                )
+                self.line_reader_as = LineReader(self.serial_port_as)
                 self.current_port_as = selected_port
                 self.status_label_as.config(
                     text=f"Autosampler Controller Status: Connected to {parsed_port}"
@@ -609,7 +630,8 @@ class PicoController:
                 self.refresh_ports(instant=True)
                 self.enable_disable_autosampler_buttons(tk.NORMAL)
                 self.send_command_queue_as.put("config")  # Populate the slots
-                self.sync_rtc_with_pc_time(queue=self.send_command_queue_as)
+                self.autosampler_polling.reset()
+                self.sync_rtc_with_pc_time(is_Autosampler=True)
             except serial.SerialException as e:
                 self.status_label_as.config(
                     text="Autosampler Controller Status: Not connected"
@@ -633,36 +655,72 @@ class PicoController:
         self.slot_combobox_as.config(state=state)
         self.goto_slot_button_as.config(state=state)
 
-    def sync_rtc_with_pc_time(self, queue: Queue) -> None:
-        """Synchronize the Pico's RTC with the PC's time."""
+    def sync_rtc_with_pc_time(self, is_Autosampler=False) -> None:
+        """Synchronize the Pico's RTC with the PC's time.
+
+        stime only takes whole seconds, so the command is sent just before the next second begins.
+        """
         try:
-            now = datetime.now()
-            sync_command = f"0:stime:{now.year}:{now.month}:{now.day}:{now.hour}:{now.minute}:{now.second}"
-            queue.put(sync_command)
+            clock = self.autosampler_clock if is_Autosampler else self.pump_clock
+            sync_command, delay = clock.stime_command()
+            self.master.after(
+                round(delay * 1000),
+                lambda: self.send_rtc_sync(sync_command, is_Autosampler),
+            )
         except Exception as e:
             logging.error(f"Error synchronizing RTC with PC time: {e}")
 
+    def send_rtc_sync(self, sync_command: str, is_Autosampler=False) -> None:
+        if not is_Autosampler and self.serial_port:
+            self.send_command_queue.put(sync_command)
+            self.send_command()  # don't wait for the next main loop tick
+            self.pump_clock.reset()
+        elif is_Autosampler and self.serial_port_as:
+            self.send_command_queue_as.put(sync_command)
+            self.send_command_as()
+            self.autosampler_clock.reset()
+
     def query_rtc_time(self) -> None:
-        """Send a request to the Pico to get the current RTC time every second."""
-        current_time = time.monotonic_ns()
-        if current_time - self.last_time_query >= NANOSECONDS_PER_SECOND:
-            if self.serial_port:
-                self.send_command_queue.put("0:time")
-            if self.serial_port_as:
-                self.send_command_queue_as.put("time")
-            self.last_time_query = current_time
+        """Send a time query to the Picos whose clock model needs another sample."""
+        if self.serial_port and self.pump_clock.due():
+            self.send_command_queue.put("0:time")
+            self.pump_clock.query_sent()
+        if self.serial_port_as and self.autosampler_clock.due():
+            self.send_command_queue_as.put("time")
+            self.autosampler_clock.query_sent()
+
+    def poll_status(self) -> None:
+        """Queue the status queries that are due, only while nothing else waits to be sent."""
+        if self.serial_port and self.send_command_queue.empty():
+            for query in self.pump_polling.due():
+                self.send_command_queue.put(query)
+        if self.serial_port_as and self.send_command_queue_as.empty():
+            for query in self.autosampler_polling.due():
+                self.send_command_queue_as.put(query)
+
+    def update_rtc_time_displays(self) -> None:
+        """Show the RTC times interpolated by the clock models."""
+        if self.serial_port:
+            self.update_rtc_time_display(self.pump_clock.now())
+        if self.serial_port_as:
+            self.update_rtc_time_display(
+                self.autosampler_clock.now(), is_Autosampler=True
+            )
 
-    def update_rtc_time_display(self, response, is_Autosampler=False) -> None:
+    def update_rtc_time_display(self, rtc_time, is_Autosampler=False) -> None:
         try:
-            match = re.search(r"RTC Time: (\d+-\d+-\d+ \d+:\d+:\d+)", response)
-            if match and not is_Autosampler:
-                rtc_time = match.group(1)
-                self.current_time_label.config(text=f"Pump Controller Time: {rtc_time}")
-            if match and is_Autosampler:
-                rtc_time = match.group(1)
-                self.current_time_label_as.config(
-                    text=f"Autosampler Controller Time: {rtc_time}"
-                )
+            if rtc_time is None:
+                return
+            rtc_time = rtc_time.strftime("%Y-%m-%d %H:%M:%S")
+            if not is_Autosampler:
+                label = self.current_time_label
+                text = f"Pump Controller Time: {rtc_time}"
+            else:
+                label = self.current_time_label_as
+                text = f"Autosampler Controller Time: {rtc_time}"
+            # the text only changes once a second
+            if label.cget("text") != text:
+                label.config(text=text)
         except Exception as e:
             logging.error(f"Error updating RTC time display: {e}")
 
@@ -680,12 +738,13 @@ class PicoController:
             try:
                 self.serial_port.close()  # close the serial port connection
                 self.serial_port = None
+                self.reply_reader = None
                 self.current_port = None
+                self.pump_clock.reset()
+                self.last_pump_info = None
 
-                # cancel the scheduled task if it exists
-                if self.scheduled_task:
-                    self.master.after_cancel(self.scheduled_task)
-                    self.scheduled_task = None
+                # drop the pending steps of the procedure
+                self.procedure_scheduler.cancel()
 
                 # update UI
                 self.status_label.config(text="Pump Controller Status: Not connected")
@@ -701,6 +760,9 @@ class PicoController:
                 self.refresh_ports(instant=True)  # refresh the ports immediately
 
                 logging.info("Disconnected from Pico")
+                logging.debug(
+                    f"{self.send_command_queue.coalesced} duplicate queries coalesced in the send queue"
+                )
                 if show_message:
                     self.non_blocking_messagebox(
                         "Connection Status", "Disconnected from Pico"
@@ -719,7 +781,10 @@ class PicoController:
             try:
                 self.serial_port_as.close()
                 self.serial_port_as = None
+                self.line_reader_as = None
                 self.current_port_as = None
+                self.autosampler_clock.reset()
+                self.last_slots_configuration = None
 
                 self.status_label_as.config(
                     text="Autosampler Controller Status: Not connected"
@@ -733,6 +798,9 @@ class PicoController:
                 self.refresh_ports(instant=True)
 
                 logging.info("Disconnected from Autosampler")
+                logging.debug(
+                    f"{self.send_command_queue_as.coalesced} duplicate queries coalesced in the send queue"
+                )
                 if show_message:
                     self.non_blocking_messagebox(
                         "Connection Status", "Disconnected from Autosampler"
@@ -750,11 +818,13 @@ class PicoController:
         if self.serial_port:
             # put the command in the queue
             self.send_command_queue.put("0:info")
+            self.pump_polling.sent("0:info")
 
     def update_status(self):
         if self.serial_port:
             # put the command in the queue
             self.send_command_queue.put("0:st")
+            self.pump_polling.sent("0:st")
 
     def toggle_power(self, pump_id, update_status=True):
         if self.serial_port:
@@ -850,14 +920,14 @@ class PicoController:
 
     def stop_procedure(self, message=False):
         try:
-            if self.scheduled_task:
-                self.master.after_cancel(self.scheduled_task)
-                self.scheduled_task = None
+            self.procedure_scheduler.cancel()
             self.start_time_ns = -1
             self.total_procedure_time_ns = -1
             self.current_index = -1
             self.pause_timepoint_ns = -1
             self.pause_duration_ns = 0
+            self.pump_polling.set_active(False)
+            self.autosampler_polling.set_active(False)
             # call a emergency shutdown in case the power is still on
             self.emergency_shutdown()
             # update the status
@@ -879,10 +949,8 @@ class PicoController:
 
     def pause_procedure(self):
         try:
-            if self.scheduled_task:
-                self.master.after_cancel(self.scheduled_task)
-                self.scheduled_task = None
             self.pause_timepoint_ns = time.monotonic_ns()
+            self.procedure_scheduler.pause(self.pause_timepoint_ns)
             self.pause_button.config(state=tk.DISABLED)
             self.continue_button.config(state=tk.NORMAL)
             self.end_time_value.config(text="")
@@ -894,25 +962,31 @@ class PicoController:
     def continue_procedure(self):
         try:
             if self.pause_timepoint_ns != -1:
-                self.pause_duration_ns += time.monotonic_ns() - self.pause_timepoint_ns
+                now_ns = time.monotonic_ns()
+                self.pause_duration_ns += now_ns - self.pause_timepoint_ns
                 self.pause_timepoint_ns = -1
+                self.procedure_scheduler.resume(now_ns)
             self.pause_button.config(state=tk.NORMAL)
             self.continue_button.config(state=tk.DISABLED)
-            self.execute_procedure(self.current_index)
             logging.info("Procedure continued.")
         except Exception as e:
             logging.error(f"Error: {e}")
             self.non_blocking_messagebox("Error", f"An error occurred: {e}")
 
-    # send_command will remove the first item from the queue and send it
+    # send_command removes every ready command from the queue and writes them with a single call
     def send_command(self):
         try:
             if self.serial_port and not self.send_command_queue.empty():
-                command = self.send_command_queue.get(block=False)
-                self.serial_port.write(f"{command}\n".encode())
-                # don't log the RTC time sync command
-                if "time" not in command:
-                    logging.debug(f"PC -> Pico: {command}")
+                commands, payload = self.send_command_queue.get_burst(
+                    self.max_burst_bytes
+                )
+                self.serial_port.write(payload)
+                for command in commands:
+                    if command == "0:time":
+                        self.pump_clock.query_sent()
+                    # don't log the RTC time sync command
+                    if "time" not in command:
+                        logging.debug(f"PC -> Pico: {command}")
         except serial.SerialException as e:
             self.disconnect_pico(False)
             logging.error(f"Error: {e}")
@@ -929,10 +1003,15 @@ class PicoController:
     def send_command_as(self):
         try:
             if self.serial_port_as and not self.send_command_queue_as.empty():
-                command = self.send_command_queue_as.get(block=False)
-                self.serial_port_as.write(f"{command}\n".encode())
-                if "time" not in command:
-                    logging.debug(f"PC -> Autosampler: {command}")
+                commands, payload = self.send_command_queue_as.get_burst(
+                    self.max_burst_bytes
+                )
+                self.serial_port_as.write(payload)
+                for command in commands:
+                    if command == "time":
+                        self.autosampler_clock.query_sent()
+                    if "time" not in command:
+                        logging.debug(f"PC -> Autosampler: {command}")
         except serial.SerialException as e:
             self.disconnect_pico_as(False)
             logging.error(f"Error: {e}")
@@ -946,32 +1025,14 @@ class PicoController:
                 "Error", f"Send_command_as: An error occurred: {e}"
             )
 
+    # read_serial dispatches every complete line waiting on the port in one pass
     def read_serial(self):
         try:
             if self.serial_port and self.serial_port.in_waiting:
-                response = self.serial_port.readline().decode("utf-8").strip()
-                # don't log the RTC time response
-                if "RTC Time" not in response:
-                    logging.debug(f"Pico -> PC: {response}")
-
-                if "Info" in response:
-                    self.add_pump_widgets(response)
-                elif "Ping" in response:
-                    if "Pump" not in response:
-                        # we connect to the wrong device
-                        self.non_blocking_messagebox(
-                            "Connection Error",
-                            "Connected to the wrong device. Please reconnect to continue.",
-                        )
-                        self.disconnect_pico(False)
-                elif "Status" in response:
-                    self.update_pump_status(response)
-                elif "RTC Time" in response:
-                    self.update_rtc_time_display(response)
-                elif "Success" in response:
-                    self.non_blocking_messagebox("Success", response)
-                elif "Error" in response:
-                    self.non_blocking_messagebox("Error", response)
+                for kind, value, response, size in self.reply_reader.read_replies():
+                    self.handle_reply(kind, value, response, size)
+                    if not self.serial_port:  # a response made us disconnect
+                        break
         except serial.SerialException as e:
             self.disconnect_pico(False)
             logging.error(f"Error: {e}")
@@ -986,48 +1047,47 @@ class PicoController:
                 "Error", f"Read_serial: An error occurred: {e}"
             )
 
+    # size is the number of bytes the reply took on the link, the polls are budgeted by it
+    def handle_reply(self, kind, value, response, size):
+        # don't log the RTC time response
+        if kind != "rtc_time":
+            logging.debug(f"Pico -> PC: {response}")
+
+        if kind == "pump_info":
+            self.pump_polling.result("0:info", value != self.last_pump_info, size)
+            self.last_pump_info = value
+            self.add_pump_widgets(value)
+        elif kind == "ping":
+            if "Pump" not in value:
+                # we connect to the wrong device
+                self.non_blocking_messagebox(
+                    "Connection Error",
+                    "Connected to the wrong device. Please reconnect to continue.",
+                )
+                self.disconnect_pico(False)
+            elif supports_binary(value):
+                # the Pico can send compact binary replies, switch to them
+                self.send_command_queue.put(BINARY_COMMAND)
+        elif kind == "pump_status":
+            changed = self.update_pump_status(value)
+            self.pump_polling.result("0:st", changed, size)
+        elif kind == "rtc_time":
+            self.pump_clock.add_sample(value)
+        elif kind == "success":
+            if value == BINARY_ACK:
+                logging.info("Binary protocol enabled")
+            else:
+                self.non_blocking_messagebox("Success", value)
+        elif kind == "error":
+            self.non_blocking_messagebox("Error", value)
+
     def read_serial_as(self):
         try:
             if self.serial_port_as and self.serial_port_as.in_waiting:
-                response = self.serial_port_as.readline().decode("utf-8").strip()
-
-                if "RTC Time" not in response:
-                    logging.debug(f"Autosampler -> PC: {response}")
-
-                if "Autosampler Configuration:" in response:
-                    # Extract the JSON part of the response
-                    config_str = response.replace(
-                        "Autosampler Configuration:", ""
-                    ).strip()
-                    try:
-                        autosampler_config = json.loads(config_str)
-                        slots = list(autosampler_config.keys())
-                        slots.sort()
-                        self.slot_combobox_as["values"] = slots
-                        if slots:
-                            self.slot_combobox_as.current(
-                                0
-                            )  # Set the first slot as default
-                        logging.info(f"Slots populated: {slots}")
-                    except json.JSONDecodeError as e:
-                        logging.error(f"Error decoding autosampler configuration: {e}")
-                        self.non_blocking_messagebox(
-                            "Error", "Failed to decode autosampler configuration."
-                        )
-                elif "Ping" in response:
-                    if "Autosampler" not in response:
-                        self.non_blocking_messagebox(
-                            "Connection Error",
-                            "Connected to the wrong device. Please reconnect to continue.",
-                        )
-                        self.disconnect_pico_as()
-                elif "RTC Time" in response:
-                    self.update_rtc_time_display(response, is_Autosampler=True)
-                elif "Error" in response:
-                    self.non_blocking_messagebox("Error", response)
-                elif "Success" in response:
-                    self.non_blocking_messagebox("Success", response)
-
+                for response in self.line_reader_as.read_lines():
+                    self.handle_response_as(response)
+                    if not self.serial_port_as:  # a response made us disconnect
+                        break
         except serial.SerialException as e:
             self.disconnect_pico_as(False)
             logging.error(f"Error: {e}")
@@ -1042,6 +1102,42 @@ class PicoController:
                 "Error", f"Read_serial_as: An error occurred: {e}"
             )
 
+    def handle_response_as(self, response):
+        if "RTC Time" not in response:
+            logging.debug(f"Autosampler -> PC: {response}")
+
+        kind, value = AUTOSAMPLER_RESPONSES.parse(response)
+        if kind == "config":
+            if value is not None:
+                self.autosampler_polling.result(
+                    "config", value != self.last_slots_configuration, len(response) + 1
+                )
+                self.last_slots_configuration = value
+                slots = list(value.keys())
+                slots.sort()
+                self.slot_combobox_as["values"] = slots
+                if slots:
+                    self.slot_combobox_as.current(0)  # Set the first slot as default
+                logging.info(f"Slots populated: {slots}")
+            else:
+                logging.error(f"Error decoding autosampler configuration: {response}")
+                self.non_blocking_messagebox(
+                    "Error", "Failed to decode autosampler configuration."
+                )
+        elif kind == "ping":
+            if "Autosampler" not in value:
+                self.non_blocking_messagebox(
+                    "Connection Error",
+                    "Connected to the wrong device. Please reconnect to continue.",
+                )
+                self.disconnect_pico_as()
+        elif kind == "rtc_time":
+            self.autosampler_clock.add_sample(value)
+        elif kind == "error":
+            self.non_blocking_messagebox("Error", value)
+        elif kind == "success":
+            self.non_blocking_messagebox("Success", value)
+
     def goto_position_as(self, position=None):
         if self.serial_port_as:
             try:
@@ -1071,26 +1167,16 @@ class PicoController:
                 logging.error(f"Error: {e}")
                 self.non_blocking_messagebox("Error", f"An error occurred: {e}")
 
-    def add_pump_widgets(self, response):
+    def add_pump_widgets(self, pumps_info):
         try:
-            info_pattern = re.compile(
-                r"Pump(\d+) Info: Power Pin: (-?\d+), Direction Pin: (-?\d+), Initial Power Pin Value: (\d+), Initial Direction Pin Value: (\d+), Current Power Status: (ON|OFF), Current Direction Status: (CW|CCW)"
-            )
-            matches = info_pattern.findall(response)
-            # sort the matches by pump_id in ascending order
-            matches = sorted(matches, key=lambda x: int(x[0]))
-
-            for match in matches:
-                (
-                    pump_id,
-                    power_pin,
-                    direction_pin,
-                    initial_power_pin_value,
-                    initial_direction_pin_value,
-                    power_status,
-                    direction_status,
-                ) = match
-                pump_id = int(pump_id)
+            # pumps_info is sorted by pump_id in ascending order
+            for pump_id, info in pumps_info.items():
+                power_pin = info["power_pin"]
+                direction_pin = info["direction_pin"]
+                initial_power_pin_value = info["initial_power_pin_value"]
+                initial_direction_pin_value = info["initial_direction_pin_value"]
+                power_status = info["power_status"]
+                direction_status = info["direction_status"]
                 if pump_id in self.pumps:
                     self.pumps[pump_id].update(
                         {
@@ -1119,10 +1205,10 @@ class PicoController:
                         text=f"Direction Status: {direction_status}"
                     )
                     self.pumps[pump_id]["power_button"].config(
-                        state="normal" if power_pin != "-1" else "disabled"
+                        state="normal" if power_pin != -1 else "disabled"
                     )
                     self.pumps[pump_id]["direction_button"].config(
-                        state="normal" if direction_pin != "-1" else "disabled"
+                        state="normal" if direction_pin != -1 else "disabled"
                     )
                     self.pumps[pump_id]["frame"].config(
                         text=f"Pump {pump_id}, Power pin: {power_pin}, Direction pin: {direction_pin}"
@@ -1169,7 +1255,7 @@ class PicoController:
                         pump_frame,
                         text="Toggle Power",
                         command=lambda pid=pump_id: self.toggle_power(pid),
-                        state="disabled" if power_pin == "-1" else "normal",
+                        state="disabled" if power_pin == -1 else "normal",
                     )
                     power_button.grid(
                         row=1,
@@ -1182,7 +1268,7 @@ class PicoController:
                         pump_frame,
                         text="Toggle Direction",
                         command=lambda pid=pump_id: self.toggle_direction(pid),
-                        state="disabled" if direction_pin == "-1" else "normal",
+                        state="disabled" if direction_pin == -1 else "normal",
                     )
                     direction_button.grid(
                         row=1,
@@ -1253,16 +1339,15 @@ class PicoController:
         )
         self.pumps.clear()
 
-    def update_pump_status(self, response):
-        status_pattern = re.compile(
-            r"Pump(\d+) Status: Power: (ON|OFF), Direction: (CW|CCW)"
-        )
-        matches = status_pattern.findall(response)
-
-        for match in matches:
-            pump_id, power_status, direction_status = match
-            pump_id = int(pump_id)
+    def update_pump_status(self, pumps_status):
+        """Show the parsed pump status, returns True if any pump changed."""
+        changed = False
+        for pump_id, (power_status, direction_status) in pumps_status.items():
             if pump_id in self.pumps:
+                changed = changed or (
+                    self.pumps[pump_id]["power_status"],
+                    self.pumps[pump_id]["direction_status"],
+                ) != (power_status, direction_status)
                 self.pumps[pump_id]["power_status"] = power_status
                 self.pumps[pump_id]["direction_status"] = direction_status
                 self.pumps[pump_id]["power_label"].config(
@@ -1279,6 +1364,8 @@ class PicoController:
                 logging.error(
                     f"We received a status update for a pump that does not exist: {pump_id}"
                 )
+                changed = True
+        return changed
 
     def load_recipe(self):
         file_path = filedialog.askopenfilename(
@@ -1292,121 +1379,32 @@ class PicoController:
                 self.stop_procedure()
                 # clear the recipe table
                 self.clear_recipe()
-                if file_path.endswith(".csv"):
-                    self.recipe_df = pd.read_csv(
-                        file_path, header=None, keep_default_na=False, dtype=object
-                    )
-                elif file_path.endswith(".xlsx") or file_path.endswith(".xls"):
-                    self.recipe_df = pd.read_excel(
-                        file_path, header=None, keep_default_na=False, dtype=object
-                    )
-                elif file_path.endswith(".pkl"):
-                    self.recipe_df = pd.read_pickle(file_path, compression=None)
-                elif file_path.endswith(".json"):
-                    self.recipe_df = pd.read_json(file_path, dtype=False)
+                # only CSV files can be parsed a chunk at a time
+                if (
+                    file_path.endswith(".csv")
+                    and os.path.getsize(file_path) > STREAMED_RECIPE_BYTES
+                ):
+                    # only the first chunk is read now, the rest as the procedure runs
+                    self.recipe_plan = RecipeStream(file_path)
+                    columns = list(self.recipe_plan.columns)
                 else:
-                    raise ValueError("Unsupported file format.")
-
-                # Clean the data frame
-                # Search for any cell containing the keyword "time"
-                time_cells = [
-                    (row_idx, col_idx, cell)
-                    for row_idx, row in self.recipe_df.iterrows()
-                    for col_idx, cell in enumerate(row)
-                    if isinstance(cell, str) and "time" in cell.lower()
-                ]
-                # we need at least one "time" cell as the anchor
-                if len(time_cells) == 0:
-                    raise ValueError("No cell containing the keyword 'time'.")
-                elif len(time_cells) == 1:
-                    # if we only have one "time" cell, we use it as the anchor
-                    time_row_idx, time_col_idx, _ = time_cells[0]
-                elif len(time_cells) > 1:
-                    # Filter to choose the most relevant "Time (min)" cell as the anchor
-                    relevant_time_cells = [
-                        cell
-                        for cell in time_cells
-                        if "time (min)" in cell[2].lower()
-                        or "time point (min)" in cell[2].lower()
-                    ]
-                    if len(relevant_time_cells) == 0:
-                        raise ValueError(
-                            "Multiple cell containing the keyword 'time' found, but none of them contain 'Time (min)' or 'Time point (min)'."
-                        )
-                    elif len(relevant_time_cells) > 1:
-                        raise ValueError(
-                            "Multiple cell containing the keyword 'time' found, multiple of them contain 'Time (min)' or 'Time point (min)'."
-                        )
-                    # Choose the first relevant "Time (min)" cell as the primary one
-                    time_row_idx, time_col_idx, _ = relevant_time_cells[0]
-
-                # Trim the DataFrame
-                self.recipe_df = self.recipe_df.iloc[time_row_idx:, time_col_idx:]
-                # Set the first row as column names
-                self.recipe_df.columns = self.recipe_df.iloc[0]
-                # Remove the first row
-                self.recipe_df = self.recipe_df[1:].reset_index(drop=True)
-
-                # drop rows where "Time point (min)" column has NaN
-                self.recipe_df.dropna(subset=[self.recipe_df.columns[0]], inplace=True)
-                # drop rows where "Time point (min)" column is empty
-                self.recipe_df = self.recipe_df[self.recipe_df.iloc[:, 0] != ""]
-
-                self.recipe_df[self.recipe_df.columns[0]] = self.recipe_df[
-                    self.recipe_df.columns[0]
-                ].apply(float)
-
-                # check if the time points are in ascending order
-                if not self.recipe_df[
-                    self.recipe_df.columns[0]
-                ].is_monotonic_increasing:
-                    raise ValueError(
-                        "Time points are required in monotonically increasing order."
-                    )
-
-                # check if there is duplicate time points
-                if self.recipe_df[self.recipe_df.columns[0]].duplicated().any():
-                    raise ValueError("Duplicate time points are not allowed.")
+                    # read the sheet and cut out the recipe table below the time anchor
+                    self.recipe_df = load_recipe(file_path)
+                    self.recipe_plan = compile_recipe(self.recipe_df)
+                    columns = list(self.recipe_df.columns)
 
                 # Setup the table to display the data
-                columns = list(self.recipe_df.columns) + [
-                    "Progress Bar",
-                    "Remaining Time",
-                ]
-                self.recipe_table = ttk.Treeview(
-                    self.recipe_table_frame, columns=columns, show="headings"
-                )
-
-                # Create a scrollbar
-                self.scrollbar = ttk.Scrollbar(
+                columns += ["Progress Bar", "Remaining Time"]
+                # only the rows in view exist as widgets, filled by recipe_table_rows
+                self.recipe_table = VirtualTable(
                     self.recipe_table_frame,
-                    orient="vertical",
-                    command=self.recipe_table.yview,
+                    columns,
+                    self.recipe_table_rows,
+                    len(self.recipe_plan),
                 )
-                self.recipe_table.configure(yscrollcommand=self.scrollbar.set)
-                self.scrollbar.grid(row=0, column=1, sticky="NS")
-
                 self.recipe_table.grid(
                     row=0, column=0, padx=global_pad_x, pady=global_pad_y, sticky="NSEW"
                 )
-                for col in columns:
-                    self.recipe_table.heading(col, text=col)
-                    self.recipe_table.column(col, width=100, anchor="center")
-
-                for index, row in self.recipe_df.iterrows():
-                    # Convert all cells to strings, preserving precision for numbers
-                    values = [
-                        (
-                            f"{cell:.15g}"
-                            if isinstance(cell, (float, Decimal))
-                            else str(cell)
-                        )
-                        for cell in row
-                    ]
-                    self.recipe_table.insert("", "end", values=values)
-                    self.recipe_rows.append(
-                        (index, self.recipe_table.get_children()[-1])
-                    )
 
                 # Double width for the notes column if it exists
                 if "Notes" in columns:
@@ -1427,16 +1425,54 @@ class PicoController:
                 )
                 logging.error(f"Error: {e}")
 
+    # the values of the recipe rows start to end - 1 as shown in the recipe table
+    def recipe_table_rows(self, start, end):
+        if isinstance(self.recipe_plan, RecipeStream):
+            rows = self.recipe_plan.format_rows(start, end)
+        else:
+            rows = format_rows(self.recipe_df, start, end)
+        for index, values in enumerate(rows, start=start):
+            progress = (
+                self.progress_tracker.shown(index) if self.progress_tracker else None
+            )
+            if progress is None:
+                values += ["", ""]
+            else:
+                values += [
+                    f"{progress.percent}%",
+                    f"{self.convert_ns_to_timestr(progress.remaining_ns)}",
+                ]
+        return rows
+
+    # a streamed recipe learns its length and end time while it is read
+    def update_recipe_stream(self):
+        stream = self.recipe_plan
+        if not isinstance(stream, RecipeStream):
+            return
+        if isinstance(self.recipe_table, VirtualTable):
+            self.recipe_table.set_row_count(len(stream))
+        # the end is known once a run read the file to the end, until then the last row read
+        total_ns = stream.total_ns
+        if total_ns is None:
+            total_ns = stream.deadlines_ns[-1]
+        # only while a procedure runs, the total time also marks it as started
+        if (
+            self.start_time_ns != -1
+            and self.progress_tracker is not None
+            and self.progress_tracker.total_ns != total_ns
+        ):
+            self.progress_tracker.total_ns = total_ns
+            self.total_procedure_time_ns = total_ns
+
     # a function to clear the recipe table
     def clear_recipe(self):
         try:
             # clear the recipe table
             self.recipe_df = None
-            self.recipe_rows = []
-            # destroy the recipe table
+            self.recipe_plan = None
+            self.progress_tracker = None
+            # destroy the recipe table, its scrollbar goes with it
             self.recipe_table.destroy()
-            # destroy the scrollbar
-            self.scrollbar.destroy()
             # recreate the recipe table
             self.recipe_table = ttk.Frame(self.recipe_table_frame)
             self.recipe_table.grid(
@@ -1457,9 +1493,15 @@ class PicoController:
             self.non_blocking_messagebox("Error", f"An error occurred: {e}")
 
     def start_procedure(self):
-        if self.recipe_df is None or self.recipe_df.empty:
+        if self.recipe_plan is None or len(self.recipe_plan) == 0:
             logging.error("No recipe data to execute.")
             return
+        # an earlier run of a streamed recipe found an error further down the file
+        if getattr(self.recipe_plan, "error", None) is not None:
+            self.non_blocking_messagebox(
+                "Error", f"The recipe file is invalid: {self.recipe_plan.error}"
+            )
+            return
         # require at least one MCU connection
         if not self.serial_port and not self.serial_port_as:
             self.non_blocking_messagebox(
@@ -1487,175 +1529,112 @@ class PicoController:
             # clear the stop time and pause time
             self.pause_timepoint_ns = -1
 
-            # cancel the scheduled task if it exists
-            if self.scheduled_task:
-                self.master.after_cancel(self.scheduled_task)
-                self.scheduled_task = None
-
-            # calculate the total procedure time
-            self.total_procedure_time_ns = self.convert_minutes_to_ns(
-                float(self.recipe_df["Time point (min)"].max())
-            )
+            # drop the steps of a previous run
+            self.procedure_scheduler.cancel()
 
             # clear the "Progress Bar" and "Remaining Time" columns in the recipe table
-            for i, child in self.recipe_rows:
-                self.recipe_table.set(child, "Progress Bar", "")
-                self.recipe_table.set(child, "Remaining Time", "")
+            self.progress_tracker = ProgressTracker(self.recipe_plan.deadlines_ns)
+            # calculate the total procedure time, a streamed recipe may not know it yet
+            if self.recipe_plan.total_ns is not None:
+                self.progress_tracker.total_ns = self.recipe_plan.total_ns
+            self.total_procedure_time_ns = self.progress_tracker.total_ns
+            self.recipe_table.refresh_rows(0, len(self.recipe_plan))
 
             # record start time
             self.start_time_ns = time.monotonic_ns() - self.pause_duration_ns
             self.current_index = 0
-            self.execute_procedure()
+            # poll at the procedure cadence until it ends
+            self.pump_polling.set_active(True)
+            self.autosampler_polling.set_active(True)
+            # deadline 0 is the start time plus the pauses so far, like the elapsed time
+            self.procedure_scheduler.start(
+                self.recipe_plan.steps(),
+                self.start_time_ns + self.pause_duration_ns,
+            )
         except Exception as e:
             # stop the procedure if an error occurs
             self.stop_procedure()
             logging.error(f"Error: {e}")
             self.non_blocking_messagebox("Error", f"An error occurred: {e}")
 
-    def execute_procedure(self, index=0):
-        if self.recipe_df is None or self.recipe_df.empty:
-            self.non_blocking_messagebox("Error", "No recipe file loaded.")
-            logging.error("No recipe data to execute.")
+    # called by the procedure scheduler on its own thread when the deadline of a step has come
+    def execute_procedure(self, index):
+        plan = self.recipe_plan
+        if plan is None or index >= len(plan):
             return
+        self.current_index = index
+        logging.info(f"executing step at index {index}")
 
-        try:
-            if index >= len(self.recipe_df):
-                # update progress bar and remaining time
-                self.update_progress()
-                self.start_time_ns = -1
-                self.total_procedure_time_ns = -1
-                self.current_index = -1
-                # call a emergency shutdown in case the power is still on
-                self.emergency_shutdown()
-                logging.info("Procedure completed.")
-                self.non_blocking_messagebox(
-                    "Procedure Complete", "The procedure has been completed."
-                )
-                # disable the stop button
-                self.stop_button.config(state=tk.DISABLED)
-                self.pause_button.config(state=tk.DISABLED)
-                self.continue_button.config(state=tk.DISABLED)
-                return
-
-            self.current_index = index
-            row = self.recipe_df.iloc[index]
-            target_time_ns = self.convert_minutes_to_ns(float(row["Time point (min)"]))
+        # issue a one-time status update
+        self.update_status()
+        self.execute_actions(plan, index)
+        # check_procedure finishes the procedure on the Tk thread after the last step
+        self.current_index = index + 1
 
-            elapsed_time_ns = (
-                time.monotonic_ns() - self.start_time_ns - self.pause_duration_ns
+    def check_procedure(self):
+        if (
+            self.start_time_ns == -1
+            or self.recipe_plan is None
+            or not self.procedure_scheduler.done()
+        ):
+            return
+        if self.procedure_scheduler.error is not None:
+            # a streamed recipe turned out to be broken further down
+            self.stop_procedure()
+            self.non_blocking_messagebox(
+                "Error",
+                f"The procedure was stopped, the recipe file is invalid: {self.procedure_scheduler.error}",
             )
-            # calculate the remaining time for the current step
-            current_step_remaining_time_ns = target_time_ns - elapsed_time_ns
-
-            # If there is time remaining, sleep for half of the remaining time
-            if current_step_remaining_time_ns > 0:
-                intended_sleep_time_ms = max(
-                    100,
-                    current_step_remaining_time_ns // 2 // NANOSECONDS_PER_MILLISECOND,
-                )
-                # convert from nanoseconds to milliseconds
-                self.scheduled_task = self.master.after(
-                    int(intended_sleep_time_ms),
-                    self.execute_procedure,
-                    index,
-                )
-                return
-
-            logging.info(f"executing step at index {index}")
-
-            # Parse pump and valve actions dynamically
-            pump_actions = {
-                col: row[col] for col in row.index if col.startswith("Pump")
-            }
-            valve_actions = {
-                col: row[col] for col in row.index if col.startswith("Valve")
-            }
-            auto_sampler_actions_slots = {
-                col: row[col] for col in row.index if col.startswith("Autosampler_slot")
-            }
-            auto_sampler_actions_positions = {
-                col: row[col]
-                for col in row.index
-                if col.startswith("Autosampler_position")
-            }
-
-            # issue a one-time status update
-            self.update_status()
-            self.execute_actions(
-                index,
-                pump_actions,
-                valve_actions,
-                auto_sampler_actions_slots,
-                auto_sampler_actions_positions,
+            return
+        try:
+            # update progress bar and remaining time
+            self.update_progress(force=True)
+            self.start_time_ns = -1
+            self.total_procedure_time_ns = -1
+            self.current_index = -1
+            self.pump_polling.set_active(False)
+            self.autosampler_polling.set_active(False)
+            # call a emergency shutdown in case the power is still on
+            self.emergency_shutdown()
+            logging.info(
+                f"Procedure completed, step lateness: {self.procedure_scheduler.lateness_summary()}"
+            )
+            self.non_blocking_messagebox(
+                "Procedure Complete", "The procedure has been completed."
             )
+            # disable the stop button
+            self.stop_button.config(state=tk.DISABLED)
+            self.pause_button.config(state=tk.DISABLED)
+            self.continue_button.config(state=tk.DISABLED)
         except Exception as e:
             logging.error(f"Error: {e}")
             self.non_blocking_messagebox("Error", f"An error occurred: {e}")
 
-    def execute_actions(
-        self,
-        index,
-        pump_actions,
-        valve_actions,
-        auto_sampler_actions_slots,
-        auto_sampler_actions_positions,
-    ):
-        for pump, action in pump_actions.items():
-            if pd.isna(action) or action == "":
-                continue
-            match = re.search(r"\d+", pump)
-            if match:
-                pump_id = int(match.group())
-                if (
-                    pump_id in self.pumps
-                    and action.lower() != self.pumps[pump_id]["power_status"].lower()
-                ):
-                    logging.debug(
-                        f"At index {index}, pump_id {pump_id} status: {self.pumps[pump_id]['power_status']}, intended status: {action}, toggling power."
-                    )
-                    self.toggle_power(pump_id, update_status=False)
-
-        for valve, action in valve_actions.items():
-            if pd.isna(action) or action == "":
-                continue
-            match = re.search(r"\d+", valve)
-            if match:
-                valve_id = int(match.group())
+    def execute_actions(self, plan, index):
+        # a pump or valve is only toggled if its live status differs from the target
+        for kind, pump_id, state, command in plan.actions(index):
+            if kind == POWER or kind == DIRECTION:
+                status_key = "power_status" if kind == POWER else "direction_status"
                 if (
-                    valve_id in self.pumps
-                    and action.upper()
-                    != self.pumps[valve_id]["direction_status"].upper()
+                    self.serial_port
+                    and pump_id in self.pumps
+                    and state != self.pumps[pump_id][status_key].upper()
                 ):
                     logging.debug(
-                        f"At index {index}, valve_id {valve_id} status: {self.pumps[valve_id]['direction_status']}, intended status: {action}, toggling direction."
+                        f"At index {index}, pump_id {pump_id} {status_key}: {self.pumps[pump_id][status_key]}, intended status: {state}, sending {command}."
                     )
-                    self.toggle_direction(valve_id, update_status=False)
-
-        for _, slot in auto_sampler_actions_slots.items():
-            if pd.isna(slot) or slot == "":
-                continue
-            self.goto_slot_as(str(slot))
-
-        for _, position in auto_sampler_actions_positions.items():
-            if pd.isna(position) or position == "":
-                continue
-            # check if the position is a number
-            if position.isdigit():
-                self.goto_position_as(int(position))
-            else:
-                logging.error(
-                    f"Warning: Invalid autosampler position: {position} at index {index}"
-                )
+                    self.send_command_queue.put(command)
+            elif self.serial_port_as:
+                self.send_command_queue_as.put(command)
+                logging.info(f"Autosampler command sent: {command}")
 
         # issue a one-time status update
         self.update_status()
-        self.execute_procedure(index + 1)
 
-    def update_progress(self):
+    def update_progress(self, force=False):
         if (
             self.total_procedure_time_ns == -1  # Check if not started
-            or self.recipe_df is None
-            or self.recipe_df.empty
+            or self.progress_tracker is None
             or self.pause_timepoint_ns != -1  # Check if paused
         ):
             return
@@ -1663,74 +1642,27 @@ class PicoController:
         elapsed_time_ns = (
             time.monotonic_ns() - self.start_time_ns - self.pause_duration_ns
         )
-        # Handle total_procedure_time_ns being zero
-        if self.total_procedure_time_ns <= 0:
-            total_progress = 100
-            remaining_time_ns = 0
-        else:
-            total_progress = min(
-                100, (elapsed_time_ns / self.total_procedure_time_ns) * 100
-            )
-            remaining_time_ns = max(
-                0,
-                self.total_procedure_time_ns - elapsed_time_ns,
-            )
-
-        self.total_progress_bar["value"] = int(total_progress)
-        self.remaining_time_value.config(
-            text=f"{self.convert_ns_to_timestr(int(remaining_time_ns))}"
-        )
-        end_time = datetime.now() + timedelta(
-            seconds=remaining_time_ns / NANOSECONDS_PER_SECOND
-        )
-        formatted_end_time = end_time.strftime("%Y-%m-%d %a %H:%M:%S")
-        self.end_time_value.config(text=f"{formatted_end_time}")
+        # None until the display resolution has passed since the last refresh
+        changes = self.progress_tracker.refresh(elapsed_time_ns, force)
+        if changes is None:
+            return
+        total, rows = changes
 
-        # Update the recipe table with individual progress and remaining time
-        for i, child in self.recipe_rows:
-            time_stamp_ns = self.convert_minutes_to_ns(
-                float(self.recipe_df.iloc[i]["Time point (min)"])
+        if total is not None:
+            total_progress, remaining_time_ns = total
+            self.total_progress_bar["value"] = total_progress
+            self.remaining_time_value.config(
+                text=f"{self.convert_ns_to_timestr(remaining_time_ns)}"
             )
+            end_time = datetime.now() + timedelta(
+                seconds=remaining_time_ns / NANOSECONDS_PER_SECOND
+            )
+            formatted_end_time = end_time.strftime("%Y-%m-%d %a %H:%M:%S")
+            self.end_time_value.config(text=f"{formatted_end_time}")
 
-            # if the time stamp is in the future, break the loop
-            if elapsed_time_ns < time_stamp_ns:
-                break
-            else:
-                # Calculate progress for each step
-                if i < len(self.recipe_df) - 1:
-                    next_row = self.recipe_df.iloc[i + 1]
-                    next_time_stamp_ns = self.convert_minutes_to_ns(
-                        float(next_row["Time point (min)"])
-                    )
-                    time_interval = next_time_stamp_ns - time_stamp_ns
-                    if time_interval > 0:
-                        # handle the case where the next row has the same timestamp
-                        row_progress = int(
-                            min(
-                                100,
-                                ((elapsed_time_ns - time_stamp_ns) / time_interval)
-                                * 100,
-                            )
-                        )
-                        remaining_time_row_ns = max(
-                            0,
-                            next_time_stamp_ns - elapsed_time_ns,
-                        )
-                    else:
-                        # If the next row has the same timestamp, mark the progress as 100%
-                        row_progress = 100
-                        remaining_time_row_ns = 0
-                else:
-                    row_progress = 100
-                    remaining_time_row_ns = 0
-
-                # Update only the "Progress Bar" and "Remaining Time" columns
-                self.recipe_table.set(child, "Progress Bar", f"{row_progress}%")
-                self.recipe_table.set(
-                    child,
-                    "Remaining Time",
-                    f"{self.convert_ns_to_timestr(int(remaining_time_row_ns))}",
-                )
+        # Redraw only the rows whose progress or remaining time changed, if they are in view
+        if rows:
+            self.recipe_table.refresh_rows(rows[0].index, rows[-1].index + 1)
 
     def convert_minutes_to_ns(self, minutes: float) -> int:
         return int(minutes * 60 * NANOSECONDS_PER_SECOND)
@@ -1765,7 +1697,16 @@ class PicoController:
 
         pump_id = len(self.pumps) + 1
         self.add_pump_widgets(
-            f"Pump{pump_id} Info: Power Pin: -1, Direction Pin: -1, Initial Power Pin Value: 0, Initial Direction Pin Value: 0, Current Power Status: OFF, Current Direction Status: CCW"
+            {
+                pump_id: {
+                    "power_pin": -1,
+                    "direction_pin": -1,
+                    "initial_power_pin_value": 0,
+                    "initial_direction_pin_value": 0,
+                    "power_status": "OFF",
+                    "direction_status": "CCW",
+                }
+            }
         )
 
     def edit_pump(self, pump_id):
@@ -1867,6 +1808,7 @@ class PicoController:
             icon.stop()
         # stop the procedure if it is running
         self.stop_procedure()
+        self.procedure_scheduler.stop()
         # close the serial ports
         if self.serial_port:
             self.disconnect_pico()